@@ -1,5 +1,6 @@
-import json
 import time
+_BOOT_STARTED = time.perf_counter() # Cold-start timing reference, taken before the heavy imports
+import json
 import random
 import re
 import os
@@ -17,11 +18,18 @@ from telegram.ext import (
 import math
 from collections import defaultdict # Ensure this is imported
 import itertools # Add this import for combination generation
+import functools # For wrapping handlers with instrumentation
+import operator
+import copy
+import hashlib
+import zlib
+import logging
+import contextvars # Per-update request ID for log correlation
 import html # <--- ADD THIS IMPORT at the top of your bot.py file
 from telegram.constants import ParseMode
-# Firebase Imports
-import firebase_admin
-from firebase_admin import credentials, db
+from telegram.error import Forbidden, RetryAfter
+# Firebase is reached through FirebaseRestClient; httpx and google.auth are imported lazily
+# inside it to keep them off the import-time critical path.
 current_admin_matches = {} # Dictionary to store matches accessible by /matchX commands
 # === CONFIG ===
 BOT_TOKEN = os.environ.get("BOT_TOKEN")
@@ -32,8 +40,65 @@ ADMIN_ID = int(os.environ.get("ADMIN_ID", 7366894756)) # Default a placeholder I
 FIREBASE_SERVICE_ACCOUNT_B64 = os.environ.get("FIREBASE_SERVICE_ACCOUNT_B64")
 FIREBASE_DATABASE_URL = os.environ.get("FIREBASE_DATABASE_URL")
 
-# Global Firebase DB reference
-firebase_db_ref = None
+# Global Firebase Realtime Database REST client (see FirebaseRestClient)
+firebase_client = None
+
+# === LOGGING ===
+# LOG_LEVEL sets the default level, LOG_LEVELS overrides it per logger,
+# e.g. LOG_LEVELS="bot.state=DEBUG,bot.handlers=WARNING,httpx=INFO".
+# LOG_FORMAT=json emits one JSON object per line for the platform log drain.
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.environ.get("LOG_LEVELS", "")
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text").lower()
+
+log = logging.getLogger("bot")                      # Startup and general wiring
+state_log = logging.getLogger("bot.state")          # Firebase reads/writes
+handler_log = logging.getLogger("bot.handlers")     # User-facing command handlers
+tournament_log = logging.getLogger("bot.tournament") # Draws, scoring and stage transitions
+metrics_log = logging.getLogger("bot.metrics")
+
+# Set per update by the handler wrapper, so every line logged while handling it can be correlated
+request_id_var = contextvars.ContextVar("request_id", default="-")
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+class JsonLogFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+def configure_logging():
+    """Installs the root handler. Called once from __main__."""
+    handler = logging.StreamHandler()
+    handler.addFilter(RequestIdFilter())
+    if LOG_FORMAT == "json":
+        formatter = JsonLogFormatter()
+        formatter.converter = time.gmtime
+        handler.setFormatter(formatter)
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"))
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(LOG_LEVEL)
+    # httpx logs every getUpdates long-poll at INFO; keep it quiet unless asked for
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    for override in filter(None, (part.strip() for part in LOG_LEVELS.split(","))):
+        name, _, level = override.partition("=")
+        if level:
+            logging.getLogger(name.strip()).setLevel(level.strip().upper())
 
 # FIFA World Cup style teams (32 teams)
 TEAM_LIST = [
@@ -49,13 +114,11 @@ TEAM_LIST = [
 
 # Conversation state for PES name entry
 REGISTER_PES = 1
+_MARKDOWN_V2_ESCAPE_RE = re.compile(r'([%s])' % re.escape(r'_*[]()~`>#+-=|{}.!'))
+
 def escape_markdown_v2(text: str) -> str:
     """Helper function to escape markdown v2 special characters."""
-    print(f"DEBUG: escape_markdown_v2 - Input: '{text}'") # Add this line
-    escape_chars = r'_*[]()~`>#+-=|{}.!'
-    escaped_text = re.sub(r'([%s])' % re.escape(escape_chars), r'\\\1', text)
-    print(f"DEBUG: escape_markdown_v2 - Output: '{escaped_text}'") # Add this line
-    return escaped_text
+    return _MARKDOWN_V2_ESCAPE_RE.sub(r'\\\1', text)
 from telegram import Update
 from telegram.ext import ContextTypes
 from telegram.constants import ParseMode # Make sure this is imported if not already
@@ -68,7 +131,7 @@ async def players_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Handles the /players command to list all registered players and their teams.
     """
-    players = load_state("players") # Assuming load_state function is available globally or imported
+    players = await load_player_index() # {id: {team, username}} projection, not the full records
 
     if not players:
         await update.message.reply_text("There are no registered players yet\\. Use /register to join\\!", 
@@ -119,86 +182,2151 @@ def get_player_display_name(player_info):
         return full_name
     else:
         return "Anonymous Player"
+
+# === METRICS ===
+# Latency histogram bucket upper bounds, in seconds (Prometheus style, cumulative on export)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_PORT = os.environ.get("METRICS_PORT") # Optional Prometheus text endpoint
+
+class MetricsRegistry:
+    """
+    In-process counters for handler calls and Firebase round-trips.
+    Series are keyed by (kind, name), e.g. ("handler", "fixtures") or ("state_read", "players").
+    """
+    def __init__(self):
+        self.started_at = time.time()
+        self.series = {}
+
+    def _get_series(self, kind, name):
+        series = self.series.get((kind, name))
+        if series is None:
+            series = {
+                "calls": 0,
+                "errors": 0,
+                "bytes": 0,
+                "seconds_sum": 0.0,
+                "buckets": [0] * (len(LATENCY_BUCKETS) + 1), # Last slot is +Inf
+            }
+            self.series[(kind, name)] = series
+        return series
+
+    def observe(self, kind, name, seconds, payload_bytes=0, error=False):
+        series = self._get_series(kind, name)
+        series["calls"] += 1
+        series["seconds_sum"] += seconds
+        series["bytes"] += payload_bytes
+        if error:
+            series["errors"] += 1
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                series["buckets"][i] += 1
+                break
+        else:
+            series["buckets"][-1] += 1
+
+    def quantile(self, series, q):
+        """Approximates a latency quantile (in seconds) from the histogram buckets."""
+        if not series["calls"]:
+            return 0.0
+        target = q * series["calls"]
+        running = 0
+        for i, count in enumerate(series["buckets"]):
+            running += count
+            if running >= target:
+                return LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else float("inf")
+        return float("inf")
+
+    def reset(self):
+        self.series.clear()
+        self.started_at = time.time()
+
+    def render_summary(self, kind=None, limit=15):
+        """Compact fixed-width table, most expensive series (by total time) first."""
+        rows = [
+            (k, n, s) for (k, n), s in self.series.items()
+            if kind is None or k == kind
+        ]
+        rows.sort(key=lambda row: row[2]["seconds_sum"], reverse=True)
+        lines = [f"{'name':<24} {'calls':>6} {'err':>4} {'avg_ms':>7} {'p95_ms':>7} {'kb':>7}"]
+        for k, name, s in rows[:limit]:
+            avg_ms = (s["seconds_sum"] / s["calls"] * 1000) if s["calls"] else 0.0
+            p95 = self.quantile(s, 0.95)
+            p95_ms = "inf" if p95 == float("inf") else f"{p95 * 1000:.0f}"
+            label = f"{k}:{name}"[:24]
+            lines.append(
+                f"{label:<24} {s['calls']:>6} {s['errors']:>4} {avg_ms:>7.1f} {p95_ms:>7} {s['bytes'] / 1024:>7.1f}"
+            )
+        return "\n".join(lines)
+
+    def render_prometheus(self):
+        """Prometheus text exposition format (version 0.0.4), one contiguous block per metric family."""
+        series = sorted(self.series.items())
+        out = [
+            "# HELP bot_uptime_seconds Seconds since the metrics registry was started.",
+            "# TYPE bot_uptime_seconds gauge",
+            f"bot_uptime_seconds {time.time() - self.started_at:.3f}",
+        ]
+        for family, field in (("bot_calls_total", "calls"), ("bot_errors_total", "errors"),
+                              ("bot_payload_bytes_total", "bytes")):
+            out.append(f"# TYPE {family} counter")
+            for (kind, name), s in series:
+                out.append(f'{family}{{kind="{kind}",name="{name}"}} {s[field]}')
+        out.append("# TYPE bot_latency_seconds histogram")
+        for (kind, name), s in series:
+            labels = f'kind="{kind}",name="{name}"'
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, s["buckets"]):
+                cumulative += count
+                out.append(f'bot_latency_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            cumulative += s["buckets"][-1]
+            out.append(f'bot_latency_seconds_bucket{{{labels},le="+Inf"}} {cumulative}')
+            out.append(f"bot_latency_seconds_sum{{{labels}}} {s['seconds_sum']:.6f}")
+            out.append(f"bot_latency_seconds_count{{{labels}}} {s['calls']}")
+        return "\n".join(out) + "\n"
+
+METRICS = MetricsRegistry()
+
+def _payload_size(data):
+    """Approximate JSON wire size of a Firebase payload, in bytes."""
+    if data is None:
+        return 0
+    try:
+        return len(json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
+    except (TypeError, ValueError):
+        return 0
+
+def instrument_handler(callback, name=None):
+    """Wraps a PTB handler callback so every invocation is timed, counted and tagged with a request ID."""
+    if getattr(callback, "_instrumented", False):
+        return callback
+    series_name = name or getattr(callback, "__name__", "handler")
+
+    @functools.wraps(callback)
+    async def wrapper(update, context, *args, **kwargs):
+        token = request_id_var.set(str(getattr(update, "update_id", None) or f"local-{id(update):x}"))
+        start_time = time.perf_counter()
+        failed = False
+        try:
+            if series_name in PROFILER.armed:
+                return await PROFILER.run(series_name, callback, update, context, *args, **kwargs)
+            return await callback(update, context, *args, **kwargs)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            METRICS.observe("handler", series_name, time.perf_counter() - start_time, error=failed)
+            request_id_var.reset(token)
+
+    wrapper._instrumented = True
+    return wrapper
+
+def instrument_application_handlers(app_instance) -> None:
+    """Wraps every registered handler callback, including those nested in ConversationHandlers."""
+    def _wrap(handler):
+        if isinstance(handler, ConversationHandler):
+            for nested in handler.entry_points + handler.fallbacks:
+                _wrap(nested)
+            for state_handlers in handler.states.values():
+                for nested in state_handlers:
+                    _wrap(nested)
+            return
+        handler.callback = instrument_handler(handler.callback)
+        # Let /profile accept either the command ("standings") or the callback name ("group_standings")
+        HANDLER_NAMES_BY_COMMAND.setdefault(handler.callback.__name__, handler.callback.__name__)
+        for command in getattr(handler, "commands", ()):
+            HANDLER_NAMES_BY_COMMAND.setdefault(command, handler.callback.__name__)
+
+    for handlers_in_group in app_instance.handlers.values():
+        for handler in handlers_in_group:
+            _wrap(handler)
+
+async def metrics_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Admin-only /metrics [handler|state_read|state_write|reset].
+    Shows call counts, errors, latency and payload sizes since startup (or the last reset).
+    """
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("❌ Only the admin can view metrics.")
+        return
+
+    kind = context.args[0].lower() if context.args else None
+    if kind == "reset":
+        METRICS.reset()
+        await update.message.reply_text("✅ Metrics reset.")
+        return
+    if kind not in (None, "handler", "state_read", "state_write"):
+        await update.message.reply_text("⚠️ Usage: /metrics [handler|state_read|state_write|reset]")
+        return
+
+    uptime_minutes = (time.time() - METRICS.started_at) / 60
+    table = METRICS.render_summary(kind) + f"\n\nfirebase circuit: {FIREBASE_BREAKER.state} ({FIREBASE_BREAKER.failures} recent failures)"
+    # Inside a MarkdownV2 code block only ` and \ need escaping
+    table = table.replace("\\", "\\\\").replace("`", "\\`")
+    await update.message.reply_text(
+        f"📈 *Metrics* \\(last {escape_markdown_v2(f'{uptime_minutes:.0f}')} min\\)\n```\n{table}\n```",
+        parse_mode=ParseMode.MARKDOWN_V2
+    )
+
+async def _serve_prometheus(reader, writer):
+    """Minimal HTTP responder for Prometheus scrapes (GET /metrics)."""
+    try:
+        request_line = await reader.readline()
+        # Drain the request headers
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        if request_line.split(b" ")[1:2] == [b"/metrics"]:
+            body = METRICS.render_prometheus().encode("utf-8")
+            status = b"200 OK"
+        else:
+            body = b"not found\n"
+            status = b"404 Not Found"
+        writer.write(
+            b"HTTP/1.1 " + status + b"\r\n"
+            b"Content-Type: text/plain; version=0.0.4\r\n"
+            b"Content-Length: " + str(len(body)).encode() + b"\r\n"
+            b"Connection: close\r\n\r\n" + body
+        )
+        await writer.drain()
+    except Exception as e:
+        metrics_log.error("Error serving metrics request: %s", e)
+    finally:
+        writer.close()
+
+async def start_metrics_server():
+    """Starts the Prometheus endpoint when METRICS_PORT is set. Returns the server or None."""
+    if not METRICS_PORT:
+        return None
+    server = await asyncio.start_server(_serve_prometheus, host="0.0.0.0", port=int(METRICS_PORT))
+    metrics_log.info("Prometheus metrics endpoint listening on :%s/metrics", METRICS_PORT)
+    return server
+
+# === PROFILER ===
+PROFILE_TOP_N = 12 # Rows per section in a profile report
+HANDLER_NAMES_BY_COMMAND = {} # "standings" -> "group_standings", filled by instrument_application_handlers
+
+# Buckets for the "where did the time go" summary, matched against the profiled function's file path
+PROFILE_AREAS = (
+    ("auth", ("google",)), # Service-account token signing
+    ("telegram", ("telegram", "httpx", "httpcore", "anyio")),
+    ("asyncio", ("asyncio", "selectors")),
+)
+
+class HandlerProfiler:
+    """
+    Wraps the next N invocations of an armed handler with cProfile and tracemalloc,
+    accumulates the results and sends the admin a compact report after the last one.
+    """
+    def __init__(self):
+        self.armed = {}    # handler name -> remaining runs
+        self.sessions = {} # handler name -> {"stats", "allocations", "runs", "wall"}
+        self.reports = {}  # handler name -> last rendered report
+        self._active = False
+
+    def arm(self, name, runs):
+        self.armed[name] = runs
+        self.sessions[name] = {"stats": None, "allocations": defaultdict(int), "runs": 0, "wall": 0.0, "firebase_wall": 0.0}
+
+    def disarm(self, name):
+        self.armed.pop(name, None)
+        return self.sessions.pop(name, None)
+
+    async def run(self, name, callback, update, context, *args, **kwargs):
+        # cProfile hooks the whole thread, so only one invocation is profiled at a time;
+        # overlapping calls run normally and don't use up a profiling slot.
+        if self._active:
+            return await callback(update, context, *args, **kwargs)
+
+        import cProfile
+        import pstats
+        import tracemalloc
+
+        self._active = True
+        started_tracemalloc = not tracemalloc.is_tracing()
+        if started_tracemalloc:
+            tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        firebase_before = _firebase_seconds()
+        profile = cProfile.Profile()
+        start_time = time.perf_counter()
+        profile.enable()
+        try:
+            return await callback(update, context, *args, **kwargs)
+        finally:
+            profile.disable()
+            wall = time.perf_counter() - start_time
+            after = tracemalloc.take_snapshot()
+            if started_tracemalloc:
+                tracemalloc.stop()
+            self._active = False
+
+            session = self.sessions.get(name)
+            if session is not None:
+                if session["stats"] is None:
+                    session["stats"] = pstats.Stats(profile)
+                else:
+                    session["stats"].add(profile)
+                for diff in after.compare_to(before, "lineno"):
+                    if diff.size_diff > 0:
+                        frame = diff.traceback[0]
+                        session["allocations"][(frame.filename, frame.lineno)] += diff.size_diff
+                session["runs"] += 1
+                session["wall"] += wall
+                session["firebase_wall"] += _firebase_seconds() - firebase_before
+
+                self.armed[name] -= 1
+                if self.armed[name] <= 0:
+                    self.disarm(name)
+                    self.reports[name] = self.render(name, session)
+                    await self._send_report(context, self.reports[name])
+
+    @staticmethod
+    def _short_location(filename, lineno=None):
+        parts = filename.replace("\\", "/").split("/")
+        short = "/".join(parts[-2:]) if "site-packages" in filename else parts[-1]
+        return f"{short}:{lineno}" if lineno is not None else short
+
+    def render(self, name, session):
+        stats = session["stats"]
+        runs = session["runs"]
+        lines = [f"🔬 Profile: {name} ({runs} run{'s' if runs != 1 else ''}, avg {session['wall'] / max(runs, 1) * 1000:.1f} ms wall)"]
+        if stats is None:
+            return lines[0]
+
+        # Own time (tottime) per area, so Firebase vs Telegram vs our own code is visible at a glance
+        area_totals = defaultdict(float)
+        for (filename, _, _), (_, _, tottime, _, _) in stats.stats.items():
+            area = "bot" if filename.endswith("bot.py") else "other"
+            for area_name, markers in PROFILE_AREAS:
+                if any(f"/{marker}/" in filename or f"{marker}." in filename.rsplit("/", 1)[-1] for marker in markers):
+                    area = area_name
+                    break
+            area_totals[area] += tottime
+        total = sum(area_totals.values()) or 1.0
+        lines.append("")
+        lines.append("Time by area (own time):")
+        for area, seconds in sorted(area_totals.items(), key=lambda item: item[1], reverse=True):
+            lines.append(f"  {area:<9} {seconds / runs * 1000:8.1f} ms/run {seconds / total * 100:5.1f}%")
+        # Awaited HTTP time never shows up as own time, so take it from the state-layer metrics
+        lines.append(f"  Firebase round-trips (wall): {session['firebase_wall'] / runs * 1000:.1f} ms/run")
+
+        lines.append("")
+        lines.append(f"Top {PROFILE_TOP_N} by cumulative time (ms/run, calls/run):")
+        hotspots = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+        for (filename, lineno, func_name), (_, ncalls, _, cumtime, _) in hotspots[:PROFILE_TOP_N]:
+            location = self._short_location(filename, lineno)
+            lines.append(f"  {cumtime / runs * 1000:8.1f} {ncalls // runs:6d}  {func_name[:28]} ({location})")
+
+        allocations = sorted(session["allocations"].items(), key=lambda item: item[1], reverse=True)
+        if allocations:
+            lines.append("")
+            lines.append(f"Top {PROFILE_TOP_N} allocation sites (KiB/run):")
+            for (filename, lineno), size in allocations[:PROFILE_TOP_N]:
+                lines.append(f"  {size / runs / 1024:8.1f}  {self._short_location(filename, lineno)}")
+        return "\n".join(lines)
+
+    async def _send_report(self, context, report):
+        try:
+            # Plain text: report contains paths and symbols that would all need MarkdownV2 escaping
+            await context.bot.send_message(chat_id=ADMIN_ID, text=report[:4000])
+        except Exception as e:
+            metrics_log.error("Could not send profile report to admin: %s", e)
+
+PROFILER = HandlerProfiler()
+
+def _firebase_seconds():
+    return sum(series["seconds_sum"] for (kind, _), series in METRICS.series.items()
+               if kind in ("state_read", "state_write"))
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Admin-only profiling toggle:
+    /profile on <command> [runs] - profile the next N invocations (default 5)
+    /profile off <command>       - cancel and report whatever was collected
+    /profile report <command>    - resend the last report
+    /profile status              - list armed handlers
+    """
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("❌ Only the admin can use the profiler.")
+        return
+
+    usage = "⚠️ Usage: /profile on <command> [runs] | off <command> | report <command> | status"
+    args = context.args
+    action = args[0].lower() if args else "status"
+
+    if action == "status":
+        if not PROFILER.armed:
+            await update.message.reply_text("ℹ️ No handlers are being profiled.")
+        else:
+            armed = ", ".join(f"{name} ({remaining} left)" for name, remaining in PROFILER.armed.items())
+            await update.message.reply_text(f"🔬 Profiling: {armed}")
+        return
+
+    if len(args) < 2:
+        await update.message.reply_text(usage)
+        return
+    command = args[1].lstrip("/")
+    name = HANDLER_NAMES_BY_COMMAND.get(command, command)
+    if name not in HANDLER_NAMES_BY_COMMAND.values():
+        await update.message.reply_text(f"❌ Unknown command or handler: {command}")
+        return
+
+    if action == "on":
+        try:
+            runs = int(args[2]) if len(args) > 2 else 5
+        except ValueError:
+            await update.message.reply_text(usage)
+            return
+        runs = max(1, min(runs, 50))
+        PROFILER.arm(name, runs)
+        await update.message.reply_text(f"🔬 Profiling the next {runs} call(s) of {name}. The report will be sent here.")
+    elif action == "off":
+        session = PROFILER.disarm(name)
+        if session and session["runs"]:
+            PROFILER.reports[name] = PROFILER.render(name, session)
+            await update.message.reply_text(PROFILER.reports[name][:4000])
+        else:
+            await update.message.reply_text(f"✅ Profiling of {name} cancelled.")
+    elif action == "report":
+        report = PROFILER.reports.get(name)
+        await update.message.reply_text(report[:4000] if report else f"ℹ️ No profile report for {name} yet.")
+    else:
+        await update.message.reply_text(usage)
+
+# === FIREBASE RESILIENCE ===
+FIREBASE_TIMEOUT = float(os.environ.get("FIREBASE_TIMEOUT", 10)) # Per-request HTTP deadline, seconds
+FIREBASE_READ_ATTEMPTS = int(os.environ.get("FIREBASE_READ_ATTEMPTS", 3))
+FIREBASE_RETRY_BASE_DELAY = 0.2 # Seconds; full-jitter exponential backoff between read attempts
+BREAKER_FAILURE_THRESHOLD = 5   # Consecutive transient failures before the circuit opens
+BREAKER_RESET_TIMEOUT = 30.0    # Seconds the circuit stays open before a probe request is let through
+
+class StateError(Exception):
+    """Base class for state-layer failures. Handlers must not write after catching one."""
+
+class StateUnavailableError(StateError):
+    """Backend not initialized, or the circuit breaker is open."""
+
+class StateReadError(StateError):
+    """A read failed after all retries; the caller has no trustworthy data."""
+
+class StateWriteError(StateError):
+    """A write failed; the remote value is unknown."""
+
+class FirebaseHTTPError(Exception):
+    """Non-2xx response from the Realtime Database REST API, with a gRPC-style code."""
+    def __init__(self, status_code, message):
+        super().__init__(f"HTTP {status_code}: {message}")
+        self.status_code = status_code
+        self.code = {
+            400: "INVALID_ARGUMENT", 401: "UNAUTHENTICATED", 403: "PERMISSION_DENIED",
+            404: "NOT_FOUND", 412: "FAILED_PRECONDITION", 429: "RESOURCE_EXHAUSTED",
+        }.get(status_code, "UNAVAILABLE" if status_code >= 500 else "UNKNOWN")
+
+# Error codes that may clear on retry and indicate a degraded backend (HTTP 5xx and 429)
+_TRANSIENT_CODES = {"UNAVAILABLE", "RESOURCE_EXHAUSTED"}
+
+def _is_transient(exc):
+    """Network failures and 5xx/429 responses only. Anything else (a bad request, a bug, an
+    unparsable payload) is re-raised at once and doesn't count towards opening the circuit."""
+    import httpx # Already loaded by FirebaseRestClient
+
+    if isinstance(exc, FirebaseHTTPError):
+        return exc.code in _TRANSIENT_CODES
+    return isinstance(exc, httpx.TransportError) # Includes httpx.TimeoutException
+
+class CircuitBreaker:
+    """Closed -> open after repeated transient failures -> half-open probe after a cool-down.
+    While half-open exactly one call is in flight as the probe; the others fail fast until it ends."""
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+
+    def before_call(self):
+        """Raises if the call must fail fast. Returns True when this call is the half-open probe,
+        which the caller must hand back with end_probe() however it finishes."""
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                raise StateUnavailableError("Firebase circuit is open, failing fast")
+            self.state = "half_open"
+        if self.state == "half_open":
+            if self.probing:
+                raise StateUnavailableError("Firebase circuit is half-open and probing, failing fast")
+            self.probing = True
+            return True
+        return False
+
+    def end_probe(self):
+        self.probing = False
+
+    def record_success(self):
+        if self.state != "closed":
+            state_log.info("Firebase circuit closed again")
+        self.state = "closed"
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                state_log.error("Firebase circuit opened after %d consecutive failures", self.failures)
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+FIREBASE_BREAKER = CircuitBreaker()
+
+async def _call_firebase(operation, key, func, attempts=1):
+    """
+    Awaits one Firebase call (`func` returns a coroutine) through the circuit breaker, retrying
+    transient failures up to `attempts` times. Only idempotent reads should pass attempts > 1.
+    """
+    last_error = None
+    for attempt in range(attempts):
+        probe = FIREBASE_BREAKER.before_call()
+        try:
+            result = await func()
+        except Exception as e:
+            last_error = e
+            if not _is_transient(e):
+                break
+            FIREBASE_BREAKER.record_failure()
+            if attempt + 1 < attempts and FIREBASE_BREAKER.state != "open":
+                delay = random.uniform(0, FIREBASE_RETRY_BASE_DELAY * (2 ** attempt))
+                state_log.warning("Firebase %s of %s failed (%s), retry %d in %.2fs", operation, key, e, attempt + 1, delay)
+                await asyncio.sleep(delay)
+                continue
+            break
+        else:
+            FIREBASE_BREAKER.record_success()
+            return result
+        finally:
+            if probe:
+                FIREBASE_BREAKER.end_probe() # Also on non-transient errors and cancellation
+    raise last_error
+
+# === FIREBASE REST CLIENT ===
+# Async client for the Realtime Database REST API. One pooled keep-alive httpx connection set is
+# shared by every call, and the OAuth access token is minted from the service account directly
+# (signed JWT exchanged over the same client) and refreshed in the background before it expires.
+FIREBASE_SCOPES = (
+    "https://www.googleapis.com/auth/firebase.database",
+    "https://www.googleapis.com/auth/userinfo.email",
+)
+TOKEN_REFRESH_MARGIN = 300 # Seconds before expiry at which the background task refreshes the token
+FIREBASE_MAX_CONNECTIONS = int(os.environ.get("FIREBASE_MAX_CONNECTIONS", 10))
+
+class FirebaseRestClient:
+    def __init__(self, database_url, service_account_info, timeout=FIREBASE_TIMEOUT):
+        import httpx
+        from google.auth import crypt
+
+        self._httpx = httpx
+        self.database_url = database_url.rstrip("/")
+        self._service_account = service_account_info
+        self._signer = crypt.RSASigner.from_service_account_info(service_account_info)
+        self._token_uri = service_account_info.get("token_uri", "https://oauth2.googleapis.com/token")
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout),
+            limits=httpx.Limits(max_connections=FIREBASE_MAX_CONNECTIONS, max_keepalive_connections=FIREBASE_MAX_CONNECTIONS),
+        )
+        self._access_token = None
+        self._token_expires_at = 0.0
+        self._token_lock = asyncio.Lock()
+        self._refresh_task = None
+        self._listeners = set()
+
+    # --- auth ---
+    async def _fetch_token(self):
+        from google.auth import jwt
+
+        now = int(time.time())
+        assertion = jwt.encode(self._signer, {
+            "iss": self._service_account["client_email"],
+            "scope": " ".join(FIREBASE_SCOPES),
+            "aud": self._token_uri,
+            "iat": now,
+            "exp": now + 3600,
+        })
+        response = await self._client.post(self._token_uri, data={
+            "grant_type": "urn:ietf:params:oauth:grant-type:jwt-bearer",
+            "assertion": assertion,
+        })
+        if response.status_code != 200:
+            raise FirebaseHTTPError(response.status_code, response.text[:200])
+        payload = response.json()
+        self._access_token = payload["access_token"]
+        self._token_expires_at = time.time() + int(payload.get("expires_in", 3600))
+        state_log.debug("Firebase access token refreshed, valid for %ss", payload.get("expires_in"))
+
+    async def _token(self):
+        if self._access_token and time.time() < self._token_expires_at - 30:
+            return self._access_token
+        async with self._token_lock:
+            if not self._access_token or time.time() >= self._token_expires_at - 30:
+                await self._fetch_token()
+        return self._access_token
+
+    async def _refresh_loop(self):
+        while True:
+            delay = max(self._token_expires_at - time.time() - TOKEN_REFRESH_MARGIN, 5)
+            await asyncio.sleep(delay)
+            try:
+                async with self._token_lock:
+                    await self._fetch_token()
+            except Exception as e:
+                # The next request refreshes on demand if the token actually runs out
+                state_log.warning("Background token refresh failed: %s", e)
+                await asyncio.sleep(30)
+
+    async def start(self):
+        """Mints the first token and starts the background refresher. Call from the running loop."""
+        await self._token()
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def close(self):
+        for task in list(self._listeners) + ([self._refresh_task] if self._refresh_task else []):
+            task.cancel()
+        await self._client.aclose()
+
+    # --- requests ---
+    def _url(self, path):
+        path = path.strip("/")
+        return f"{self.database_url}/{path}.json" if path else f"{self.database_url}/.json"
+
+    async def _request(self, method, path, params=None, json_body=None):
+        headers = {"Authorization": f"Bearer {await self._token()}"}
+        response = await self._client.request(method, self._url(path), params=params, json=json_body, headers=headers)
+        if response.status_code >= 300:
+            raise FirebaseHTTPError(response.status_code, response.text[:200])
+        return response
+
+    async def get(self, path, **query):
+        """GET a path. Extra query params (shallow, orderBy, ...) are JSON-encoded as the REST API expects."""
+        params = {name: json.dumps(value) if not isinstance(value, bool) else str(value).lower()
+                  for name, value in query.items()}
+        response = await self._request("GET", path, params=params or None)
+        return response.json(), len(response.content)
+
+    async def shallow(self, path):
+        """Returns only the child keys of `path` (values are replaced by True)."""
+        data, size = await self.get(path, shallow=True)
+        return data, size
+
+    async def set(self, path, data):
+        # print=silent: the server answers 204 without echoing the payload back
+        await self._request("PUT", path, params={"print": "silent"}, json_body=data)
+
+    async def update(self, path, data):
+        """Multi-path PATCH; keys may be nested paths like "players/123/stats". Atomic server-side."""
+        await self._request("PATCH", path, params={"print": "silent"}, json_body=data)
+
+    async def push(self, path, data):
+        """POST a new child with a chronologically ordered key and return that key."""
+        response = await self._request("POST", path, json_body=data)
+        return response.json()["name"]
+
+    async def delete(self, path):
+        await self._request("DELETE", path, params={"print": "silent"})
+
+    def listen(self, path, callback):
+        """
+        Starts a streaming listener (server-sent events) on `path`. `callback(event, path, data)`
+        is called for every put/patch event; the stream reconnects with backoff if it drops.
+        Returns the listener task.
+        """
+        async def _run():
+            backoff = 1
+            while True:
+                try:
+                    headers = {"Accept": "text/event-stream", "Authorization": f"Bearer {await self._token()}"}
+                    timeout = self._httpx.Timeout(FIREBASE_TIMEOUT, read=None)
+                    async with self._client.stream("GET", self._url(path), headers=headers, timeout=timeout) as response:
+                        if response.status_code >= 300:
+                            raise FirebaseHTTPError(response.status_code, "stream rejected")
+                        backoff = 1
+                        event = None
+                        async for line in response.aiter_lines():
+                            if line.startswith("event:"):
+                                event = line[6:].strip()
+                            elif line.startswith("data:") and event in ("put", "patch"):
+                                payload = json.loads(line[5:].strip())
+                                callback(event, payload.get("path", "/"), payload.get("data"))
+                            elif line.startswith("data:") and event in ("cancel", "auth_revoked"):
+                                break # Reconnect with a fresh token
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    state_log.warning("Stream on %s dropped (%s), reconnecting in %ss", path, e, backoff)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+
+        task = asyncio.create_task(_run())
+        self._listeners.add(task)
+        task.add_done_callback(self._listeners.discard)
+        return task
+
 def init_firebase():
-    global firebase_db_ref
-    if firebase_db_ref:
+    """Builds the REST client (no network I/O; the first token is fetched in start_firebase)."""
+    global firebase_client
+    if firebase_client:
         return # Already initialized
 
     if not FIREBASE_SERVICE_ACCOUNT_B64 or not FIREBASE_DATABASE_URL:
-        print("Error: Firebase environment variables not set. Cannot initialize Firebase.")
+        state_log.error("Firebase environment variables not set. Cannot initialize Firebase.")
         # We will not exit here, but allow the bot to start if not using DB features
         return
 
     try:
         service_account_info_bytes = base64.b64decode(FIREBASE_SERVICE_ACCOUNT_B64)
         service_account_info = json.loads(service_account_info_bytes)
-
-        cred = credentials.Certificate(service_account_info)
-        firebase_admin.initialize_app(cred, {
-            'databaseURL': FIREBASE_DATABASE_URL
-        })
-        firebase_db_ref = db.reference('/')
-        print("Successfully initialized Firebase!")
+        firebase_client = FirebaseRestClient(FIREBASE_DATABASE_URL, service_account_info)
+        state_log.info("Successfully initialized Firebase!")
     except Exception as e:
-        print(f"Error initializing Firebase: {e}")
-        firebase_db_ref = None
-
-def load_state(key, default_value=None):
-    if not firebase_db_ref:
-        print(f"Firebase not initialized for key {key}. Returning default.")
-        return default_value if default_value is not None else {}
+        state_log.error("Error initializing Firebase: %s", e)
+        firebase_client = None
+
+async def start_firebase():
+    """Fetches the first access token and, if FIREBASE_STREAM is set, keeps the state cache live."""
+    await firebase_client.start()
+    if FIREBASE_STREAM:
+        firebase_client.listen("/", _apply_stream_event)
+
+# === STATE CACHE ===
+# Write-through cache of top-level keys. The bot is the only writer of its tree, so after the
+# startup warm-up (or the first read of a key) reads are served from memory. Callers mutate the
+# dicts they get back before saving, so values are copied on the way in and out.
+# With FIREBASE_STREAM=true a streaming listener also applies edits made outside the bot.
+FIREBASE_STREAM = os.environ.get("FIREBASE_STREAM", "false").lower() == "true"
+# Keys read at startup. Cold keys grow with every season (the archive) or every result (the
+# match event log) and are read path by path or by key range via load_cold; they never enter the cache.
+WARM_STATE_KEYS = ("players", "player_index", "groups", "fixtures", "lock", "tournament_state", "rules_list", "meta",
+                   "match_snapshot", "match_index", "match_views", "ratings", "schedule")
+COLD_STATE_KEYS = ("archive", "archive_index", "match_events")
+_state_cache = {}
+_state_version = 0 # Bumped on every cache change; renders cached against it go stale with it
+
+def state_version():
+    return _state_version
+
+def _bump_state_version():
+    global _state_version
+    _state_version += 1
+
+def _cache_put(key, data):
+    if key in COLD_STATE_KEYS:
+        return # Written through, never cached (see load_cold)
+    # Firebase drops empty containers, mirror that so cached and fetched reads agree
+    _state_cache[key] = copy.deepcopy(data) if data not in (None, {}, []) else None
+    _bump_state_version()
+
+def invalidate_state_cache(key=None):
+    _bump_state_version()
+    if key is None:
+        _state_cache.clear()
+    else:
+        _state_cache.pop(key, None)
+
+def _apply_stream_event(event, path, data):
+    """Folds one put/patch event from the root listener into the cache."""
+    parts = [part for part in path.split("/") if part]
+    if not parts:
+        if event == "put":
+            _state_cache.clear()
+            for key, value in (data or {}).items():
+                if key not in COLD_STATE_KEYS:
+                    _cache_put(key, value)
+        else:
+            for key, value in (data or {}).items():
+                invalidate_state_cache(key.split("/")[0])
+        return
+    key = parts[0]
+    if key in COLD_STATE_KEYS:
+        return
+    if len(parts) == 1 and event == "put":
+        _cache_put(key, data)
+    else:
+        # Nested edit: cheaper to re-read that key on demand than to patch lists/dicts in place
+        invalidate_state_cache(key)
+
+async def warm_state_cache():
+    """Fetches every live key in parallel (one round-trip of wall time) and seeds the cache."""
+    if not firebase_client:
+        return 0
+    start_time = time.perf_counter()
+    try:
+        # Not a root read: that would also pull the cold keys (the season archive) on every boot
+        values = await asyncio.gather(*(
+            _call_firebase("read", key, functools.partial(firebase_client.get, key), attempts=FIREBASE_READ_ATTEMPTS)
+            for key in WARM_STATE_KEYS))
+    except Exception as e:
+        METRICS.observe("state_read", "/", time.perf_counter() - start_time, error=True)
+        state_log.error("State warm-up failed, falling back to per-key reads: %s", e)
+        return 0
+    METRICS.observe("state_read", "/", time.perf_counter() - start_time, sum(size for _, size in values))
+    _state_cache.clear()
+    # Keys absent from the tree come back as None and are cached as known to be empty
+    for key, (value, _) in zip(WARM_STATE_KEYS, values):
+        _cache_put(key, value)
+    present = sum(1 for value, _ in values if value is not None)
+    state_log.info("State cache warmed with %d top-level keys", present)
+    return present
+
+async def load_cold(path, **query):
+    """
+    Uncached read of a path under one of the COLD_STATE_KEYS. Returns {} when it is empty.
+    `query` is passed on to the REST API, e.g. orderBy="$key", startAt=<key> for a key range.
+    """
+    if not firebase_client:
+        raise StateUnavailableError(f"Firebase not initialized, cannot read {path}")
+    key = path.strip("/").split("/")[0]
+    start_time = time.perf_counter()
     try:
-        data = firebase_db_ref.child(key).get()
+        data, size = await _call_firebase("read", key, lambda: firebase_client.get(path, **query), attempts=FIREBASE_READ_ATTEMPTS)
+    except StateUnavailableError:
+        raise
+    except Exception as e:
+        METRICS.observe("state_read", key, time.perf_counter() - start_time, error=True)
+        raise StateReadError(f"Could not read {path}: {e}") from e
+    METRICS.observe("state_read", key, time.perf_counter() - start_time, size)
+    return data if data is not None else {}
+
+async def load_state(key, default_value=None):
+    """
+    Returns the value stored under `key`, or `default_value` ({} if not given) when it is empty.
+    Raises StateError instead of returning a default when the backend can't be read, so a failed
+    read can never be mistaken for an empty tree and written back.
+    """
+    if key in _state_cache:
+        METRICS.observe("state_cache", key, 0.0)
+        data = _state_cache[key]
         if data is None:
             return default_value if default_value is not None else {}
-        return data
+        return copy.deepcopy(data)
+    if not firebase_client:
+        raise StateUnavailableError(f"Firebase not initialized, cannot read {key}")
+    start_time = time.perf_counter()
+    try:
+        data, size = await _call_firebase("read", key, lambda: firebase_client.get(key), attempts=FIREBASE_READ_ATTEMPTS)
+    except StateUnavailableError:
+        METRICS.observe("state_read", key, time.perf_counter() - start_time, error=True)
+        raise
     except Exception as e:
-        print(f"Error loading data from Firebase for key {key}: {e}")
+        METRICS.observe("state_read", key, time.perf_counter() - start_time, error=True)
+        state_log.error("Error loading data from Firebase for key %s: %s", key, e)
+        raise StateReadError(f"Could not read {key}: {e}") from e
+    METRICS.observe("state_read", key, time.perf_counter() - start_time, size)
+    _cache_put(key, data)
+    if data is None:
         return default_value if default_value is not None else {}
+    return data
+
+async def save_state(key, data):
+    """Replaces the value under `key`. Raises StateError if the write did not go through."""
+    if not firebase_client:
+        raise StateUnavailableError(f"Firebase not initialized, cannot save {key}")
+    start_time = time.perf_counter()
+    try:
+        await _call_firebase("write", key, lambda: firebase_client.set(key, data))
+    except Exception as e:
+        invalidate_state_cache(key) # Unknown remote state, re-read next time
+        METRICS.observe("state_write", key, time.perf_counter() - start_time, error=True)
+        state_log.error("Error saving data to Firebase for key %s: %s", key, e)
+        if isinstance(e, StateError):
+            raise
+        raise StateWriteError(f"Could not save {key}: {e}") from e
+    METRICS.observe("state_write", key, time.perf_counter() - start_time, _payload_size(data))
+    _cache_put(key, data)
+
+def _cache_patch(path, value):
+    """Applies one multi-path update entry ("players/123/stats") to the cache, or drops the key."""
+    _bump_state_version()
+    parts = [part for part in path.split("/") if part]
+    key = parts[0]
+    if len(parts) == 1:
+        _cache_put(key, value)
+        return
+    if key not in _state_cache:
+        return # Not cached; the next read fetches the updated value
+    root = _state_cache[key] if _state_cache[key] is not None else {}
+    container = root
+    for part in parts[1:-1]:
+        if isinstance(container, dict):
+            if not isinstance(container.get(part), (dict, list)):
+                container[part] = {}
+            container = container[part]
+        elif isinstance(container, list) and part.isdigit() and int(part) < len(container):
+            container = container[int(part)]
+        else:
+            invalidate_state_cache(key)
+            return
+    last = parts[-1]
+    if isinstance(container, dict):
+        if value is None:
+            container.pop(last, None)
+        else:
+            container[last] = copy.deepcopy(value)
+    elif isinstance(container, list) and last.isdigit() and int(last) < len(container):
+        container[int(last)] = copy.deepcopy(value)
+    else:
+        invalidate_state_cache(key)
+        return
+    _cache_put(key, root)
+
+async def update_state(updates):
+    """
+    Atomic multi-path update at the root, e.g. {"players/123": {...}, "player_index/123": {...}}.
+    A None value deletes that path. Raises StateError if the write did not go through.
+    """
+    if not firebase_client:
+        raise StateUnavailableError("Firebase not initialized, cannot apply update")
+    label = ",".join(sorted({path.strip("/").split("/")[0] for path in updates}))
+    start_time = time.perf_counter()
+    try:
+        await _call_firebase("write", label, lambda: firebase_client.update("/", updates))
+    except Exception as e:
+        for path in updates:
+            invalidate_state_cache(path.strip("/").split("/")[0])
+        METRICS.observe("state_write", label, time.perf_counter() - start_time, error=True)
+        state_log.error("Error applying multi-path update to %s: %s", label, e)
+        if isinstance(e, StateError):
+            raise
+        raise StateWriteError(f"Could not update {label}: {e}") from e
+    METRICS.observe("state_write", label, time.perf_counter() - start_time, _payload_size(updates))
+    for path, value in updates.items():
+        _cache_patch(path, value)
+
+async def load_keys(key):
+    """Child keys of `key` without their values (shallow read), served from the cache when possible."""
+    if key in _state_cache:
+        METRICS.observe("state_cache", f"{key}?shallow", 0.0)
+        data = _state_cache[key]
+        if isinstance(data, dict):
+            return set(data)
+        return {str(i) for i, value in enumerate(data or []) if value is not None}
+    if not firebase_client:
+        raise StateUnavailableError(f"Firebase not initialized, cannot read {key}")
+    start_time = time.perf_counter()
+    try:
+        data, size = await _call_firebase("read", key, lambda: firebase_client.shallow(key), attempts=FIREBASE_READ_ATTEMPTS)
+    except StateUnavailableError:
+        raise
+    except Exception as e:
+        METRICS.observe("state_read", f"{key}?shallow", time.perf_counter() - start_time, error=True)
+        raise StateReadError(f"Could not read keys of {key}: {e}") from e
+    METRICS.observe("state_read", f"{key}?shallow", time.perf_counter() - start_time, size)
+    return set(data or {})
+
+# === READ COALESCING ===
+# Read commands whose reply is the same for everyone (/standings, /showknockout) render through
+# READ_FLIGHTS: concurrent requests share one in-flight render, and the reply is reused until the
+# state cache next changes. Per-user token buckets drop rapid repeats of a read command, so a
+# burst of /standings from one user gets one reply. The admin is never throttled.
+READ_BUCKET_CAPACITY = int(os.environ.get("READ_BUCKET_CAPACITY", 2))
+READ_BUCKET_REFILL_SECONDS = float(os.environ.get("READ_BUCKET_REFILL_SECONDS", 10))
+
+class SingleFlight:
+    """Shares one computation per key among concurrent callers and memoizes it per state version."""
+    def __init__(self):
+        self._inflight = {}
+        self._results = {}
+
+    async def run(self, key, compute):
+        version = state_version()
+        cached = self._results.get(key)
+        if cached is not None and cached[0] == version:
+            METRICS.observe("coalesced", key, 0.0)
+            return cached[1]
+        task = self._inflight.get((key, version))
+        if task is None:
+            task = asyncio.ensure_future(compute())
+            self._inflight[(key, version)] = task
+            task.add_done_callback(lambda done: self._finish(key, version, done))
+        else:
+            METRICS.observe("coalesced", key, 0.0)
+        # Shielded so one caller's cancellation doesn't cancel the render for the others
+        return await asyncio.shield(task)
+
+    def _finish(self, key, version, task):
+        self._inflight.pop((key, version), None)
+        if not task.cancelled() and task.exception() is None and state_version() == version:
+            self._results[key] = (version, task.result())
+
+class TokenBuckets:
+    """One token bucket per key: `capacity` requests at once, refilled one per `refill_seconds`."""
+    MAX_KEYS = 10000
+
+    def __init__(self, capacity, refill_seconds):
+        self.capacity = capacity
+        self.refill_seconds = refill_seconds
+        self._buckets = {} # key: (tokens, last_update)
+
+    def allow(self, key):
+        now = time.monotonic()
+        tokens, last = self._buckets.get(key, (self.capacity, now))
+        tokens = min(self.capacity, tokens + (now - last) / self.refill_seconds)
+        allowed = tokens >= 1
+        self._buckets[key] = (tokens - 1 if allowed else tokens, now)
+        if len(self._buckets) > self.MAX_KEYS:
+            # Buckets that have refilled completely carry no state worth keeping
+            horizon = now - self.capacity * self.refill_seconds
+            self._buckets = {k: v for k, v in self._buckets.items() if v[1] > horizon}
+        return allowed
+
+READ_FLIGHTS = SingleFlight()
+READ_BUCKETS = TokenBuckets(READ_BUCKET_CAPACITY, READ_BUCKET_REFILL_SECONDS)
+
+def throttled_read(callback):
+    """Drops a user's repeats of a read command once their bucket for it is empty."""
+    @functools.wraps(callback)
+    async def wrapper(update, context, *args, **kwargs):
+        user = update.effective_user
+        if user and user.id != ADMIN_ID and not READ_BUCKETS.allow((user.id, callback.__name__)):
+            METRICS.observe("throttled", callback.__name__, 0.0)
+            return None
+        return await callback(update, context, *args, **kwargs)
+    return wrapper
+
+# === PLAYER INDEX ===
+# Denormalized projection of the fields list-style commands need, {user_id: {"team", "username"}},
+# kept next to `players` so /players and the team picker don't download full records with stats.
+def player_index_entry(player_info):
+    return {"team": player_info.get("team", ""), "username": player_info.get("username", "")}
+
+async def load_player_index():
+    index = await load_state("player_index")
+    if index or not await load_keys("players"):
+        return index
+    # Older trees predate the index: build it once from the full records
+    players = await load_state("players")
+    index = {p_id: player_index_entry(p_info) for p_id, p_info in players.items()}
+    await save_state("player_index", index)
+    return index
+
+# === MATCH EVENT LOG ===
+# Append-only history under `match_events` (result_recorded, result_corrected, round_advanced,
+# tiebreaker_decided). Keys are time-ordered push IDs generated here, so an event and the
+# projections it touches (a fixture slot, two players' stats) go out in one multi-path update.
+# The ledger folded from the log is kept in memory; `match_snapshot` holds a compacted copy
+# so a restart only reads and replays the events written after it (a key-range query). The log
+# itself is a cold key: only /replay_log reads it whole.
+MATCH_SNAPSHOT_EVERY = int(os.environ.get("MATCH_SNAPSHOT_EVERY", 25)) # Events between snapshots
+PUSH_CHARS = "-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz"
+
+_last_push_time = 0
+_last_push_random = []
+_match_ledger = None # Folded ledger, loaded on first use
+
+def new_push_key():
+    """Firebase-style push ID: 8 chars of millisecond timestamp + 12 random chars, sortable by time."""
+    global _last_push_time, _last_push_random
+    now = int(time.time() * 1000)
+    if now == _last_push_time:
+        # Same millisecond: increment the random part so keys stay strictly ordered
+        for i in range(11, -1, -1):
+            if _last_push_random[i] != 63:
+                _last_push_random[i] += 1
+                break
+            _last_push_random[i] = 0
+    else:
+        _last_push_random = [random.randrange(64) for _ in range(12)]
+    _last_push_time = now
+    time_chars = []
+    for _ in range(8):
+        time_chars.append(PUSH_CHARS[now % 64])
+        now //= 64
+    return "".join(reversed(time_chars)) + "".join(PUSH_CHARS[i] for i in _last_push_random)
+
+def empty_stats():
+    return {'wins': 0, 'losses': 0, 'draws': 0, 'points': 0, 'gf': 0, 'ga': 0, 'gd': 0}
+
+def apply_result_delta(player_stats, opponent_stats, player_score, opponent_score, sign=1):
+    """Adds (sign=1) or removes (sign=-1) one result from two players' stats, in place."""
+    player_stats['gf'] += sign * player_score
+    player_stats['ga'] += sign * opponent_score
+    opponent_stats['gf'] += sign * opponent_score
+    opponent_stats['ga'] += sign * player_score
+    player_stats['gd'] = player_stats['gf'] - player_stats['ga']
+    opponent_stats['gd'] = opponent_stats['gf'] - opponent_stats['ga']
+
+    if player_score > opponent_score:
+        player_stats['wins'] += sign
+        player_stats['points'] += sign * 3
+        opponent_stats['losses'] += sign
+    elif player_score < opponent_score:
+        player_stats['losses'] += sign
+        opponent_stats['wins'] += sign
+        opponent_stats['points'] += sign * 3
+    else:
+        player_stats['draws'] += sign
+        player_stats['points'] += sign
+        opponent_stats['draws'] += sign
+        opponent_stats['points'] += sign
+
+def match_ref(stage, p1_id, p2_id, group=None):
+    """Stable ledger key for a fixture, independent of which side was listed first."""
+    low, high = sorted((str(p1_id), str(p2_id)))
+    return f"{group if stage == 'group_stage' else stage}:{low}:{high}"
+
+def new_match_ledger():
+    return {"results": {}, "stats": {}, "stage": None, "group_round": 0, "tiebreakers": {},
+            "events": 0, "last_event": None, "snapshot_events": 0}
+
+def fold_match_event(ledger, event_key, event):
+    """Applies one event to the ledger in place. Folding the same log always gives the same ledger."""
+    event_type = event.get("type")
+    if event_type in ("result_recorded", "result_corrected"):
+        stage = event["stage"]
+        p1_id, p2_id = event["p1"], event["p2"]
+        ref = match_ref(stage, p1_id, p2_id, event.get("group"))
+        previous = ledger["results"].get(ref)
+        ledger["results"][ref] = {"stage": stage, "group": event.get("group"), "round": event.get("round"),
+                                  "p1": p1_id, "p2": p2_id, "s1": event["s1"], "s2": event["s2"]}
+        if event.get("rating"):
+            ledger["results"][ref]["rating"] = event["rating"] # Elo change, reversed on correction
+        if stage == "group_stage":
+            stats = ledger["stats"]
+            p1_stats = stats.setdefault(p1_id, empty_stats())
+            p2_stats = stats.setdefault(p2_id, empty_stats())
+            if previous:
+                # Reverse the result being replaced, oriented the way it was recorded
+                apply_result_delta(stats.setdefault(previous["p1"], empty_stats()),
+                                   stats.setdefault(previous["p2"], empty_stats()),
+                                   previous["s1"], previous["s2"], sign=-1)
+            apply_result_delta(p1_stats, p2_stats, event["s1"], event["s2"])
+        for ref in event.get("voided") or []:
+            ledger["results"].pop(ref, None) # Knockout results voided by a correction upstream
+    elif event_type == "round_advanced":
+        ledger["stage"] = event["stage"]
+        if event.get("round") is not None:
+            ledger["group_round"] = event["round"]
+    elif event_type == "tiebreaker_decided":
+        ledger["tiebreakers"][event["group"]] = {"winner": event["winner"], "loser": event["loser"]}
+    else:
+        tournament_log.warning("Ignoring unknown match event %s: %s", event_key, event_type)
+    ledger["events"] += 1
+    ledger["last_event"] = event_key
+    return ledger
+
+def fold_match_events(events, ledger=None):
+    """Folds {push_key: event} in key (= time) order, optionally on top of a snapshot ledger."""
+    ledger = ledger if ledger is not None else new_match_ledger()
+    after = ledger["last_event"]
+    for event_key in sorted(events or {}):
+        if after is None or event_key > after:
+            fold_match_event(ledger, event_key, events[event_key])
+    return ledger
+
+async def load_match_ledger():
+    """The in-memory ledger: snapshot + events written after it, folded once per process."""
+    global _match_ledger
+    if _match_ledger is None:
+        snapshot = await load_state("match_snapshot")
+        ledger = new_match_ledger()
+        ledger.update(snapshot.get("ledger") or {})
+        for key in ("results", "stats", "tiebreakers"):
+            ledger[key] = ledger.get(key) or {} # Firebase drops empty maps
+        after = ledger["last_event"]
+        # startAt is inclusive; fold_match_events skips the event the snapshot already holds
+        events = await load_cold("match_events", orderBy="$key", startAt=after) if after else await load_cold("match_events")
+        _match_ledger = fold_match_events(events, ledger)
+        state_log.debug("Match ledger folded: %s events", _match_ledger["events"])
+    return _match_ledger
+
+def reset_match_ledger():
+    global _match_ledger
+    _match_ledger = None
+
+async def record_match_events(events, updates=None):
+    """
+    Appends [(event_type, fields), ...] and writes `updates` (projections derived from them) in one
+    atomic multi-path update. The ledger is only advanced once the write succeeded. Returns the keys.
+    """
+    global _match_ledger
+    ledger = await load_match_ledger()
+    folded = copy.deepcopy(ledger)
+    payload = dict(updates or {})
+    now = int(time.time())
+    event_keys = []
+    ratings = await load_ratings()
+    rated = {} # Ratings of players touched by this batch
+    for event_type, fields in events:
+        event = {"type": event_type, "at": now, **fields}
+        if event_type in ("result_recorded", "result_corrected"):
+            rate_result_event(folded, event, ratings, rated, payload)
+        event_key = new_push_key()
+        fold_match_event(folded, event_key, event)
+        payload[f"match_events/{event_key}"] = event
+        event_keys.append(event_key)
+    if folded["events"] - folded["snapshot_events"] >= MATCH_SNAPSHOT_EVERY:
+        folded["snapshot_events"] = folded["events"]
+        payload["match_snapshot"] = {"ledger": folded, "at": now}
+    await update_state(payload)
+    _match_ledger = folded
+    tournament_log.info("Recorded %d match event(s): %s", len(event_keys), ", ".join(t for t, _ in events))
+    return event_keys
+
+async def record_match_event(event_type, updates=None, **fields):
+    """Single-event form of record_match_events. Returns the event key."""
+    return (await record_match_events([(event_type, fields)], updates))[0]
+
+async def replay_log(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin: /replay_log — folds the whole event log from scratch and repairs drifted group stats."""
+    global _match_ledger
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("❌ Only the admin can replay the match log.")
+        return
+
+    events = await load_cold("match_events")
+    ledger = fold_match_events(events)
+    players = await load_state("players")
+    repairs = {}
+    for p_id, player_info in players.items():
+        expected = ledger["stats"].get(p_id, empty_stats())
+        if player_info.get("stats") != expected:
+            repairs[f"players/{p_id}/stats"] = expected
+    if repairs:
+        await update_state(repairs)
+    ledger["snapshot_events"] = _match_ledger["snapshot_events"] if _match_ledger else 0
+    _match_ledger = ledger
+    await update.message.reply_text(
+        f"🔁 Replayed {ledger['events']} events ({len(ledger['results'])} results). "
+        f"Stats repaired for {len(repairs)} player(s)."
+    )
+
+# === PLAYER RATINGS ===
+# Elo per Telegram user under `ratings/<user_id>` = {rating, games, seq, history}. Unlike the
+# tournament keys it is never cleared by /reset, so ratings carry over between tournaments.
+# Each recorded result stores the rating change it caused on its event, so a correction or a
+# voided knockout result takes exactly that change back; an update touches two players only.
+# `history` is a ring of the last RATING_HISTORY ratings, written at slot seq % RATING_HISTORY.
+RATING_DEFAULT = 1500
+RATING_K = float(os.environ.get("RATING_K", 32))
+RATING_HISTORY = int(os.environ.get("RATING_HISTORY", 20))
+RATING_POTS = os.environ.get("RATING_POTS", "false").lower() in ("1", "true", "yes") # Draw groups from rating pots
+RATING_SEEDING = os.environ.get("RATING_SEEDING", "false").lower() in ("1", "true", "yes") # Seed knockout by rating
+
+def new_rating():
+    return {"rating": RATING_DEFAULT, "games": 0, "seq": 0, "history": {}}
+
+def rating_of(ratings, player_id):
+    return (ratings.get(str(player_id)) or {}).get("rating", RATING_DEFAULT)
+
+def rating_history(record):
+    """Ratings in the ring oldest first. Firebase may hand the ring back as a list."""
+    history = record.get("history") or {}
+    if isinstance(history, list):
+        history = {str(i): value for i, value in enumerate(history) if value is not None}
+    seq = record.get("seq", 0)
+    slots = [str(i % RATING_HISTORY) for i in range(max(0, seq - RATING_HISTORY), seq)]
+    return [history[slot] for slot in slots if slot in history]
+
+def elo_delta(rating1, rating2, score1, score2):
+    """Rating change for player 1 (player 2 gets the negation). The goal difference scales K
+    the way the World Football Elo ratings do: x1.5 for two goals, x(11+N)/8 for three or more."""
+    margin = abs(score1 - score2)
+    multiplier = 1 if margin <= 1 else 1.5 if margin == 2 else (11 + margin) / 8
+    expected = 1 / (1 + 10 ** ((rating2 - rating1) / 400))
+    actual = 1 if score1 > score2 else 0 if score1 < score2 else 0.5
+    return round(RATING_K * multiplier * (actual - expected), 2)
+
+async def load_ratings():
+    return await load_state("ratings")
+
+def record_rating(working, updates, player_id):
+    """Appends a player's current rating to their history ring and queues the per-field writes."""
+    record = working[player_id]
+    slot = str(record["seq"] % RATING_HISTORY)
+    record["seq"] += 1
+    updates[f"ratings/{player_id}/rating"] = record["rating"]
+    updates[f"ratings/{player_id}/games"] = record["games"]
+    updates[f"ratings/{player_id}/seq"] = record["seq"]
+    updates[f"ratings/{player_id}/history/{slot}"] = round(record["rating"])
+
+def rate_result_event(ledger, event, ratings, working, updates):
+    """
+    Reverses the rating change of the result this event replaces (and of any knockout results it
+    voids), then rates the new score. Stores the applied change on the event as {player_id: delta}.
+    `working` holds the players touched so far in this batch, so consecutive events compound.
+    """
+    results = ledger["results"]
+    p1_id, p2_id = str(event["p1"]), str(event["p2"])
+    ref = match_ref(event["stage"], p1_id, p2_id, event.get("group"))
+    previous = results.get(ref)
+    reversed_refs = [ref] if previous else []
+    reversed_refs += [voided for voided in event.get("voided") or [] if voided != ref and voided in results]
+    touched = {p1_id, p2_id}.union(*((results[r].get("rating") or {}) for r in reversed_refs))
+    for player_id in touched:
+        if player_id not in working:
+            working[player_id] = {**new_rating(), **copy.deepcopy(ratings.get(player_id) or {})}
+    for reversed_ref in reversed_refs:
+        replaced = reversed_ref == ref # The fixture itself keeps counting as a game
+        for player_id, delta in (results[reversed_ref].get("rating") or {}).items():
+            working[player_id]["rating"] -= delta
+            working[player_id]["games"] -= 0 if replaced else 1
+    delta = elo_delta(working[p1_id]["rating"], working[p2_id]["rating"], event["s1"], event["s2"])
+    games = 0 if previous and previous.get("rating") else 1
+    for player_id, change in ((p1_id, delta), (p2_id, -delta)):
+        working[player_id]["rating"] += change
+        working[player_id]["games"] += games
+    for player_id in touched:
+        working[player_id]["rating"] = round(working[player_id]["rating"], 2)
+        record_rating(working, updates, player_id)
+    event["rating"] = {p1_id: delta, p2_id: -delta}
+
+def rating_pots(player_ids, ratings, pot_size):
+    """Players strongest first, cut into pots of `pot_size` (the draw shuffles within pots)."""
+    ordered = sorted(player_ids, key=lambda p_id: (-rating_of(ratings, p_id), p_id))
+    return [ordered[start:start + pot_size] for start in range(0, len(ordered), pot_size)]
+
+async def rating_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/rating — your Elo rating, games rated and recent trend."""
+    user_id = str(update.effective_user.id)
+    record = (await load_ratings()).get(user_id)
+    if not record:
+        await update.message.reply_text(f"📈 No rated matches yet. Everyone starts at {RATING_DEFAULT}.")
+        return
+    history = rating_history(record)
+    trend = " → ".join(str(value) for value in history[-6:])
+    await update.message.reply_text(
+        f"📈 Rating: {round(record.get('rating', RATING_DEFAULT))} ({record.get('games', 0)} rated matches)"
+        + (f"\nRecent: {trend}" if trend else "")
+    )
+
+# === MATCH INDEX ===
+# `match_index/pending_count` keeps {round key: unscored fixtures} and `match_index/pending` the
+# unscored fixtures themselves ({match_ref: entry}). Both change in the same update as each result,
+# so "was that the last match of the round?" and "what is left to play?" need no fixtures scan.
+GROUP_ROUNDS = 3 # Rounds generated per group (0-indexed in fixtures)
+
+def round_key(stage, round_num=None):
+    """"group_stage-r1" for group rounds, the stage name for knockout stages."""
+    return f"group_stage-r{round_num}" if stage == "group_stage" else stage
+
+def count_pending(fixtures_data):
+    """Full fixtures scan; only used to (re)build the counters."""
+    counts = {}
+    for matches in (fixtures_data.get("group_stage") or {}).values():
+        for match in matches or []:
+            if isinstance(match, list) and len(match) >= 5 and match[2] is None:
+                key = round_key("group_stage", match[4])
+                counts[key] = counts.get(key, 0) + 1
+    for stage in KNOCKOUT_STAGES:
+        for match in fixtures_data.get(stage) or []:
+            if isinstance(match, list) and len(match) >= 4 and match[2] is None:
+                counts[stage] = counts.get(stage, 0) + 1
+    return counts
+
+async def load_pending_counts():
+    return (await load_match_index()).get("pending_count") or {}
+
+def pending_entry(stage, index, match, group=None):
+    """Pending-set entry for a fixture, or None if it has a score or is still waiting for a player."""
+    if not isinstance(match, list) or len(match) < 4 or match[2] is not None or not match[0] or not match[1]:
+        return None
+    return {"type": "group" if stage == "group_stage" else "knockout", "stage": stage, "group": group, "index": index,
+            "p1_id": match[0], "p2_id": match[1], "round_num": match[4] if stage == "group_stage" else None}
+
+def pending_set_change(stage, index, old_match, new_match, group=None):
+    """Multi-path entries that move one fixture's pending-set membership from old_match to new_match."""
+    updates = {}
+    if pending_entry(stage, index, old_match, group):
+        updates[f"match_index/pending/{match_ref(stage, old_match[0], old_match[1], group)}"] = None
+    entry = pending_entry(stage, index, new_match, group)
+    if entry:
+        updates[f"match_index/pending/{match_ref(stage, new_match[0], new_match[1], group)}"] = entry
+    return updates
+
+def build_match_index(fixtures_data):
+    """Full fixtures scan; only used when fixtures are drawn or the index is missing."""
+    pending = {}
+    for group_name, matches in (fixtures_data.get("group_stage") or {}).items():
+        for i, match in enumerate(matches or []):
+            entry = pending_entry("group_stage", i, match, group_name)
+            if entry:
+                pending[match_ref("group_stage", match[0], match[1], group_name)] = entry
+    for stage in KNOCKOUT_STAGES:
+        for i, match in enumerate(fixtures_data.get(stage) or []):
+            entry = pending_entry(stage, i, match)
+            if entry:
+                pending[match_ref(stage, match[0], match[1])] = entry
+    return {"pending_count": count_pending(fixtures_data), "pending": pending}
+
+async def load_match_index():
+    index = await load_state("match_index")
+    if "pending_count" in index:
+        return index
+    # Older trees predate the index: build it once from fixtures and save it, so the deltas
+    # written with each result apply on top of complete counters and a complete pending set
+    fixtures_data = await load_state("fixtures")
+    await upgrade_bracket(fixtures_data) # Unscored flat knockout fixtures come back as [p1, p2]
+    index = build_match_index(fixtures_data)
+    if index["pending_count"]:
+        await save_state("match_index", index)
+    return index
+
+async def load_pending_matches(tournament_state):
+    """Unscored fixtures of the current group round or knockout stage, in fixture order. O(pending)."""
+    pending = (await load_match_index()).get("pending") or {} # Firebase drops the map once it is empty
+    stage = tournament_state.get("stage")
+    current_round = tournament_state.get("group_match_round", 0)
+    if stage in KNOCKOUT_STAGES:
+        # Bracket matches are playable as soon as both feeders are done, whatever their stage
+        matches = [entry for entry in pending.values() if entry["stage"] in KNOCKOUT_STAGES]
+    else:
+        matches = [entry for entry in pending.values() if entry["stage"] == stage
+                   and (stage != "group_stage" or entry.get("round_num") == current_round)]
+    stage_order = {s: i for i, s in enumerate(KNOCKOUT_STAGES)}
+    return sorted(matches, key=lambda entry: (stage_order.get(entry["stage"], -1), entry.get("group") or "", entry["index"]))
+
+async def pending_count(pending_counts, key):
+    """One round's counter. A key missing from a partial map is recounted from the stored fixtures
+    (which do not yet include the result being applied) instead of being guessed."""
+    if key not in pending_counts:
+        pending_counts[key] = count_pending(await load_state("fixtures")).get(key, 0)
+    return pending_counts[key]
+
+def set_pending_count(pending_counts, key, value):
+    """Sets one counter and returns the multi-path entry that persists it."""
+    pending_counts[key] = max(value, 0)
+    return {f"match_index/pending_count/{key}": pending_counts[key]}
+
+def group_round_transition(tournament_state):
+    """Moves tournament_state past the current group round; returns the round_advanced event."""
+    current_group_round = tournament_state.get("group_match_round", 0)
+    if current_group_round < GROUP_ROUNDS - 1:
+        tournament_state["group_match_round"] = current_group_round + 1
+        return ("round_advanced", {"stage": "group_stage", "round": current_group_round + 1})
+    tournament_state["stage"] = "group_stage_completed"
+    return ("round_advanced", {"stage": "group_stage_completed"})
+
+async def announce_group_round_transition(context: ContextTypes.DEFAULT_TYPE, tournament_state):
+    """Group-chat side of a group round transition; chains into the knockout draw after the last round."""
+    if tournament_state.get("stage") == "group_stage":
+        await context.bot.send_message(
+            GROUP_ID,
+            f"📣 Group stage has advanced! Round {tournament_state['group_match_round'] + 1} matches are now active. Use /fixtures to see your new match.",
+            parse_mode='Markdown'
+        )
+        await broadcast_fixtures(context, await load_pending_matches(tournament_state),
+                                 f"Round {tournament_state['group_match_round'] + 1} fixtures")
+        return
+    await context.bot.send_message(
+        GROUP_ID,
+        "🎉 The Group Stage has concluded! Calculating final standings and preparing for Knockouts (to be drawn by admin). Use /standings to see final group rankings.",
+        parse_mode='Markdown'
+    )
+    await advance_to_knockout(context)
+
+async def auto_advance_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin: /autoadvance on|off — close group rounds automatically when their last result is recorded."""
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("❌ Only the admin can change auto-advance.")
+        return
+    tournament_state = await load_state("tournament_state")
+    if not context.args or context.args[0].lower() not in ("on", "off"):
+        status = "on" if tournament_state.get("auto_advance") else "off"
+        await update.message.reply_text(f"Usage: /autoadvance on|off (currently {status})")
+        return
+    enabled = context.args[0].lower() == "on"
+    await update_state({"tournament_state/auto_advance": enabled})
+    await update.message.reply_text(
+        "✅ Auto-advance is on: a round closes as soon as its last result is recorded." if enabled
+        else "✅ Auto-advance is off: use /advance_group_round to close group rounds."
+    )
+
+async def pending_dashboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin: /pending — pending counters per round/stage and the matches left in the current one."""
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("❌ Only the admin can view pending matches.")
+        return
+
+    tournament_state = await load_state("tournament_state")
+    stage = tournament_state.get("stage") or "registration"
+    pending_counts = await load_pending_counts()
+    pending_matches = await load_pending_matches(tournament_state)
+    players = await load_player_index() if pending_matches else {}
+
+    current_key = round_key(stage, tournament_state.get("group_match_round", 0))
+    stage_order = {s: i for i, s in enumerate(KNOCKOUT_STAGES)}
+    lines = [f"📋 Pending matches ({stage.replace('_', ' ').title()})"]
+    for key in sorted(pending_counts, key=lambda k: (stage_order.get(k, -1), k)):
+        label = f"Group round {int(key.rsplit('-r', 1)[1]) + 1}" if key.startswith("group_stage-r") else key.replace('_', ' ').title()
+        lines.append(f"{'▶️' if key == current_key else '•'} {label}: {pending_counts[key]} pending")
+
+    if pending_matches:
+        lines.append("")
+        for entry in pending_matches:
+            lines.append(
+                f"- {players.get(entry['p1_id'], {}).get('team', entry['p1_id'])} vs "
+                f"{players.get(entry['p2_id'], {}).get('team', entry['p2_id'])} "
+                f"({entry.get('group') or entry['stage'].replace('_', ' ').title()})"
+            )
+    elif pending_counts:
+        lines.append("\n✅ Nothing left to play in the current round.")
+    await update.message.reply_text("\n".join(lines))
+
+# === MATCH VIEWS ===
+# `match_views/<player_id>` is each player's "current match" with names already resolved, so
+# /fixtures is one lookup. Views are rebuilt in one pass when a round opens (build_match_views)
+# and patched for the two players of every recorded result (match_view_updates). In the knockout
+# a player's view is the deepest bracket node they have reached, so a winner sees their next
+# match (or "waiting for opponent") as soon as the result is in.
+def match_view(player_id, stage, index, match, players, group=None):
+    side = 0 if match[0] == player_id else 1
+    opponent_id = match[1 - side]
+    opponent = players.get(opponent_id, {}) if opponent_id else {}
+    view = {
+        "stage": stage, "group": group, "index": index,
+        "round_num": match[4] if stage == "group_stage" else None,
+        "team": players.get(player_id, {}).get("team", "N/A"),
+        "opponent_id": opponent_id,
+        "opponent_team": opponent.get("team", "TBD"),
+        "opponent_username": opponent.get("username"),
+    }
+    if match[2] is not None:
+        view["score"] = [match[2 + side], match[3 - side]]
+        view["status"] = "completed"
+    else:
+        view["status"] = "pending" if opponent_id else "waiting"
+    return view
+
+def match_view_updates(stage, index, match, players, group=None):
+    """Multi-path entries refreshing the views of a fixture's players."""
+    return {f"match_views/{p_id}": match_view(p_id, stage, index, match, players, group)
+            for p_id in match[:2] if p_id}
+
+def build_match_views(fixtures_data, tournament_state, players):
+    """Full rebuild for the current group round, or the furthest node each player reached in the bracket."""
+    views = {}
+    stage = tournament_state.get("stage")
+    if stage in ("group_stage", "group_stage_completed"):
+        current_round = tournament_state.get("group_match_round", 0)
+        for group_name, matches in (fixtures_data.get("group_stage") or {}).items():
+            for i, match in enumerate(matches or []):
+                if isinstance(match, list) and len(match) >= 5 and match[4] == current_round:
+                    for p_id in match[:2]:
+                        views[p_id] = match_view(p_id, "group_stage", i, match, players, group_name)
+    elif stage in KNOCKOUT_STAGES or stage == "completed":
+        for knockout_stage in KNOCKOUT_STAGES: # Later stages overwrite earlier ones
+            for i, match in enumerate(fixtures_data.get(knockout_stage) or []):
+                if isinstance(match, list) and len(match) >= 4:
+                    for p_id in match[:2]:
+                        if p_id:
+                            views[p_id] = match_view(p_id, knockout_stage, i, match, players)
+    return views
+
+async def load_match_views():
+    views = await load_state("match_views")
+    if views:
+        return views
+    # Older trees predate the views (or nothing is scheduled yet): build them once
+    tournament_state = await load_state("tournament_state")
+    views = build_match_views(await load_state("fixtures"), tournament_state, await load_player_index())
+    if views:
+        await save_state("match_views", views)
+    return views
+
+# === GROUP RANKING ===
+# Group tables are ordered by a chain of criteria, TIEBREAK_CRITERIA="points,gd,gf,h2h,fair_play,playoff"
+# by default. Each criterion only splits teams still level on everything before it:
+#   h2h       - mini-table (points, GD, GF) of the matches between the tied teams only
+#   fair_play - fewer admin-entered deduction points (/fairplay) ranks higher
+#   playoff   - a recorded tiebreaker match decides a two-way tie on the qualification line
+#   lots      - a reproducible draw
+# Anything still level at the end of the chain is drawn by lots, so every table has an order and
+# the only thing that can hold up qualification is an unplayed playoff.
+QUALIFIERS_PER_GROUP = 2
+RANKING_CRITERIA = ("points", "gd", "gf", "h2h", "fair_play", "playoff", "lots")
+
+def parse_tiebreak_criteria(spec):
+    criteria = []
+    for name in (part.strip().lower() for part in spec.split(",")):
+        if name in RANKING_CRITERIA:
+            criteria.append(name)
+        elif name:
+            tournament_log.warning("Ignoring unknown tiebreak criterion %r", name)
+    return tuple(criteria)
+
+TIEBREAK_CRITERIA = parse_tiebreak_criteria(os.environ.get("TIEBREAK_CRITERIA", "points,gd,gf,h2h,fair_play,playoff"))
+
+def group_table(group_matches, player_ids, restrict=False):
+    """{player_id: stats} over a group's completed matches. With restrict=True only matches
+    between player_ids count (the head-to-head mini-table)."""
+    table = {p_id: empty_stats() for p_id in player_ids}
+    for match in group_matches or []:
+        if not isinstance(match, list) or len(match) < 4 or None in match[:4]:
+            continue
+        p1_id, p2_id, score1, score2 = match[:4]
+        if restrict and (p1_id not in table or p2_id not in table):
+            continue
+        for p_id in (p1_id, p2_id):
+            if p_id not in table: # Not in `groups`; setdefault would build a throwaway dict per match
+                table[p_id] = empty_stats()
+        apply_result_delta(table[p1_id], table[p2_id], score1, score2)
+    return table
+
+def lots_key(group_name, player_id, seed=""):
+    """Position in a reproducible drawing of lots: the same tie is always drawn the same way."""
+    return hashlib.sha256(f"{seed}:{group_name}:{player_id}".encode()).hexdigest()
+
+def split_block(block, key):
+    """Orders a tied block by key (highest first) and splits it into runs of equal keys."""
+    runs, last_key = [], None
+    for p_id in sorted(block, key=key, reverse=True):
+        if runs and key(p_id) == last_key:
+            runs[-1].append(p_id)
+        else:
+            runs.append([p_id])
+            last_key = key(p_id)
+    return runs
+
+STATIC_CRITERIA = ("points", "gd", "gf", "fair_play") # Independent of which teams are tied
+
+@functools.lru_cache(maxsize=None)
+def criteria_passes(criteria):
+    """
+    Merges each run of static criteria into one composite-key pass, e.g.
+    ("points", "gd", "gf", "h2h") -> (("points", "gd", "gf"), "h2h"). Splitting once on the tuple
+    gives the same blocks as splitting on each criterion in turn, with one sort instead of three.
+    """
+    passes = []
+    for criterion in criteria:
+        if criterion in STATIC_CRITERIA and passes and isinstance(passes[-1], tuple):
+            passes[-1] += (criterion,)
+        else:
+            passes.append((criterion,) if criterion in STATIC_CRITERIA else criterion)
+    return tuple(passes)
+
+def recorded_playoffs(fixtures_data):
+    """{group_name: (winner_id, loser_id)} for every completed tiebreaker match."""
+    playoffs = {}
+    for group_name, match in (fixtures_data.get("tiebreaker_fixtures") or {}).items():
+        if isinstance(match, list) and len(match) >= 5 and match[4] == "completed":
+            playoffs[group_name] = (match[2], match[3])
+    return playoffs
+
+def rank_group(group_name, group_matches, player_ids, fair_play=None, playoff=None, criteria=TIEBREAK_CRITERIA, lots_seed=""):
+    """Ranks one group. Returns (order, table, unresolved): unresolved is the tied pair on the
+    qualification line still waiting for its playoff, or None."""
+    table = group_table(group_matches, player_ids)
+    fair_play = fair_play or {}
+    blocks = [sorted(table)]
+    unresolved = None
+    for criterion in criteria_passes(criteria + ("lots",)):
+        if all(len(block) == 1 for block in blocks):
+            break # Fully ordered; later criteria cannot change anything
+        next_blocks = []
+        start = 0
+        if isinstance(criterion, tuple):
+            # Composite key for a run of static criteria, computed once per team
+            pick = operator.itemgetter(*(STATIC_CRITERIA.index(name) for name in criterion))
+            composite = {p_id: pick((stats["points"], stats["gd"], stats["gf"], -fair_play.get(p_id, 0)))
+                         for p_id, stats in table.items()}
+        for block in blocks:
+            if len(block) == 1:
+                next_blocks.append(block)
+            elif isinstance(criterion, tuple):
+                next_blocks.extend(split_block(block, composite.__getitem__))
+            elif criterion == "h2h":
+                mini = group_table(group_matches, block, restrict=True)
+                next_blocks.extend(split_block(block, lambda p_id: (mini[p_id]["points"], mini[p_id]["gd"], mini[p_id]["gf"])))
+            elif criterion == "playoff" and len(block) == 2 and start == QUALIFIERS_PER_GROUP - 1:
+                if playoff and set(playoff) == set(block):
+                    next_blocks.extend([[playoff[0]], [playoff[1]]])
+                else:
+                    unresolved = list(block)
+                    next_blocks.append(block)
+            elif criterion == "lots":
+                next_blocks.extend([p_id] for p_id in sorted(block, key=lambda p_id: lots_key(group_name, p_id, lots_seed)))
+            else:
+                next_blocks.append(block)
+            start += len(block)
+        blocks = next_blocks
+    return [block[0] for block in blocks], table, unresolved
+
+def rank_all_groups(groups, fixtures_data, fair_play=None, criteria=TIEBREAK_CRITERIA):
+    """Ranks every group in one pass: {group_name: (order, table, unresolved)}."""
+    group_fixtures = fixtures_data.get("group_stage") or {}
+    playoffs = recorded_playoffs(fixtures_data)
+    rankings = {}
+    for group_name in sorted(set(groups or {}) | set(group_fixtures)):
+        player_ids = (groups or {}).get(group_name) or []
+        rankings[group_name] = rank_group(group_name, group_fixtures.get(group_name), player_ids,
+                                          fair_play, playoffs.get(group_name), criteria)
+    return rankings
+
+def seed_qualifiers(rankings, fair_play=None, ratings=None):
+    """Knockout seeds: group winners first, then runners-up, each set ordered across groups by
+    points, GD, GF and fair play, then lots. With `ratings`, Elo orders each set instead."""
+    fair_play = fair_play or {}
+    seeds = []
+    for position in range(QUALIFIERS_PER_GROUP):
+        entrants = [(group_name, order[position], table[order[position]])
+                    for group_name, (order, table, _) in rankings.items() if len(order) > position]
+        entrants.sort(key=lambda e: (-rating_of(ratings, e[1]) if ratings is not None else 0,
+                                     -e[2]["points"], -e[2]["gd"], -e[2]["gf"], fair_play.get(e[1], 0), lots_key(e[0], e[1])))
+        seeds.extend(p_id for _, p_id, _ in entrants)
+    return seeds
+
+# === QUALIFICATION ODDS ===
+# /odds plays the remaining group fixtures ODDS_SIMULATIONS times. Goals are Poisson with a rate per
+# (team, opponent) fitted from the results so far: the mean goals per team per match, scaled by
+# the team's attack and the opponent's defence, both shrunk towards the mean by
+# ODDS_PRIOR_MATCHES pseudo-matches so one big win doesn't dominate. Every simulated table goes
+# through rank_group, with unplayed playoffs and lots drawn at random. The reply is cached per
+# state version (READ_FLIGHTS), so it is recomputed only after a result changes.
+ODDS_SIMULATIONS = int(os.environ.get("ODDS_SIMULATIONS", 1000))
+ODDS_PRIOR_MATCHES = 2
+ODDS_DEFAULT_GOALS = 1.3 # Per team per match, before any result is in
+
+def poisson_sample(rng, rate):
+    """Knuth's method; fine for the small rates of a football score."""
+    threshold, goals, product = math.exp(-rate), 0, rng.random()
+    while product > threshold:
+        goals += 1
+        product *= rng.random()
+    return goals
+
+def fit_goal_rates(group_fixtures):
+    """Returns rate(team, opponent): expected goals for `team` against `opponent`."""
+    scored, conceded, played = defaultdict(int), defaultdict(int), defaultdict(int)
+    for matches in (group_fixtures or {}).values():
+        for match in matches or []:
+            if isinstance(match, list) and len(match) >= 4 and None not in match[:4]:
+                p1_id, p2_id, score1, score2 = match[:4]
+                scored[p1_id] += score1
+                conceded[p1_id] += score2
+                scored[p2_id] += score2
+                conceded[p2_id] += score1
+                played[p1_id] += 1
+                played[p2_id] += 1
+    appearances = sum(played.values())
+    mean = sum(scored.values()) / appearances if appearances else ODDS_DEFAULT_GOALS
+    mean = mean or ODDS_DEFAULT_GOALS / 2 # Every match so far 0-0; keep some goals in play
+    prior = ODDS_PRIOR_MATCHES * mean
+
+    def rate(team, opponent):
+        attack = (scored[team] + prior) / (played[team] * mean + prior)
+        defence = (conceded[opponent] + prior) / (played[opponent] * mean + prior)
+        return mean * attack * defence
+    return rate
+
+def simulate_group_odds(groups, fixtures_data, fair_play=None, simulations=ODDS_SIMULATIONS, rng=None):
+    """{group_name: {player_id: (advance_probability, group_win_probability)}} and the number of matches simulated."""
+    group_fixtures = fixtures_data.get("group_stage") or {}
+    rate = fit_goal_rates(group_fixtures)
+    rng = rng or random.Random(0)
+    playoffs = recorded_playoffs(fixtures_data)
+    odds, remaining_total = {}, 0
+    for group_name in sorted(set(groups or {}) | set(group_fixtures)):
+        matches = [m for m in group_fixtures.get(group_name) or [] if isinstance(m, list) and len(m) >= 4]
+        player_ids = (groups or {}).get(group_name) or sorted({p_id for m in matches for p_id in m[:2]})
+        played = [m for m in matches if None not in m[:4]]
+        remaining = [(m[0], m[1], rate(m[0], m[1]), rate(m[1], m[0])) for m in matches if None in m[:4]]
+        remaining_total += len(remaining)
+        advanced, won = defaultdict(int), defaultdict(int)
+        for i in range(simulations):
+            simulated = played + [[p1_id, p2_id, poisson_sample(rng, rate1), poisson_sample(rng, rate2)]
+                                  for p1_id, p2_id, rate1, rate2 in remaining]
+            # An unplayed playoff falls through to lots, which a per-run seed makes a coin toss
+            order, _, _ = rank_group(group_name, simulated, player_ids, fair_play, playoffs.get(group_name), lots_seed=f"sim{i}")
+            won[order[0]] += 1
+            for p_id in order[:QUALIFIERS_PER_GROUP]:
+                advanced[p_id] += 1
+        odds[group_name] = {p_id: (advanced[p_id] / simulations, won[p_id] / simulations) for p_id in player_ids}
+    return odds, remaining_total
+
+async def render_odds():
+    tournament_state = await load_state("tournament_state")
+    if tournament_state.get("stage") not in ("group_stage", "group_stage_completed"):
+        return "ℹ️ Qualification odds are only available during the group stage\\."
+    groups = await load_state("groups")
+    players = await load_player_index()
+    # Same tournament, same recorded events: same odds, whichever process renders them
+    ledger = await load_match_ledger()
+    # The Monte Carlo run is CPU-bound: keep it off the event loop so polling and other handlers
+    # carry on meanwhile (odds_command shares one run among concurrent /odds through READ_FLIGHTS)
+    odds, remaining = await asyncio.to_thread(
+        simulate_group_odds, groups, await load_state("fixtures"), tournament_state.get("fair_play"),
+        rng=tournament_rng(tournament_state.get("seed"), f"odds:{ledger['events']}"))
+    reply = (f"📈 *Qualification Odds* \\({ODDS_SIMULATIONS} simulations of the "
+             f"{remaining} remaining group matches\\)\n\n")
+    for group_name, group_odds in odds.items():
+        names = {p_id: players.get(p_id, {}).get('team', p_id) for p_id in group_odds}
+        width = max([len(name) for name in names.values()] + [4]) + 2
+        reply += f"*{escape_markdown_v2(group_name.upper())}*\n```\n{'Team'.ljust(width)}  Adv   1st\n"
+        for p_id, (advance, win) in sorted(group_odds.items(), key=lambda item: item[1], reverse=True):
+            reply += f"{names[p_id].ljust(width)} {advance:>4.0%}  {win:>4.0%}\n"
+        reply += "```\n"
+    return reply
+
+async def odds_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/odds — each team's chance of advancing and of winning its group."""
+    reply = await READ_FLIGHTS.run("odds", render_odds)
+    await update.message.reply_text(reply, parse_mode=ParseMode.MARKDOWN_V2)
+
+async def fair_play_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin: /fairplay <player_id> <points> — sets a player's fair-play deduction points."""
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("❌ Only the admin can record fair-play points.")
+        return
+    if len(context.args) != 2 or not context.args[1].isdigit():
+        await update.message.reply_text("Usage: /fairplay <player_id> <points> (0 clears)")
+        return
+    player_id, points = context.args[0], int(context.args[1])
+    if player_id not in await load_player_index():
+        await update.message.reply_text(f"❌ No registered player with ID {player_id}.")
+        return
+    await update_state({f"tournament_state/fair_play/{player_id}": points or None})
+    await update.message.reply_text(f"✅ Fair-play deductions for {player_id}: {points}")
+
+# === PLAYER BROADCAST ===
+# When a round opens every affected player gets their fixture by DM, instead of everyone asking
+# /fixtures at once. Notices are coalesced into one DM per user and sent concurrently, at most
+# BROADCAST_CONCURRENCY at a time; each send holds its slot for at least
+# BROADCAST_CONCURRENCY / BROADCAST_RATE seconds, so a burst stays under BROADCAST_RATE
+# messages/second (Telegram allows bots about 30).
+BROADCAST_CONCURRENCY = int(os.environ.get("BROADCAST_CONCURRENCY", 8))
+BROADCAST_RATE = float(os.environ.get("BROADCAST_RATE", 25))
+
+def coalesce_messages(messages):
+    """[(user_id, text)] -> {user_id: text}, one DM per user in first-seen order."""
+    coalesced = {}
+    for user_id, text in messages:
+        coalesced[str(user_id)] = f"{coalesced[str(user_id)]}\n\n{text}" if str(user_id) in coalesced else text
+    return coalesced
+
+async def send_dm(bot, semaphore, user_id, text, stats, label):
+    async with semaphore:
+        start_time = time.perf_counter()
+        outcome = "failed"
+        for attempt in range(2):
+            try:
+                await bot.send_message(int(user_id), text, parse_mode=ParseMode.MARKDOWN_V2)
+                outcome = "sent"
+            except RetryAfter as e:
+                retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else e.retry_after
+                if attempt == 0:
+                    stats["retried"] += 1
+                    await asyncio.sleep(retry_after)
+                    continue
+            except Forbidden:
+                outcome = "unreachable" # Blocked the bot or never opened a DM with it
+            except Exception as e:
+                handler_log.warning("DM to %s failed (%s): %s", user_id, label, e)
+            break
+        stats[outcome] += 1
+        elapsed = time.perf_counter() - start_time
+        METRICS.observe("broadcast", label, elapsed, len(text.encode("utf-8")), error=outcome != "sent")
+        await asyncio.sleep(max(0.0, BROADCAST_CONCURRENCY / BROADCAST_RATE - elapsed))
+
+async def broadcast_dms(bot, messages, label):
+    """DMs [(user_id, text)] with bounded concurrency. Returns delivery stats."""
+    coalesced = coalesce_messages(messages)
+    stats = {"users": len(coalesced), "sent": 0, "unreachable": 0, "failed": 0, "retried": 0}
+    start_time = time.perf_counter()
+    semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+    await asyncio.gather(*(send_dm(bot, semaphore, user_id, text, stats, label) for user_id, text in coalesced.items()))
+    stats["seconds"] = round(time.perf_counter() - start_time, 2)
+    handler_log.info("Broadcast %s: %s", label, stats)
+    return stats
+
+def format_broadcast_stats(label, stats):
+    return (f"📨 {label}: {stats['sent']}/{stats['users']} DMs delivered, {stats['unreachable']} unreachable, "
+            f"{stats['failed']} failed, {stats['retried']} rate-limited retries ({stats['seconds']}s)")
+
+def fixture_dm_text(entry, player_info, opponent_info, kickoff=None):
+    where = entry.get("group") or entry["stage"].replace('_', ' ').title()
+    if entry.get("round_num") is not None:
+        where += f", Round {entry['round_num'] + 1}"
+    return (
+        f"📅 *Your next match* \\({escape_markdown_v2(where)}\\):\n"
+        f"*{escape_markdown_v2(player_info.get('team', 'N/A'))}* vs *{escape_markdown_v2(opponent_info.get('team', 'N/A'))}* "
+        f"\\(@{escape_markdown_v2(opponent_info.get('username', 'N/A'))}\\)"
+        + (f"\n🕒 Kickoff: *{escape_markdown_v2(kickoff_label(kickoff))}*" if kickoff else "")
+    )
+
+async def broadcast_fixtures(context: ContextTypes.DEFAULT_TYPE, entries, label, report=True):
+    """Schedules and DMs both players of each pending-set entry their fixture; reports delivery to the admin."""
+    if not entries:
+        return None
+    kickoffs = await schedule_kickoffs(context.bot, entries)
+    players = await load_player_index()
+    messages = []
+    for entry in entries:
+        kickoff = kickoffs.get(entry_ref(entry))
+        for player_id, opponent_id in ((entry["p1_id"], entry["p2_id"]), (entry["p2_id"], entry["p1_id"])):
+            messages.append((player_id, fixture_dm_text(entry, players.get(player_id, {}), players.get(opponent_id, {}), kickoff)))
+    stats = await broadcast_dms(context.bot, messages, label)
+    if report:
+        await context.bot.send_message(ADMIN_ID, format_broadcast_stats(label, stats))
+    return stats
+
+# === KICKOFF SCHEDULING ===
+# When a round opens its matches get kickoff times from the players' weekly availability
+# (/available, stored as players/<id>/availability = [[weekday, start_hour, end_hour], ...] in
+# SCHEDULE_UTC_OFFSET local time). Slots are SCHEDULE_SLOT_MINUTES long over the next
+# SCHEDULE_HORIZON_HOURS and host at most SCHEDULE_PARALLEL matches each. The assignment is a
+# bipartite matching of matches to slot places: augmenting paths move earlier matches aside
+# when a later one has no free slot, and a binary search over the horizon finds the earliest
+# time by which the whole round can be over. Matches where neither player set availability are
+# left to the players. Kickoffs live under `schedule/<match_ref>`; each gets a reminder DM
+# REMINDER_LEAD_MINUTES before (asyncio tasks, re-armed from `schedule` after a restart; a sent
+# reminder is marked with `reminded` = epoch seconds, so a restart doesn't send it again).
+SCHEDULE_SLOT_MINUTES = int(os.environ.get("SCHEDULE_SLOT_MINUTES", 60))
+SCHEDULE_HORIZON_HOURS = int(os.environ.get("SCHEDULE_HORIZON_HOURS", 72))
+SCHEDULE_PARALLEL = int(os.environ.get("SCHEDULE_PARALLEL", 4)) # Matches that can kick off in the same slot
+SCHEDULE_UTC_OFFSET = float(os.environ.get("SCHEDULE_UTC_OFFSET", 0)) # Hours; availability is given in this local time
+REMINDER_LEAD_MINUTES = int(os.environ.get("REMINDER_LEAD_MINUTES", 30))
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+DAY_GROUPS = {"daily": range(7), "weekdays": range(5), "weekends": range(5, 7)}
+AVAILABILITY_PATTERN = re.compile(r"(mon|tue|wed|thu|fri|sat|sun|daily|weekdays|weekends)\w*\s+(\d{1,2})\s*-\s*(\d{1,2})", re.IGNORECASE)
+WEEK_MINUTES = 7 * 24 * 60
+
+_reminder_tasks = {} # match_ref -> pending reminder task
+
+def parse_availability(text):
+    """"Mon 18-22, weekends 10-14" -> [[0, 18, 22], [5, 10, 14], [6, 10, 14]]. End hours below the
+    start run past midnight ("fri 22-2"). Returns None if nothing in the text parses."""
+    windows = []
+    for day, start, end in AVAILABILITY_PATTERN.findall(text):
+        start, end = int(start), int(end)
+        if start > 23 or end > 24 or start == end:
+            return None
+        days = DAY_GROUPS.get(day.lower()) or [WEEKDAYS.index(day.lower()[:3])]
+        windows.extend([weekday, start, end] for weekday in days)
+    return windows or None
+
+def format_availability(windows):
+    return ", ".join(f"{WEEKDAYS[day].title()} {start:02d}-{end:02d}" for day, start, end in windows)
+
+def slot_starts(now):
+    """Slot start times (epoch seconds) from the next slot boundary to the end of the horizon."""
+    step = SCHEDULE_SLOT_MINUTES * 60
+    first = (int(now) // step + 1) * step
+    return list(range(first, int(now) + SCHEDULE_HORIZON_HOURS * 3600, step))
+
+def available_at(windows, slot):
+    """Whether a whole slot starting at `slot` falls inside one of the weekly windows."""
+    # The Unix epoch was a Thursday: shift so minute 0 of the week is Monday 00:00 local time
+    minute = int((slot / 60 + SCHEDULE_UTC_OFFSET * 60 + 3 * 24 * 60) % WEEK_MINUTES)
+    for day, start, end in windows:
+        window_start = day * 24 * 60 + start * 60
+        length = ((end - start) % 24 or 24) * 60
+        if (minute - window_start) % WEEK_MINUTES + SCHEDULE_SLOT_MINUTES <= length:
+            return True
+    return False
+
+def assign_kickoffs(candidates, capacity):
+    """
+    {match: slot} for {match: [candidate slots, ascending]}, at most capacity[slot] matches per
+    slot (SCHEDULE_PARALLEL where not given). Schedules as many matches as can be, and among
+    those assignments picks one whose last kickoff is as early as possible.
+    """
+    def match_within(limit):
+        occupants = defaultdict(list)
+        assigned = {}
 
-def save_state(key, data):
-    if not firebase_db_ref:
-        print(f"Firebase not initialized for key {key}. Cannot save data.")
+        def augment(match, seen):
+            for slot in candidates[match]:
+                if slot > limit:
+                    break
+                if slot in seen:
+                    continue
+                seen.add(slot)
+                if len(occupants[slot]) < capacity.get(slot, SCHEDULE_PARALLEL):
+                    occupants[slot].append(match)
+                    assigned[match] = slot
+                    return True
+                for other in list(occupants[slot]):
+                    if augment(other, seen): # `other` moved to another slot, freeing a place here
+                        occupants[slot].remove(other)
+                        occupants[slot].append(match)
+                        assigned[match] = slot
+                        return True
+            return False
+
+        # Most constrained matches first, so the early slots go where they are needed
+        for match in sorted(candidates, key=lambda m: (len(candidates[m]), str(m))):
+            augment(match, set())
+        return assigned
+
+    slots = sorted(set().union(*candidates.values())) if candidates else []
+    if not slots:
+        return {}
+    best = match_within(slots[-1])
+    low, high = 0, len(slots) - 1
+    while low < high: # Earliest horizon that still fits as many matches as the full one
+        middle = (low + high) // 2
+        attempt = match_within(slots[middle])
+        if len(attempt) == len(best):
+            best, high = attempt, middle
+        else:
+            low = middle + 1
+    return best
+
+def kickoff_label(kickoff):
+    local = time.gmtime(kickoff + SCHEDULE_UTC_OFFSET * 3600)
+    offset = f"{SCHEDULE_UTC_OFFSET:+g}" if SCHEDULE_UTC_OFFSET else ""
+    return time.strftime("%a %d %b %H:%M", local) + f" UTC{offset}"
+
+def entry_ref(entry):
+    return match_ref(entry["stage"], entry["p1_id"], entry["p2_id"], entry.get("group"))
+
+async def schedule_kickoffs(bot, entries):
+    """Gives the pending-set entries of a newly opened round kickoff slots, stores them and arms
+    their reminders. Returns {match_ref: kickoff}."""
+    players = await load_state("players")
+    schedule = await load_state("schedule")
+    now = time.time()
+    slots = slot_starts(now)
+    refs = {entry_ref(entry) for entry in entries}
+    taken = defaultdict(int) # Places already used by other matches scheduled earlier
+    for ref, scheduled in schedule.items():
+        if ref not in refs:
+            taken[scheduled["kickoff"]] += 1
+    candidates = {}
+    for entry in entries:
+        windows = [players.get(p_id, {}).get("availability") for p_id in (entry["p1_id"], entry["p2_id"])]
+        if not any(windows):
+            continue # Neither player gave availability: they agree a time themselves
+        candidates[entry_ref(entry)] = [slot for slot in slots if all(available_at(w, slot) for w in windows if w)]
+    capacity = {slot: SCHEDULE_PARALLEL - taken[slot] for slot in slots}
+    kickoffs = assign_kickoffs(candidates, capacity)
+    updates = {f"schedule/{ref}": None for ref, scheduled in schedule.items()
+               if scheduled["kickoff"] < now - SCHEDULE_SLOT_MINUTES * 60} # Long kicked off
+    for entry in entries:
+        ref = entry_ref(entry)
+        if ref in kickoffs:
+            updates[f"schedule/{ref}"] = {"kickoff": kickoffs[ref], "stage": entry["stage"], "group": entry.get("group"),
+                                          "p1": entry["p1_id"], "p2": entry["p2_id"]}
+    if updates:
+        await update_state(updates)
+    for ref, scheduled in updates.items():
+        if scheduled:
+            arm_reminder(bot, ref.split("/", 1)[1], scheduled)
+    unscheduled = [ref for ref in candidates if ref not in kickoffs]
+    tournament_log.info("Scheduled %d of %d match(es); no common slot for %s", len(kickoffs), len(entries), unscheduled or "none")
+    return kickoffs
+
+def arm_reminder(bot, ref, scheduled):
+    """(Re)starts the reminder task for one scheduled match."""
+    previous = _reminder_tasks.pop(ref, None)
+    if previous:
+        previous.cancel()
+    if scheduled["kickoff"] <= time.time():
         return
+    task = asyncio.create_task(remind_kickoff(bot, ref, scheduled))
+    _reminder_tasks[ref] = task
+    task.add_done_callback(lambda done, ref=ref: _reminder_tasks.pop(ref, None) if _reminder_tasks.get(ref) is done else None)
+
+def cancel_reminders():
+    for task in _reminder_tasks.values():
+        task.cancel()
+    _reminder_tasks.clear()
+
+async def arm_stored_reminders(bot):
+    """Re-arms the reminders of every future kickoff not reminded yet, e.g. after a restart."""
+    for ref, scheduled in (await load_state("schedule")).items():
+        if not scheduled.get("reminded"):
+            arm_reminder(bot, ref, scheduled)
+    return len(_reminder_tasks)
+
+async def remind_kickoff(bot, ref, scheduled):
     try:
-        firebase_db_ref.child(key).set(data)
+        await asyncio.sleep(max(0.0, scheduled["kickoff"] - REMINDER_LEAD_MINUTES * 60 - time.time()))
+        if ref in (await load_match_ledger())["results"]:
+            return # Already played
+        players = await load_player_index()
+        messages = []
+        for player_id, opponent_id in ((scheduled["p1"], scheduled["p2"]), (scheduled["p2"], scheduled["p1"])):
+            opponent = players.get(opponent_id, {})
+            messages.append((player_id,
+                             f"⏰ *Kickoff at {escape_markdown_v2(kickoff_label(scheduled['kickoff']))}*: you vs "
+                             f"*{escape_markdown_v2(opponent.get('team', 'N/A'))}* \\(@{escape_markdown_v2(opponent.get('username', 'N/A'))}\\)"))
+        await broadcast_dms(bot, messages, "Kickoff reminders")
+        await update_state({f"schedule/{ref}/reminded": int(time.time())})
+    except asyncio.CancelledError:
+        raise # Rescheduled or shut down
     except Exception as e:
-        print(f"Error saving data to Firebase for key {key}: {e}")
+        tournament_log.error("Kickoff reminder for %s failed: %s", ref, e, exc_info=True)
+
+async def available_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/available <windows> — weekly times you can play, e.g. /available mon 18-22, weekends 10-14."""
+    user_id = str(update.effective_user.id)
+    if user_id not in await load_player_index():
+        await update.message.reply_text("❌ Only registered players can set availability.")
+        return
+    text = " ".join(context.args)
+    if not text:
+        windows = (await load_state("players")).get(user_id, {}).get("availability")
+        await update.message.reply_text(
+            f"🕒 Your availability: {format_availability(windows)}" if windows else
+            "🕒 No availability set. Usage: /available mon 18-22, weekends 10-14 (or /available clear)")
+        return
+    if text.strip().lower() == "clear":
+        await update_state({f"players/{user_id}/availability": None})
+        await update.message.reply_text("✅ Availability cleared; you will arrange kickoffs with your opponents.")
+        return
+    windows = parse_availability(text)
+    if not windows:
+        await update.message.reply_text("❌ Couldn't read that. Example: /available mon 18-22, weekends 10-14")
+        return
+    await update_state({f"players/{user_id}/availability": windows})
+    await update.message.reply_text(f"✅ Availability saved: {format_availability(windows)}")
+
+async def kickoffs_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/kickoffs — upcoming scheduled matches in kickoff order."""
+    schedule = await load_state("schedule")
+    upcoming = sorted((s for s in schedule.values() if s["kickoff"] >= time.time() - SCHEDULE_SLOT_MINUTES * 60),
+                      key=lambda s: s["kickoff"])
+    if not upcoming:
+        await update.message.reply_text("🕒 No kickoffs scheduled.")
+        return
+    players = await load_player_index()
+    lines = ["🕒 Scheduled kickoffs:"]
+    for scheduled in upcoming:
+        lines.append(f"{kickoff_label(scheduled['kickoff'])}: {players.get(scheduled['p1'], {}).get('team', scheduled['p1'])} vs "
+                     f"{players.get(scheduled['p2'], {}).get('team', scheduled['p2'])}")
+    await update.message.reply_text("\n".join(lines))
 
 # === LOCKING SYSTEM (now in Firebase) ===
-def is_locked():
-    lock = load_state("lock")
+async def is_locked():
+    lock = await load_state("lock")
     if not lock:
         return False
     if time.time() - lock.get("start_time", 0) > 300: # 5 minutes timeout
-        unlock_user()
+        await unlock_user()
         return False
     return True
 
-def lock_user(user_id):
-    save_state("lock", {"user_id": user_id, "start_time": time.time(), "selected_team": None})
+async def lock_user(user_id):
+    await save_state("lock", {"user_id": user_id, "start_time": time.time(), "selected_team": None})
 
-def unlock_user():
-    save_state("lock", {})
+async def unlock_user():
+    await save_state("lock", {})
 
-def set_selected_team(team):
-    lock = load_state("lock")
+async def set_selected_team(team):
+    lock = await load_state("lock")
     if lock:
         lock["selected_team"] = team
-        save_state("lock", lock)
+        await save_state("lock", lock)
 
-def get_locked_user():
-    return load_state("lock").get("user_id")
+async def get_locked_user():
+    return (await load_state("lock")).get("user_id")
 
-def get_locked_team():
-    return load_state("lock").get("selected_team")
+async def get_locked_team():
+    return (await load_state("lock")).get("selected_team")
 
 # === BOT COMMANDS ===
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("👋 Welcome to the eFootball World Cup Tournament!\nUse /register to join.")
 
 async def rules(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    rules_list = load_state("rules_list", default_value=[])
+    rules_list = await load_state("rules_list", default_value=[])
     if not rules_list:
         await update.message.reply_text("ℹ️ No rules added yet. Admin can use /addrule.")
         return
@@ -217,9 +2345,9 @@ async def addrule(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("⚠️ Usage: /addrule Your rule text here")
         return
 
-    rules_list = load_state("rules_list", default_value=[])
+    rules_list = await load_state("rules_list", default_value=[])
     rules_list.append(text)
-    save_state("rules_list", rules_list)
+    await save_state("rules_list", rules_list)
     await update.message.reply_text("✅ Rule added.")
 
 async def register(update: Update, context: ContextTypes.DEFAULT_TYPE): 
@@ -236,17 +2364,17 @@ async def register(update: Update, context: ContextTypes.DEFAULT_TYPE):
     #     return 
     # --- END REMOVAL ---
 
-    if is_locked(): 
+    if await is_locked(): 
         await update.message.reply_text("⚠️ Another player is registering. Please try again in a few minutes.") 
         return 
 
-    players = load_state("players") 
-    if str(user.id) in players: 
+    registered_ids = await load_keys("players") # Shallow read: ids only
+    if str(user.id) in registered_ids: 
         await update.message.reply_text("✅ You are already registered.") 
         return 
 
     # --- THIS IS THE CORRECT LOCATION AND FIX FOR THE RETURN STATEMENT ---
-    if len(players) >= MAX_PLAYERS:
+    if len(registered_ids) >= MAX_PLAYERS:
         await update.message.reply_text(
             f"❌ Registration is now closed\! The tournament has reached its maximum of *{MAX_PLAYERS}* players\.",
             parse_mode=ParseMode.MARKDOWN_V2 # Make sure ParseMode is imported from telegram.constants
@@ -254,28 +2382,28 @@ async def register(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return # <--- THIS IS THE MISSING RETURN THAT STOPS THE FUNCTION
     # --- END OF FIX ---
 
-    tournament_state = load_state("tournament_state") 
+    tournament_state = await load_state("tournament_state") 
     current_stage = tournament_state.get("stage", "registration") 
     if current_stage != "registration": 
         await update.message.reply_text("❌ Registration is closed. The tournament has already started.") 
         return 
 
-    lock_user(user.id) 
+    await lock_user(user.id) 
 
     try: 
         await context.bot.send_message( 
             chat_id=user.id, 
             text="📝 Let's get you registered!\nPlease select your national team:", 
-            reply_markup=InlineKeyboardMarkup(build_team_buttons()) 
+            reply_markup=InlineKeyboardMarkup(await build_team_buttons()) 
         ) 
         await update.message.reply_text("📩 Check your DM to complete registration.") 
     except Exception as e: 
-        print(f"Error sending DM for registration: {e}") 
+        handler_log.error("Error sending DM for registration: %s", e)
         await update.message.reply_text("❌ Couldn't send DM. Please start the bot first: @e_tournament_bot") 
-        unlock_user()
-def build_team_buttons():
-    players = load_state("players")
-    taken_teams = {p['team'] for p in players.values()}
+        await unlock_user()
+async def build_team_buttons():
+    player_index = await load_player_index()
+    taken_teams = {p['team'] for p in player_index.values()}
     available = [(flag, name) for flag, name in TEAM_LIST if f"{flag} {name}" not in taken_teams]
 
     keyboard = []
@@ -294,12 +2422,12 @@ async def handle_team_selection(update: Update, context: ContextTypes.DEFAULT_TY
     user = query.from_user
     await query.answer()
 
-    if user.id != get_locked_user():
+    if user.id != await get_locked_user():
         await query.edit_message_text("⚠️ You are not allowed to register now. Please wait your turn.")
         return ConversationHandler.END
 
     team_full_name = query.data.split(':', 1)[1]
-    set_selected_team(team_full_name)
+    await set_selected_team(team_full_name)
 
     await query.edit_message_text(f"✅ Team selected: {team_full_name}\n\nNow send your PES username:")
     return REGISTER_PES
@@ -309,12 +2437,11 @@ async def handle_team_selection(update: Update, context: ContextTypes.DEFAULT_TY
 async def receive_pes_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     pes_name = update.message.text.strip()
-    players = load_state("players")
 
-    team = get_locked_team()
+    team = await get_locked_team()
     if not team:
         await update.message.reply_text("❌ Something went wrong. Try /register again.")
-        unlock_user()
+        await unlock_user()
         return ConversationHandler.END
 
     # --- THESE LINES ARE CRUCIAL AND MUST BE HERE ---
@@ -323,7 +2450,7 @@ async def receive_pes_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     html_escaped_team_name = html.escape(team) # team is already defined above, so we can escape it
     # -------------------------------------------------
 
-    players[str(user.id)] = {
+    player_record = {
         "name": user.first_name,
         "username": user.username or "NoUsername",
         "team": team,
@@ -332,8 +2459,12 @@ async def receive_pes_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "stats": {"wins": 0, "draws": 0, "losses": 0, "gf": 0, "ga": 0, "points": 0, "gd": 0}
     }
 
-    save_state("players", players)
-    unlock_user()
+    # Write only the new record and its index entry, not the whole players tree
+    await update_state({
+        f"players/{user.id}": player_record,
+        f"player_index/{user.id}": player_index_entry(player_record),
+    })
+    await unlock_user()
 
     # Message to the user's DM (removed duplicate)
     await context.bot.send_message(
@@ -357,27 +2488,289 @@ async def receive_pes_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def cancel_registration(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    if user_id == get_locked_user():
-        unlock_user()
+    if user_id == await get_locked_user():
+        await unlock_user()
         await update.message.reply_text("❌ Registration cancelled.")
     else:
         await update.message.reply_text("ℹ️ No active registration to cancel.")
     return ConversationHandler.END
 
+BOT_COMMANDS = [
+    BotCommand("start", "Start the bot"),
+    BotCommand("register", "Register for the tournament"),
+    BotCommand("fixtures", "View upcoming matches"),
+    BotCommand("standings", "View group standings"),
+    BotCommand("rules", "Show tournament rules"),
+    BotCommand("players", "List registered players"),
+    BotCommand("odds", "Group qualification odds"),
+    BotCommand("rating", "Your Elo rating"),
+    BotCommand("champions", "Past champions"),
+    BotCommand("leaderboard", "All-time leaderboard"),
+    BotCommand("h2h", "Head-to-head record of two players"),
+    BotCommand("career", "Career stats across seasons"),
+    BotCommand("available", "Set when you can play"),
+    BotCommand("kickoffs", "Scheduled kickoff times"),
+    # Admin Commands
+    BotCommand("start_tournament", "Admin: Start the group stage"),
+    BotCommand("addscore", "Admin: Add match scores"),
+]
+
 async def set_bot_commands(application_instance):
-    commands = [
-        BotCommand("start", "Start the bot"),
-        BotCommand("register", "Register for the tournament"),
-        BotCommand("fixtures", "View upcoming matches"),
-        BotCommand("standings", "View group standings"),
-        BotCommand("rules", "Show tournament rules"),
-        BotCommand("players", "List registered players"),
-        # Admin Commands
-        BotCommand("start_tournament", "Admin: Start the group stage"),
-        BotCommand("addscore", "Admin: Add match scores"),
-    ]
-    await application_instance.bot.set_my_commands(commands)
-    # print("Bot commands set.") # This print will now happen after the await
+    """Calls set_my_commands only when the command list differs from the one last published."""
+    commands_hash = hashlib.sha1(
+        json.dumps([[c.command, c.description] for c in BOT_COMMANDS]).encode("utf-8")
+    ).hexdigest()
+    meta = await load_state("meta")
+    if meta.get("bot_commands_hash") == commands_hash:
+        log.info("Bot commands unchanged, skipping set_my_commands")
+        return False
+    await application_instance.bot.set_my_commands(BOT_COMMANDS)
+    meta["bot_commands_hash"] = commands_hash
+    await save_state("meta", meta)
+    return True
+
+# === TOURNAMENT RNG ===
+# Every random choice a tournament makes (pots, the draw, reveal order, odds simulations) comes
+# from a stream derived from one seed, stored as tournament_state/seed, so any of them can be
+# replayed. Streams are independent per purpose: replaying the draw does not depend on how
+# many simulations ran before it.
+TOURNAMENT_SEED = os.environ.get("TOURNAMENT_SEED") # Same seed for every tournament (testing); random when unset
+
+def new_tournament_seed():
+    return int(TOURNAMENT_SEED) if TOURNAMENT_SEED else random.SystemRandom().randrange(2 ** 32)
+
+def tournament_rng(seed, purpose):
+    """Random stream for one purpose. String seeds are hashed with SHA-512, so this is stable
+    across processes and Python runs (unlike hash())."""
+    return random.Random(f"{seed}:{purpose}")
+
+async def replay_draw(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/replay_draw — re-runs the group draw from its stored seed and inputs and checks that it
+    gives the groups on record. Works from tournament_state alone; nothing else is read."""
+    tournament_state = await load_state("tournament_state")
+    draw = tournament_state.get("draw")
+    if not draw:
+        await update.message.reply_text("ℹ️ No draw has been made yet.")
+        return
+    start_time = time.perf_counter()
+    try:
+        replayed = run_draw(draw)
+    except DrawError as e:
+        await update.message.reply_text(f"❌ Replaying the draw failed: {e}")
+        return
+    elapsed_ms = (time.perf_counter() - start_time) * 1000
+    recorded = await load_state("groups")
+    matches = all(recorded.get(group_name) == player_ids for group_name, player_ids in replayed.items()) and len(recorded) == len(replayed)
+    lines = [f"🎲 Draw replayed from seed {draw['seed']} in {elapsed_ms:.0f} ms: "
+             + ("identical to the recorded groups ✅" if matches else "DIFFERS from the recorded groups ❌")]
+    teams = await load_player_index()
+    for group_name, player_ids in replayed.items():
+        lines.append(f"{group_name}: " + ", ".join(teams.get(p_id, {}).get("team", p_id) for p_id in player_ids))
+    await update.message.reply_text("\n".join(lines))
+
+# === GROUP DRAW ===
+# Pot draw with separation rules. Pots come from the admin (/setpot), from ratings (RATING_POTS)
+# or, failing both, from a shuffle; a group takes at most one player from each pot.
+# DRAW_SEPARATE names the attributes group-mates may not share beyond their limit: "confederation"
+# (from the team; UEFA may have two per group, as at the World Cup) and "clan" (set with /setclan).
+# The search places the player with the fewest legal groups next; every placement prunes that
+# group from the players it now excludes, so dead ends show up before they are walked into.
+# Pots and placements come from the tournament's RNG streams (see TOURNAMENT RNG), and the
+# draw's inputs are stored under tournament_state/draw, so /replay_draw can re-run it exactly.
+DRAW_SEPARATE = tuple(name.strip() for name in os.environ.get("DRAW_SEPARATE", "confederation,clan").split(",") if name.strip())
+DRAW_MAX_STEPS = int(os.environ.get("DRAW_MAX_STEPS", 200000))
+SEPARATION_LIMITS = {("confederation", "UEFA"): 2} # Everything else: one per group
+TEAM_CONFEDERATIONS = {
+    "Brazil": "CONMEBOL", "Argentina": "CONMEBOL", "Uruguay": "CONMEBOL", "Colombia": "CONMEBOL",
+    "Chile": "CONMEBOL", "Ecuador": "CONMEBOL",
+    "France": "UEFA", "Germany": "UEFA", "Spain": "UEFA", "Italy": "UEFA", "England": "UEFA",
+    "Portugal": "UEFA", "Netherlands": "UEFA", "Belgium": "UEFA", "Croatia": "UEFA",
+    "Switzerland": "UEFA", "Poland": "UEFA", "Serbia": "UEFA", "Denmark": "UEFA",
+    "Mexico": "CONCACAF", "USA": "CONCACAF", "Canada": "CONCACAF",
+    "Japan": "AFC", "South Korea": "AFC", "Australia": "AFC", "Qatar": "AFC", "Saudi Arabia": "AFC", "Iran": "AFC",
+    "Senegal": "CAF", "Morocco": "CAF", "Ghana": "CAF", "Cameroon": "CAF",
+}
+
+class DrawError(Exception):
+    """No allocation satisfies the pots and separation rules, or the search gave up."""
+
+def team_confederation(team):
+    return TEAM_CONFEDERATIONS.get((team or "").split(" ", 1)[-1]) # Teams are stored as "<flag> <name>"
+
+def draw_attributes(players):
+    """{player_id: [(attribute, value), ...]} for the DRAW_SEPARATE rules that apply to each player."""
+    attributes = {}
+    for p_id, player_info in players.items():
+        values = {"confederation": team_confederation(player_info.get("team")),
+                  "clan": (player_info.get("clan") or "").strip().lower() or None}
+        attributes[p_id] = [(name, values[name]) for name in DRAW_SEPARATE if values.get(name)]
+    return attributes
+
+def draw_pots(players, ratings, group_count, rng):
+    """Pots as lists of player IDs: admin-set pots, rating pots (RATING_POTS) or random ones."""
+    admin_pots = {p_id: info["pot"] for p_id, info in players.items() if info.get("pot")}
+    if admin_pots:
+        unpotted = len(players) - len(admin_pots)
+        if unpotted:
+            raise DrawError(f"{unpotted} player(s) have no pot; set one with /setpot or clear them all")
+        return [sorted(p_id for p_id, pot in admin_pots.items() if pot == number) for number in sorted(set(admin_pots.values()))]
+    if RATING_POTS:
+        return rating_pots(players, ratings, group_count)
+    shuffled = sorted(players)
+    rng.shuffle(shuffled)
+    return [sorted(shuffled[start:start + group_count]) for start in range(0, len(shuffled), group_count)]
+
+def solve_draw(pots, group_names, attributes, rng, max_steps=DRAW_MAX_STEPS):
+    """
+    Allocates every potted player to a group: one per pot per group, and no more players sharing
+    an attribute value in a group than its separation limit. Returns {group_name: [player_id, ...]}
+    in pot order; the same pots, attributes and rng state always give the same draw.
+    """
+    group_count = len(group_names)
+    # Every group takes one player from every pot, so pots must fill the groups exactly;
+    # uneven pots would leave groups of other sizes, which get no round-robin schedule
+    uneven = [f"{i + 1} ({len(pot)})" for i, pot in enumerate(pots) if len(pot) != group_count]
+    if uneven:
+        raise DrawError(f"Every pot needs exactly {group_count} players, one per group; pot(s) {', '.join(uneven)} don't")
+    pot_of = {p_id: i for i, pot in enumerate(pots) for p_id in pot}
+    players = [p_id for pot in pots for p_id in pot]
+    sharing = defaultdict(list) # (attribute, value) -> players carrying it
+    for p_id in players:
+        for attribute in attributes.get(p_id, ()):
+            sharing[attribute].append(p_id)
+    for attribute, members in sharing.items():
+        if len(members) > SEPARATION_LIMITS.get(attribute, 1) * group_count:
+            raise DrawError(f"Too many players share {attribute[0]} {attribute[1]} to keep them apart")
+
+    domains = {p_id: set(range(group_count)) for p_id in players}
+    counts = defaultdict(int) # (group, attribute) -> players placed
+    placement = {}
+
+    def feasible(p_id, removed):
+        """Counting checks on what the last placement touched: the open players of a pot need as
+        many distinct groups, and those sharing an attribute need that much room left for it."""
+        for pot_index in {pot_of[p_id]} | {pot_of[other] for other in removed}:
+            open_players = [other for other in pots[pot_index] if other not in placement]
+            if len(set().union(*(domains[other] for other in open_players))) < len(open_players):
+                return False
+        for attribute in {a for other in [p_id, *removed] for a in attributes.get(other, ())}:
+            open_players = [other for other in sharing[attribute] if other not in placement]
+            room = sum(SEPARATION_LIMITS.get(attribute, 1) - counts[group, attribute]
+                       for group in set().union(*(domains[other] for other in open_players)))
+            if room < len(open_players):
+                return False
+        return True
+
+    def place(p_id, group, removed):
+        """Places a player and prunes `group` where it is now illegal. False on a dead end."""
+        placement[p_id] = group
+        excluded = [other for other in pots[pot_of[p_id]] if other not in placement]
+        for attribute in attributes.get(p_id, ()):
+            counts[group, attribute] += 1
+            if counts[group, attribute] >= SEPARATION_LIMITS.get(attribute, 1):
+                excluded.extend(other for other in sharing[attribute] if other not in placement)
+        for other in excluded:
+            if group in domains[other]:
+                domains[other].discard(group)
+                removed.append(other)
+                if not domains[other]:
+                    return False
+        return feasible(p_id, removed)
+
+    def unplace(p_id, group, removed):
+        del placement[p_id]
+        for attribute in attributes.get(p_id, ()):
+            counts[group, attribute] -= 1
+        for other in removed:
+            domains[other].add(group)
+
+    def attempt(budget):
+        """Depth-first search (iterative: one level per player) within `budget` steps.
+        True when every player is placed, False when out of budget, DrawError when exhausted."""
+        tiebreak = {p_id: rng.random() for p_id in players} # Random order among equally constrained players
+        stack = [] # [player, untried groups, placed group, pruned players]
+        descend = True
+        for _ in range(budget):
+            if descend:
+                if len(placement) == len(players):
+                    return True
+                p_id = min((other for other in players if other not in placement), key=lambda other: (len(domains[other]), tiebreak[other]))
+                choices = sorted(domains[p_id])
+                rng.shuffle(choices)
+                stack.append([p_id, choices, None, None])
+            frame = stack[-1]
+            p_id, choices, group, removed = frame
+            if group is not None:
+                unplace(p_id, group, removed)
+            descend = False
+            while choices:
+                group, removed = choices.pop(), []
+                if place(p_id, group, removed):
+                    frame[2:] = group, removed
+                    descend = True
+                    break
+                unplace(p_id, group, removed)
+            if not descend:
+                stack.pop()
+                if not stack:
+                    raise DrawError("No draw satisfies the pots and separation rules")
+        for p_id, _, group, removed in reversed(stack):
+            if group is not None:
+                unplace(p_id, group, removed)
+        return False
+
+    # Randomised restarts with a doubling budget cut off the long unlucky runs a single search can take
+    budget, spent = 4 * len(players) + 100, 0
+    while spent < max_steps:
+        if attempt(min(budget, max_steps - spent)):
+            groups = {}
+            for p_id in players:
+                groups.setdefault(group_names[placement[p_id]], []).append(p_id)
+            return {name: groups[name] for name in group_names if name in groups}
+        spent += budget
+        budget *= 2
+    raise DrawError(f"No draw found within {max_steps} steps")
+
+def run_draw(draw):
+    """{group_name: [player_id, ...]} in reveal order, computed from a stored draw record alone."""
+    attributes = {p_id: [tuple(attribute) for attribute in values] for p_id, values in (draw.get("attributes") or {}).items()}
+    groups = solve_draw(draw["pots"], draw["groups"], attributes, tournament_rng(draw["seed"], "draw"))
+    reveal = tournament_rng(draw["seed"], "reveal")
+    for group_name in sorted(groups):
+        reveal.shuffle(groups[group_name])
+    return groups
+
+async def set_player_draw_field(update, context, field, usage, parse):
+    """Shared body of /setpot and /setclan: admin only, before the draw, `<player_id> <value>`."""
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("❌ Only the admin can change draw settings.")
+        return
+    if len(context.args) < 2:
+        await update.message.reply_text(usage)
+        return
+    if (await load_state("tournament_state")).get("stage") != "registration":
+        await update.message.reply_text("❌ The draw has already been made.")
+        return
+    player_id, raw_value = context.args[0], " ".join(context.args[1:])
+    if player_id not in await load_player_index():
+        await update.message.reply_text(f"❌ No registered player with ID {player_id}.")
+        return
+    value = parse(raw_value)
+    if value is False:
+        await update.message.reply_text(usage)
+        return
+    await update_state({f"players/{player_id}/{field}": value})
+    await update.message.reply_text(f"✅ {field.capitalize()} for {player_id}: {value if value is not None else 'cleared'}")
+
+async def set_pot_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin: /setpot <player_id> <pot> — puts a player in a draw pot (1 is the top pot, 0 clears)."""
+    await set_player_draw_field(update, context, "pot", "Usage: /setpot <player_id> <pot> (0 clears)",
+                                lambda raw: (int(raw) or None) if raw.isdigit() else False)
+
+async def set_clan_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin: /setclan <player_id> <clan> — players of one clan are drawn into different groups ("-" clears)."""
+    await set_player_draw_field(update, context, "clan", "Usage: /setclan <player_id> <clan> (- clears)",
+                                lambda raw: None if raw.strip() == "-" else raw.strip())
 
 # === TOURNAMENT LOGIC ===
 def make_group_fixtures(groups: dict):
@@ -416,24 +2809,28 @@ async def start_tournament(update, context):
         await update.message.reply_text("❌ Only the admin can start the tournament\\.", parse_mode=ParseMode.MARKDOWN_V2)
         return
 
-    players = load_state("players")
+    players = await load_state("players")
     # Player count check
     if len(players) != 32:
         await update.message.reply_text(f"❌ Need exactly 32 players to start the tournament\\. Currently have {len(players)}\\.", parse_mode=ParseMode.MARKDOWN_V2)
         return
 
-    tournament_state = load_state("tournament_state")
+    tournament_state = await load_state("tournament_state")
     # Tournament stage check
     if tournament_state.get("stage") != "registration":
         await update.message.reply_text("❌ The tournament has already started or is in an advanced stage\\. Use /reset_tournament to restart\\.", parse_mode=ParseMode.MARKDOWN_V2)
         return
 
-    # Initial message to admin (before drawing starts)
-    await update.message.reply_text("🎉 The tournament is starting\\! Initiating live group drawing\\.\\.\\.", parse_mode=ParseMode.MARKDOWN_V2)
-
     # 1. Make groups and get the group assignments back IN MEMORY
     # make_groups function is assumed to be defined elsewhere and correctly assigns groups
-    players_with_groups, groups_structure = await make_groups(context) 
+    try:
+        players_with_groups, groups_structure, draw = await make_groups(context)
+    except DrawError as e:
+        await update.message.reply_text(f"❌ The group draw failed: {escape_markdown_v2(str(e))}", parse_mode=ParseMode.MARKDOWN_V2)
+        return
+
+    # Initial message to admin (before drawing starts)
+    await update.message.reply_text("🎉 The tournament is starting\\! Initiating live group drawing\\.\\.\\.", parse_mode=ParseMode.MARKDOWN_V2)
 
     # 2. Perform the live drawing s based on the allocated groups
     # State (players and groups) will be saved INSIDE _perform_live_group_drawing after all announcements
@@ -452,15 +2849,19 @@ async def start_tournament(update, context):
         "final": []
     }
 
-    print(f"DEBUG: Fixtures data *before* saving to Firebase: {json.dumps(fixtures_data, indent=2)}")
+    tournament_log.info("Generated group fixtures for %d groups", len(group_stage_fixtures))
 
     # 5. Perform the single, final save of the complete fixtures data
-    save_state("fixtures", fixtures_data)
+    await save_state("fixtures", fixtures_data)
 
     # 6. Update tournament state - Initialize current group match round
     tournament_state["stage"] = "group_stage" # Now safe to change stage
     tournament_state["group_match_round"] = 0 
-    save_state("tournament_state", tournament_state)
+    tournament_state["seed"] = draw["seed"] # Seeds every later random stream of this tournament
+    tournament_state["draw"] = draw
+    await record_match_event("round_advanced", {"tournament_state": tournament_state, "match_index": build_match_index(fixtures_data),
+                                                "match_views": build_match_views(fixtures_data, tournament_state, players_with_groups)},
+                             stage="group_stage", round=0)
 
     # Final messages to admin and group chat after everything is done (group drawing and fixtures)
     final_message_for_admin = "✅ Group drawing complete and fixtures generated\\! Tournament is officially in the Group Stage\\!"
@@ -474,36 +2875,37 @@ async def start_tournament(update, context):
             parse_mode=ParseMode.MARKDOWN_V2
         )
     
-    print("DEBUG: Start tournament command finished and all final messages sent.")
+    await broadcast_fixtures(context, await load_pending_matches(tournament_state), "Round 1 fixtures")
+
+    tournament_log.debug("Start tournament command finished and all final messages sent.")
 async def make_groups(context):
     """
     Allocates registered players into groups in memory.
     It DOES NOT save state here.
-    Returns (players_data_with_groups, groups_structure).
+    Returns (players_data_with_groups, groups_structure, draw).
     """
-    players = load_state("players") # Load players initially
-    player_ids = list(players.keys())
-    random.shuffle(player_ids)
-
-    groups = defaultdict(list)
+    players = await load_state("players") # Load players initially
     group_names = [f"Group {chr(65 + i)}" for i in range(8)]
 
+    # Pots and separation rules decide the groups (see GROUP DRAW); raises DrawError if impossible.
+    # The record holds everything the draw used, so run_draw(draw) gives the same groups again.
+    seed = new_tournament_seed()
+    pots = draw_pots(players, await load_ratings() if RATING_POTS else {}, len(group_names), tournament_rng(seed, "pots"))
+    draw = {"seed": seed, "groups": group_names, "pots": pots, "separate": list(DRAW_SEPARATE),
+            "attributes": {p_id: [list(attribute) for attribute in values] for p_id, values in draw_attributes(players).items() if values}}
+    groups_structure = run_draw(draw)
+
     # Temporary players_data to hold in-memory changes
     players_data_with_groups = players.copy() 
 
-    for i, player_id in enumerate(player_ids):
-        group_name = group_names[i % 8]
-        groups[group_name].append(player_id)
-        players_data_with_groups[player_id]['group'] = group_name # Update group in temp dict
+    for group_name, player_ids in groups_structure.items():
+        for player_id in player_ids:
+            players_data_with_groups[player_id]['group'] = group_name # Update group in temp dict
 
-    # Convert defaultdict to regular dict for groups before returning
-    groups_structure = {name: ids for name, ids in groups.items()}
-
-    print("DEBUG: make_groups calculated groups in memory. Not saved yet.")
-    return players_data_with_groups, groups_structure
+    tournament_log.debug("make_groups calculated groups in memory. Not saved yet.")
+    return players_data_with_groups, groups_structure, draw
 
 def make_group_fixtures(groups: dict):
-    fixtures_data = load_state("fixtures") # Temporarily load to potentially merge if needed, but not saving back here
     group_stage_fixtures = {}
 
     for group_name, player_ids_in_group in groups.items():
@@ -521,7 +2923,7 @@ async def _perform_live_group_drawing(context, players_data, allocated_groups):
     Performs the live drawing announcements with delays, with a FIFA World Cup draw style.
     Crucially, it SAVES the updated players and groups state AFTER all announcements.
     """
-    print("DEBUG: _perform_live_group_drawing function started. Will save state at the end\.")
+    tournament_log.debug("_perform_live_group_drawing function started. Will save state at the end.")
 
     initial_drawing_message = (
         "✨ FIFA Tournament Live Drawing in progress\.\.\. ✨\n\n"
@@ -543,8 +2945,7 @@ async def _perform_live_group_drawing(context, players_data, allocated_groups):
 
     # Iterate through each group for announcements
     for group_name in sorted_group_names:
-        player_ids_in_group = allocated_groups[group_name]
-        random.shuffle(player_ids_in_group) # Shuffle players *within* this group for drawing sequence
+        player_ids_in_group = allocated_groups[group_name] # Already in reveal order (see run_draw)
 
         # Announce the start of drawing for this specific group with fanfare
         group_start_message = f"Next up: The exciting draw for *Group {escape_markdown_v2(group_name).upper()}* is about to begin\\!"
@@ -586,7 +2987,7 @@ async def _perform_live_group_drawing(context, players_data, allocated_groups):
                 f"is officially assigned to *Group {escape_markdown_v2(assigned_group)}*\\! 🏆"
             )
             
-            print(f"DEBUG: Sending final team announcement for {team_name}: '{final_team_announcement}'")
+            tournament_log.debug("Sending final team announcement for %s: '%s'", team_name, final_team_announcement)
             await context.bot.send_message(
                 chat_id=GROUP_ID,
                 text=final_team_announcement,
@@ -596,7 +2997,7 @@ async def _perform_live_group_drawing(context, players_data, allocated_groups):
             # Add player's display name to the list for the group summary
             group_summary_list.append(f"{escape_markdown_v2(team_name)} \\(@{escape_markdown_v2(username)}\\)")
 
-            print(f"DEBUG: Announcing {team_name} in {assigned_group}.")
+            tournament_log.debug("Announcing %s in %s.", team_name, assigned_group)
 
             # Delay between individual player announcements within the same group
             if i < len(player_ids_in_group) - 1: # No delay after the last player of a group
@@ -626,9 +3027,9 @@ async def _perform_live_group_drawing(context, players_data, allocated_groups):
             await asyncio.sleep(15) # Longer delay between groups
 
     # Crucial: SAVE STATE AFTER ALL ANNOUNCEMENTS ARE DONE
-    save_state("players", players_data) # Save players with their new group assignments
-    save_state("groups", allocated_groups) # Save the complete group structure
-    print("DEBUG: All drawing announcements complete. Players and Groups state SAVED.")
+    await save_state("players", players_data) # Save players with their new group assignments
+    await save_state("groups", allocated_groups) # Save the complete group structure
+    tournament_log.debug("All drawing announcements complete. Players and Groups state SAVED.")
 
     # Final summary message for the admin
     final_drawing_summary = "✅ Live group drawing complete\\! All teams have been announced\\." 
@@ -637,7 +3038,7 @@ async def _perform_live_group_drawing(context, players_data, allocated_groups):
         text=final_drawing_summary,
         parse_mode=ParseMode.MARKDOWN_V2
     )
-    print("DEBUG: _perform_live_group_drawing finished.")
+    tournament_log.debug("_perform_live_group_drawing finished.")
 def generate_round_robin_schedule(players_in_group):
     """
     Generates a round-robin schedule for 4 players over 3 rounds.
@@ -647,7 +3048,7 @@ def generate_round_robin_schedule(players_in_group):
     if len(players_in_group) != 4:
         # This function is specifically for groups of 4. Adjust if group sizes vary.
         # For other sizes, a different scheduling algorithm would be needed.
-        print(f"WARNING: Group size is not 4. Cannot generate round-robin schedule for: {players_in_group}")
+        tournament_log.warning("Group size is not 4. Cannot generate round-robin schedule for: %s", players_in_group)
         return []
 
     schedule = []
@@ -676,173 +3077,68 @@ import json # Ensure this is at the top of your bot.py file for any debugging pr
 
 async def fixtures(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
-    print(f"DEBUG: Fixtures command received from user_id: {user_id}")
-
-    players = load_state("players")
-    fixtures_data = load_state("fixtures")
-    tournament_state = load_state("tournament_state")
-    current_stage = tournament_state.get("stage", "registration")
-    current_group_round = tournament_state.get("group_match_round", 0)
-
-    if user_id not in players:
-        await update.message.reply_text("❌ You are not registered for the tournament\. Use /register\.", parse_mode=ParseMode.MARKDOWN_V2)
-        print(f"DEBUG: User {user_id} not in players.")
+    handler_log.debug("Fixtures command received from user_id: %s", user_id)
+
+    # One lookup in the precomputed views (see MATCH VIEWS); no fixtures scan
+    view = (await load_match_views()).get(user_id)
+    if view is None:
+        if user_id not in await load_player_index():
+            await update.message.reply_text("❌ You are not registered for the tournament\\. Use /register\\.", parse_mode=ParseMode.MARKDOWN_V2)
+            handler_log.debug("User %s not in players.", user_id)
+        else:
+            await update.message.reply_text("❌ No upcoming match found for you yet\\. Fixtures appear here once your round is drawn\\.", parse_mode=ParseMode.MARKDOWN_V2)
+            handler_log.debug("No match view for %s.", user_id)
         return
 
-    player_info = players[user_id]
-    print(f"DEBUG: Player info for {user_id}: {player_info}")
-    reply_text = ""
-    found_fixture = False
-
-    if current_stage == "group_stage":
-        player_group = player_info.get("group")
-        print(f"DEBUG: User {user_id}'s group: {player_group}")
-
-        if not player_group or player_group not in fixtures_data.get("group_stage", {}):
-            await update.message.reply_text("❌ Your group fixtures are not yet available\.", parse_mode=ParseMode.MARKDOWN_V2)
-            print(f"DEBUG: Group '{player_group}' not found in fixtures_data group_stage.")
-            return
-
-        # Escape header elements
-        escaped_player_team_header = escape_markdown_v2(player_info.get('team', ''))
-        escaped_player_group_header = escape_markdown_v2(player_info.get('group', 'No Group'))
-        reply_text += f"📅 Your Group Matches \- {escaped_player_team_header} \({escaped_player_group_header}\) \- Match {escape_markdown_v2(str(current_group_round + 1))}\n\n"
-
-        group_matches = fixtures_data["group_stage"][player_group]
-        print(f"DEBUG: Group '{player_group}' matches loaded: {json.dumps(group_matches, indent=2)}")
-
-        if not group_matches:
-            reply_text = "❌ No matches found for your group\."
-            await update.message.reply_text(reply_text, parse_mode=ParseMode.MARKDOWN_V2)
-            print(f"DEBUG: Group '{player_group}' has no matches listed.")
-            return
-
-        current_round_matches_for_user = []
-        for match_index, match in enumerate(group_matches):
-            if not isinstance(match, list) or len(match) < 5:
-                print(f"WARNING: Malformed match data (too short) in Firebase for Group {player_group}, Match index {match_index}: {match}")
-                continue
-
-            # Check if this match belongs to the current round
-            if match[4] == current_group_round: # match[4] is the round_number
-                if user_id in match[0:2]:
-                    current_round_matches_for_user.append(match)
-                    found_fixture = True # At least one match for the user in this round
-
-        if not current_round_matches_for_user:
-            # If no matches found specifically for the user in the current round
-            await update.message.reply_text("✅ Your match for this round is completed or you have no active match for the current round\. Please wait for the admin to advance to the next round\.", parse_mode=ParseMode.MARKDOWN_V2)
-            print(f"DEBUG: No active match found for {user_id} in Round {current_group_round}.")
-            return # Exit after sending this specific message
-
-        # Now, iterate only through the matches relevant to the user for the current round
-        for match in current_round_matches_for_user:
-            opponent_id = match[1] if match[0] == user_id else match[0]
-            opponent_info = players.get(opponent_id)
-
-            if opponent_info:
-                # Escape all dynamic text that goes into the reply
-                escaped_player_team = escape_markdown_v2(player_info.get('team', ''))
-                escaped_opponent_team = escape_markdown_v2(opponent_info.get('team', ''))
-                escaped_opponent_username = escape_markdown_v2(opponent_info.get('username', ''))
-
-                if match[2] is not None and match[3] is not None:
-                    # If match is finished, display as scoreboard
-                    reply_text += (
-                        f"🏆 Match Result \(Round {escape_markdown_v2(str(match[4] + 1))}\):\n"
-                        f"*{escaped_player_team} {match[2]} \- {match[3]} {escaped_opponent_team}*\n"
-                        f"🎮 Opponent: @{escaped_opponent_username}\n\n"
-                    )
-                else:
-                    # If match is pending
-                    reply_text += (
-                        f"MATCHDAY \( {escape_markdown_v2(str(match[4] + 1))}\):\n"
-                        f"{escaped_player_team} vs {escaped_opponent_team} \(Pending\)\n"
-                        f"🎮 Opponent: @{escaped_opponent_username}\n\n"
-                    )
-            else:
-                print(f"DEBUG: Opponent {opponent_id} not found in 'players' data.")
-                # Consider adding a message for this case if it's a common occurrence
-                escaped_player_team = escape_markdown_v2(player_info.get('team', ''))
-                reply_text += f"MATCHDAY \( {escape_markdown_v2(str(match[4] + 1))}\):\n" \
-                              f"{escaped_player_team} vs Unknown Opponent \(Pending\)\n" \
-                              f"🎮 Opponent: @unknown\n\n" # Fallback if username is missing
-
-
-    elif current_stage in ["round_of_16", "quarter_finals", "semi_finals", "final"]:
-        knockout_matches = fixtures_data.get(current_stage, [])
-        if not knockout_matches:
-            await update.message.reply_text("❌ Knockout matches for this stage are not yet drawn\.", parse_mode=ParseMode.MARKDOWN_V2)
-            print(f"DEBUG: No knockout matches for stage {current_stage}.")
-            return
-
-        # Header for knockout stage matches
-        stage_title_escaped_header = escape_markdown_v2(current_stage.replace('_', ' ').title())
-        player_team_escaped_header = escape_markdown_v2(player_info.get('team', ''))
-        reply_text += f"📅 Your Knockout Match \- {player_team_escaped_header} \({stage_title_escaped_header}\)\n\n"
-
-        for match_index, match in enumerate(knockout_matches):
-            if not isinstance(match, list) or len(match) < 5:# Assuming knockout matches are 4 elements
-                print(f"WARNING: Malformed knockout match data (too short) in Firebase for stage {current_stage}, Match index {match_index}: {match}")
-                continue
-
-            print(f"DEBUG: Processing knockout match {match_index}: {match}")
-            if user_id == match[0] or user_id == match[1]:
-                opponent_id = match[1] if match[0] == user_id else match[0]
-                opponent_info = players.get(opponent_id)
-                print(f"DEBUG: Opponent info for {opponent_id}: {opponent_info}")
-
-                if opponent_info:
-                    # Escape all dynamic text that goes into the reply
-                    player_team_escaped = escape_markdown_v2(player_info.get('team', ''))
-                    opponent_team_escaped = escape_markdown_v2(opponent_info.get('team', ''))
-                    opponent_username_escaped = escape_markdown_v2(opponent_info.get('username', ''))
-                    stage_title_escaped = escape_markdown_v2(current_stage.replace('_', ' ').title())
-
-                    if match[2] is not None and match[3] is not None:
-                        # If match is finished, display as scoreboard
-                        reply_text += (
-                            f"🏆 Match Result \(*{stage_title_escaped}*\):\n"
-                            f"*{player_team_escaped} {match[2]} \- {match[3]} {opponent_team_escaped}*\n"
-                            f"🎮 Opponent: @{opponent_username_escaped}\n\n"
-                        )
-                    else:
-                        # If match is pending
-                        reply_text += (
-                            f"📅 Your Match \(*{stage_title_escaped}*\):\n"
-                            f"{player_team_escaped} vs {opponent_team_escaped} \(Pending\)\n"
-                            f"🎮 Opponent: @{opponent_username_escaped}\n\n"
-                        )
-                    found_fixture = True
-                    print(f"DEBUG: Fixture found and added to reply for {user_id}.")
-                    break # Stop after finding the user's match
-                else:
-                    print(f"DEBUG: Opponent {opponent_id} not found in 'players' data for knockout match.")
-                    # Handle case where opponent info is missing, still display partial info
-                    player_team_escaped = escape_markdown_v2(player_info.get('team', ''))
-                    stage_title_escaped = escape_markdown_v2(current_stage.replace('_', ' ').title())
-                    reply_text += (
-                        f"📅 Your Match \(*{stage_title_escaped}*\):\n"
-                        f"{player_team_escaped} vs Unknown Opponent \(Pending\)\n"
-                        f"🎮 Opponent: @unknown\n\n" # Fallback if username is missing
-                    )
-                    found_fixture = True # We still found *a* fixture, even if opponent is missing.
-                    break
-            else:
-                print(f"DEBUG: User {user_id} not in knockout match {match_index}'s player IDs ({match[0]}, {match[1]}).")
-
-        # If after checking all knockout matches, no fixture was found for the user
-        if not found_fixture:
-            reply_text = "❌ No upcoming match found for you or your matches are already completed for this stage\."
-            print(f"DEBUG: No fixture found for {user_id} in {current_stage}. 'found_fixture' remained False.")
+    handler_log.debug("Match view for %s: %s", user_id, view)
+    player_team_escaped = escape_markdown_v2(view.get('team', ''))
+    opponent_team_escaped = escape_markdown_v2(view.get('opponent_team', 'TBD'))
+    opponent_username_escaped = escape_markdown_v2(view.get('opponent_username') or 'unknown')
+    score = view.get("score")
+
+    if view["stage"] == "group_stage":
+        round_escaped = escape_markdown_v2(str(view['round_num'] + 1))
+        reply_text = f"📅 Your Group Matches \\- {player_team_escaped} \\({escape_markdown_v2(view.get('group') or 'No Group')}\\) \\- Match {round_escaped}\n\n"
+        if score:
+            # If match is finished, display as scoreboard
+            reply_text += (
+                f"🏆 Match Result \\(Round {round_escaped}\\):\n"
+                f"*{player_team_escaped} {score[0]} \\- {score[1]} {opponent_team_escaped}*\n"
+                f"🎮 Opponent: @{opponent_username_escaped}\n\n"
+            )
+        else:
+            reply_text += (
+                f"MATCHDAY \\( {round_escaped}\\):\n"
+                f"{player_team_escaped} vs {opponent_team_escaped} \\(Pending\\)\n"
+                f"🎮 Opponent: @{opponent_username_escaped}\n\n"
+            )
+    else:
+        stage_title_escaped = escape_markdown_v2(view["stage"].replace('_', ' ').title())
+        reply_text = f"📅 Your Knockout Match \\- {player_team_escaped} \\({stage_title_escaped}\\)\n\n"
+        if score:
+            reply_text += (
+                f"🏆 Match Result \\(*{stage_title_escaped}*\\):\n"
+                f"*{player_team_escaped} {score[0]} \\- {score[1]} {opponent_team_escaped}*\n"
+                f"🎮 Opponent: @{opponent_username_escaped}\n\n"
+            )
+        elif view.get("status") == "waiting":
+            reply_text += (
+                f"📅 Your Match \\(*{stage_title_escaped}*\\):\n"
+                f"{player_team_escaped} vs TBD \\(Waiting for your opponent's match\\)\n\n"
+            )
+        else:
+            reply_text += (
+                f"📅 Your Match \\(*{stage_title_escaped}*\\):\n"
+                f"{player_team_escaped} vs {opponent_team_escaped} \\(Pending\\)\n"
+                f"🎮 Opponent: @{opponent_username_escaped}\n\n"
+            )
 
     # Final send of the message
     if reply_text: # Ensure reply_text is not empty before sending
         try:
             await update.message.reply_text(reply_text, parse_mode=ParseMode.MARKDOWN_V2)
         except Exception as e:
-            print(f"ERROR: Could not send reply_text due to markdown parsing error: {e}")
-            print(f"Problematic reply_text:\n{reply_text}")
+            handler_log.error("Could not send reply_text due to markdown parsing error: %s\nProblematic reply_text:\n%s", e, reply_text)
             # Fallback to plain text if MarkdownV2 fails
             await update.message.reply_text("An error occurred while formatting the message\. Please contact admin\. Here's the raw info:\n" + escape_markdown_v2(reply_text), parse_mode=ParseMode.MARKDOWN_V2)
     else:
@@ -852,35 +3148,39 @@ async def fixtures(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def group_standings(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Everyone sees the same table: concurrent requests share one render (see READ COALESCING)
+    reply = await READ_FLIGHTS.run("standings", render_group_standings)
+    await update.message.reply_text(reply, parse_mode=ParseMode.MARKDOWN_V2)
+
+async def render_group_standings():
     # Load tournament state to check the current stage
-    tournament_state = load_state("tournament_state")
+    tournament_state = await load_state("tournament_state")
     current_stage = tournament_state.get("stage", "registration")
 
     if current_stage in ["round_of_16", "quarter_finals", "semi_finals", "final"]:
-        await update.message.reply_text(
+        return (
             "🚫 The tournament has moved to the knockout stage\\. Group standings are no longer available\\.\n"
-            "Use /fixtures to see *your* upcoming match, or */showknockout* to see all matches for the current stage\\.",
-            parse_mode=ParseMode.MARKDOWN_V2
+            "Use /fixtures to see *your* upcoming match, or */showknockout* to see all matches for the current stage\\."
         )
-        return
 
-    players = load_state("players")
-    groups_data = load_state("groups") 
+    players = await load_state("players")
+    groups_data = await load_state("groups") 
 
     if not groups_data:
-        await update.message.reply_text("❌ Groups have not been formed yet\\.", parse_mode=ParseMode.MARKDOWN_V2)
-        return
+        return "❌ Groups have not been formed yet\\."
 
+    # Same ranking (and tiebreak chain) that decides qualification
+    rankings = rank_all_groups(groups_data, await load_state("fixtures"), tournament_state.get("fair_play"))
     all_standings = ""
     for group_name in sorted(groups_data.keys()):
-        player_ids = groups_data[group_name]
+        order, table, _ = rankings[group_name]
         standings = []
         max_team_name_len = 0 # Track max length for dynamic padding
 
-        for p_id in player_ids:
+        for p_id in order:
             player_info = players.get(p_id)
             if player_info:
-                stats = player_info.get("stats", {})
+                stats = table[p_id]
                 team_name = player_info.get('team', 'N/A')
                 team_name_escaped = escape_markdown_v2(team_name) 
                 
@@ -895,8 +3195,6 @@ async def group_standings(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     "losses": stats.get("losses", 0)
                 })
 
-        standings.sort(key=lambda x: (x['points'], x['wins'], x['draws']), reverse=True)
-
         team_col_width = max_team_name_len + 2 
         stat_col_width = 1 # *** CHANGED TO 1 ***
 
@@ -933,49 +3231,19 @@ async def group_standings(update: Update, context: ContextTypes.DEFAULT_TYPE):
         all_standings += group_text
 
     if all_standings:
-        await update.message.reply_text(all_standings, parse_mode=ParseMode.MARKDOWN_V2)
+        return all_standings
     else:
-        await update.message.reply_text("❌ No standings available yet\\.", parse_mode=ParseMode.MARKDOWN_V2)
+        return "❌ No standings available yet\\."
 def update_player_stats(players_data, player_id, opponent_id, player_score, opponent_score):
     # Ensure 'stats' dictionary exists for the player reporting
     if 'stats' not in players_data.get(player_id, {}):
-        players_data[player_id]['stats'] = {'wins': 0, 'losses': 0, 'draws': 0, 'points': 0, 'gf': 0, 'ga': 0, 'gd': 0}
+        players_data[player_id]['stats'] = empty_stats()
 
     # Ensure 'stats' dictionary exists for the opponent
     if 'stats' not in players_data.get(opponent_id, {}):
-        players_data[opponent_id]['stats'] = {'wins': 0, 'losses': 0, 'draws': 0, 'points': 0, 'gf': 0, 'ga': 0, 'gd': 0}
-
-    # Get current stats objects for easier modification
-    player_stats = players_data[player_id]['stats']
-    opponent_stats = players_data[opponent_id]['stats']
-
-    # Update Goals For (GF) and Goals Against (GA) for both players
-    player_stats['gf'] += player_score
-    player_stats['ga'] += opponent_score
-    opponent_stats['gf'] += opponent_score
-    opponent_stats['ga'] += player_score
-
-    # Update Goal Difference (GD) for both players
-    player_stats['gd'] = player_stats['gf'] - player_stats['ga']
-    opponent_stats['gd'] = opponent_stats['gf'] - opponent_stats['ga']
+        players_data[opponent_id]['stats'] = empty_stats()
 
-    # Update Wins, Losses, Draws, and Points for both players
-    if player_score > opponent_score:
-        # Player wins
-        player_stats['wins'] += 1
-        player_stats['points'] += 3
-        opponent_stats['losses'] += 1
-    elif player_score < opponent_score:
-        # Opponent wins
-        player_stats['losses'] += 1
-        opponent_stats['wins'] += 1
-        opponent_stats['points'] += 3
-    else: # Draw
-        # Both players draw
-        player_stats['draws'] += 1
-        player_stats['points'] += 1
-        opponent_stats['draws'] += 1
-        opponent_stats['points'] += 1
+    apply_result_delta(players_data[player_id]['stats'], players_data[opponent_id]['stats'], player_score, opponent_score)
 
     # No need to explicitly save_state here, as the caller will save it once updates are complete.
 # Assuming current_admin_matches = {} is defined globally at the top of your script
@@ -987,67 +3255,52 @@ async def addscore(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ You are not authorized\\.", parse_mode=ParseMode.MARKDOWN_V2) 
         return
 
-    fixtures_data = load_state("fixtures")
-    players_data = load_state("players")
-    tournament_state = load_state("tournament_state")
+    tournament_state = await load_state("tournament_state")
     current_stage = tournament_state.get("stage")
-    current_group_round = tournament_state.get("group_match_round", 0) 
 
-    if not fixtures_data or not current_stage:
+    if not current_stage:
         await update.message.reply_text("❌ No matches currently scheduled for any stage\\.", parse_mode=ParseMode.MARKDOWN_V2) 
         return
 
+    # Only the pending set and the {id: team} projection: O(pending), no fixtures scan
+    pending_matches = await load_pending_matches(tournament_state)
+    players_data = await load_player_index()
+
     # Beautified header
     reply = f"📅 *Upcoming Matches for {escape_markdown_v2(current_stage.replace('_', ' ').title())}:*\n\n"
     
     current_admin_matches.clear() 
     idx = 1 
 
-    if current_stage == "group_stage":
-        for group_name, matches in fixtures_data.get("group_stage", {}).items():
-            for match in matches:
-                if not isinstance(match, list) or len(match) < 5 or match[4] != current_group_round:
-                    continue 
-
-                p1_id, p2_id, score1, score2, round_num = match 
-
-                if score1 is None: 
-                    p1 = players_data.get(p1_id)
-                    p2 = players_data.get(p2_id)
-                    if p1 and p2:
-                        current_admin_matches[f"match{idx}"] = {
-                            "type": "group",
-                            "group": group_name,
-                            "p1_id": p1_id,
-                            "p2_id": p2_id,
-                            "round_num": round_num 
-                        }
-                        # Added emojis and consistent MarkdownV2 escaping
-                        reply += (
-                            f"✨ /{escape_markdown_v2(f'match{idx}')} → " 
-                            f"*{escape_markdown_v2(p1.get('team', 'Unknown Player'))}* vs *{escape_markdown_v2(p2.get('team', 'Unknown Player'))}* "
-                            f"\\(Group {escape_markdown_v2(group_name)} \\- Round {round_num + 1}\\)\n" 
-                        )
-                        idx += 1
-    elif current_stage in ["round_of_16", "quarter_finals", "semi_finals", "final"]:
-        for match in fixtures_data.get(current_stage, []):
-            if not isinstance(match, list) or len(match) < 4:
-                print(f"WARNING: Skipping malformed knockout match: {match}")
-                continue 
-
-            p1_id, p2_id, score1, score2 = match[:4] 
-            if score1 is None: 
-                p1 = players_data.get(p1_id)
-                p2 = players_data.get(p2_id)
-                if p1 and p2:
-                    current_admin_matches[f"match{idx}"] = {"type": "knockout", "stage": current_stage, "p1_id": p1_id, "p2_id": p2_id}
-                    # Added emojis and consistent MarkdownV2 escaping
-                    reply += (
-                        f"⚔️ /{escape_markdown_v2(f'match{idx}')} → " 
-                        f"*{escape_markdown_v2(p1.get('team', 'Unknown Player'))}* vs *{escape_markdown_v2(p2.get('team', 'Unknown Player'))}* "
-                        f"\\({escape_markdown_v2(current_stage.replace('_', ' ').title())}\\)\n"
-                    )
-                    idx += 1
+    for entry in pending_matches:
+        p1_id, p2_id = entry["p1_id"], entry["p2_id"]
+        p1 = players_data.get(p1_id)
+        p2 = players_data.get(p2_id)
+        if not p1 or not p2:
+            continue
+        if entry["type"] == "group":
+            current_admin_matches[f"match{idx}"] = {
+                "type": "group",
+                "group": entry["group"],
+                "p1_id": p1_id,
+                "p2_id": p2_id,
+                "round_num": entry["round_num"] 
+            }
+            # Added emojis and consistent MarkdownV2 escaping
+            reply += (
+                f"✨ /{escape_markdown_v2(f'match{idx}')} → " 
+                f"*{escape_markdown_v2(p1.get('team', 'Unknown Player'))}* vs *{escape_markdown_v2(p2.get('team', 'Unknown Player'))}* "
+                f"\\(Group {escape_markdown_v2(entry['group'])} \\- Round {entry['round_num'] + 1}\\)\n" 
+            )
+        else:
+            current_admin_matches[f"match{idx}"] = {"type": "knockout", "stage": entry["stage"], "p1_id": p1_id, "p2_id": p2_id}
+            # Added emojis and consistent MarkdownV2 escaping
+            reply += (
+                f"⚔️ /{escape_markdown_v2(f'match{idx}')} → " 
+                f"*{escape_markdown_v2(p1.get('team', 'Unknown Player'))}* vs *{escape_markdown_v2(p2.get('team', 'Unknown Player'))}* "
+                f"\\({escape_markdown_v2(entry['stage'].replace('_', ' ').title())}\\)\n"
+            )
+        idx += 1
     
     # --- Provide feedback if no matches found (Beautified) ---
     if idx == 1: 
@@ -1075,7 +3328,7 @@ async def handle_score(update: Update, context: ContextTypes.DEFAULT_TYPE):
             raise ValueError("Score not provided")
 
         cmd, score_str = cmd_parts
-        match_key = cmd[1:]
+        match_key = cmd[1:].split("@", 1)[0] # "/match3@botname" -> "match3"
         goals = score_str.split("-")
         if len(goals) != 2:
             raise ValueError("Invalid score format")
@@ -1106,31 +3359,39 @@ async def handle_score(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     except ValueError as ve:
         await update.message.reply_text(f"❌ Invalid format. Use like: /match2 1-0. Error: {ve}")
+    except StateError:
+        raise # Reported by on_handler_error
     except Exception as e:
-        print(f"Error in handle_score: {e}")
+        handler_log.error("Error in handle_score: %s", e)
         await update.message.reply_text("❌ An unexpected error occurred.")
 
 
 async def handle_group_score(update: Update, context: ContextTypes.DEFAULT_TYPE, group_name: str, p1_id: str, p2_id: str, score1: int, score2: int, round_num: int): # NEW: Added round_num parameter
-    fixtures_data = load_state("fixtures")
-    players = load_state("players")
+    fixtures_data = await load_state("fixtures")
+    players = await load_state("players")
+    tournament_state = await load_state("tournament_state")
 
     group_matches = fixtures_data["group_stage"][group_name]
     match_found = False
+    match_index = None
 
     for i, match in enumerate(group_matches):
         # Check if this is the correct match and belongs to the specified round
         if (match[0] == p1_id and match[1] == p2_id and match[4] == round_num):
+            was_pending = match[2] is None
             # Preserve round_num when updating
             group_matches[i] = [p1_id, p2_id, score1, score2, round_num]
             match_found = True
+            match_index = i
             break
         elif (match[0] == p2_id and match[1] == p1_id and match[4] == round_num):
             # Preserve round_num when updating (and swap scores for canonical order if desired, or just store as reported)
             # For consistency, it's better to store with p1_id as match[0] and p2_id as match[1]
             # even if reported by p2, then the scores swap.
+            was_pending = match[2] is None
             group_matches[i] = [p1_id, p2_id, score1, score2, round_num] # Correctly store in canonical order
             match_found = True
+            match_index = i
             break
 
     if not match_found:
@@ -1140,8 +3401,32 @@ async def handle_group_score(update: Update, context: ContextTypes.DEFAULT_TYPE,
     # Use the helper function to update player statistics
     update_player_stats(players, p1_id, p2_id, score1, score2) # p1_id and p2_id are fixed for the match
 
-    save_state("fixtures", fixtures_data)
-    save_state("players", players)
+    # One event plus the nodes it changes, instead of rewriting fixtures and players
+    updates = {
+        f"fixtures/group_stage/{group_name}/{match_index}": group_matches[match_index],
+        f"players/{p1_id}/stats": players[p1_id]['stats'],
+        f"players/{p2_id}/stats": players[p2_id]['stats'],
+    }
+    events = [("result_recorded", {"stage": "group_stage", "group": group_name, "round": round_num,
+                                   "p1": p1_id, "p2": p2_id, "s1": score1, "s2": score2})]
+    round_closed = False
+    if was_pending:
+        pending_counts = await load_pending_counts()
+        key = round_key("group_stage", round_num)
+        updates.update(set_pending_count(pending_counts, key, await pending_count(pending_counts, key) - 1))
+        updates.update(pending_set_change("group_stage", match_index, match, group_matches[match_index], group_name))
+        # Auto-advance: the last result of the round closes it in the same write
+        round_closed = (pending_counts[key] == 0 and tournament_state.get("auto_advance")
+                        and tournament_state.get("stage") == "group_stage"
+                        and tournament_state.get("group_match_round", 0) == round_num)
+        if round_closed:
+            events.append(group_round_transition(tournament_state))
+            updates["tournament_state"] = tournament_state
+    if round_closed:
+        updates["match_views"] = build_match_views(fixtures_data, tournament_state, players)
+    else:
+        updates.update(match_view_updates("group_stage", match_index, group_matches[match_index], players, group_name))
+    await record_match_events(events, updates)
 
     # Use escape_markdown_v2 for team names in replies
     p1_team_name = players.get(p1_id, {}).get('team', 'Unknown Player')
@@ -1166,8 +3451,9 @@ async def handle_group_score(update: Update, context: ContextTypes.DEFAULT_TYPE,
         parse_mode=ParseMode.MARKDOWN_V2
     )
 
-    # The logic to check if all matches are completed and advance to knockout
-    # is now handled by the /advance_group_round command, NOT here.
+    # Without auto-advance, closing the round is left to the /advance_group_round command
+    if round_closed:
+        await announce_group_round_transition(context, tournament_state)
 
 async def advance_group_round(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
@@ -1177,9 +3463,7 @@ async def advance_group_round(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update.message.reply_text("❌ Only the admin can advance tournament rounds.")
         return
 
-    tournament_state = load_state("tournament_state")
-    fixtures_data = load_state("fixtures")
-    players = load_state("players") # Needed to show team names
+    tournament_state = await load_state("tournament_state")
 
     current_stage = tournament_state.get("stage")
     current_group_round = tournament_state.get("group_match_round", 0)
@@ -1188,28 +3472,18 @@ async def advance_group_round(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update.message.reply_text(f"❌ Tournament is not in the group stage. Current stage: {current_stage}. Cannot advance group rounds.")
         return
 
-    group_stage_fixtures = fixtures_data.get("group_stage", {})
-
-    # 1. Check if ALL matches for the current round are completed
+    # 1. Check if ALL matches for the current round are completed (from the pending set, not a fixtures scan)
     pending_matches_in_current_round = []
-    # Loop through all groups
-    for group_name, matches_in_group in group_stage_fixtures.items():
-        # Loop through matches within each group
-        for match_data in matches_in_group:
-            # Ensure it's a valid match list with 5 elements (player1_id, player2_id, score1, score2, round_number)
-            # And ensure it belongs to the current_group_round being checked
-            if isinstance(match_data, list) and len(match_data) >= 5 and match_data[4] == current_group_round:
-                # Check if scores are missing (None)
-                if match_data[2] is None or match_data[3] is None:
-                    player1_id, player2_id, _, _, _ = match_data
-                    
-                    # Get player teams for display, using escape_markdown_v2
-                    player1_team = players.get(player1_id, {}).get('team', f"Player {player1_id}")
-                    player2_team = players.get(player2_id, {}).get('team', f"Player {player2_id}")
-                    
-                    pending_matches_in_current_round.append(
-                        f"- {escape_markdown_v2(player1_team)} vs {escape_markdown_v2(player2_team)} (Group {escape_markdown_v2(group_name)})"
-                    )
+    pending_matches = await load_pending_matches(tournament_state)
+    if pending_matches:
+        players = await load_player_index() # Needed to show team names
+    for entry in pending_matches:
+        # Get player teams for display, using escape_markdown_v2
+        player1_team = players.get(entry["p1_id"], {}).get('team', f"Player {entry['p1_id']}")
+        player2_team = players.get(entry["p2_id"], {}).get('team', f"Player {entry['p2_id']}")
+        pending_matches_in_current_round.append(
+            f"- {escape_markdown_v2(player1_team)} vs {escape_markdown_v2(player2_team)} (Group {escape_markdown_v2(entry['group'])})"
+        )
 
     if pending_matches_in_current_round:
         # If there are pending matches, inform the admin
@@ -1219,76 +3493,38 @@ async def advance_group_round(update: Update, context: ContextTypes.DEFAULT_TYPE
         return
 
     # 2. If all current round matches are complete, check if there are more rounds or if group stage is finished
-    max_group_rounds = 3 # This should match the total number of rounds you generate (0-indexed: 0, 1, 2 for 3 rounds)
-
-    if current_group_round < max_group_rounds - 1: # -1 because rounds are 0-indexed (e.g., if max=3, rounds are 0,1,2. We advance if current is 0 or 1)
-        tournament_state["group_match_round"] += 1 # Increment to the next round
-        save_state("tournament_state", tournament_state)
-        new_round_number = tournament_state["group_match_round"] + 1 # For user-friendly display (1-indexed)
+    transition = group_round_transition(tournament_state)
+    match_views = build_match_views(await load_state("fixtures"), tournament_state, await load_player_index())
+    await record_match_events([transition], {"tournament_state": tournament_state, "match_views": match_views})
 
+    if tournament_state.get("stage") == "group_stage":
         await update.message.reply_text(
-            f"✅ All matches for Round {current_group_round + 1} are completed! Advancing to Round {new_round_number}.",
+            f"✅ All matches for Round {current_group_round + 1} are completed! Advancing to Round {tournament_state['group_match_round'] + 1}.",
             parse_mode='Markdown' # Ensure Markdown is applied
         )
-        await context.bot.send_message(
-            GROUP_ID,
-            f"📣 Group stage has advanced! Round {new_round_number} matches are now active. Use /fixtures to see your new match.",
-            parse_mode='Markdown'
-        )
     else:
-        # All group rounds are finished (current_group_round is now max_group_rounds - 1, meaning the last round's matches are done)
-        tournament_state["stage"] = "group_stage_completed" # Update stage to indicate group stage is over
-        save_state("tournament_state", tournament_state)
-
+        # All group rounds are finished
         await update.message.reply_text(
             "🎉 All group stage matches are completed! The group stage has ended. Calculating standings and preparing for Knockouts...",
             parse_mode='Markdown'
         )
-        await context.bot.send_message(
-            GROUP_ID,
-            "🎉 The Group Stage has concluded! Calculating final standings and preparing for Knockouts (to be drawn by admin). Use /standings to see final group rankings.",
-            parse_mode='Markdown'
-        )
-        
-        # This is where your 'advance_to_knockout' function gets called,
-        # after ALL group rounds are complete and confirmed by the admin via /advance_group_round.
-        await advance_to_knockout(context)
+    # Announces the new round, or the end of the group stage followed by advance_to_knockout
+    await announce_group_round_transition(context, tournament_state)
 
 
 async def advance_to_knockout(context: ContextTypes.DEFAULT_TYPE):
-    print("DEBUG: Entering advance_to_knockout function.")
-    tournament_state = load_state("tournament_state")
-    players = load_state("players")
-    fixtures_data = load_state("fixtures")
+    tournament_log.debug("Entering advance_to_knockout function.")
+    tournament_state = await load_state("tournament_state")
+    players = await load_state("players")
+    fixtures_data = await load_state("fixtures")
+    groups = await load_state("groups")
     
     ADMIN_ID = "7366894756" # Define this properly!
     GROUP_ID = "-1002835703789"        # Define this properly!
 
-    # --- NEW: Check if there are pending tiebreakers from previous runs ---
-    pending_tiebreakers = tournament_state.get('pending_tiebreakers', {})
-    if pending_tiebreakers:
-        message = "*🚨 Knockout Stage On Hold: Tiebreakers Pending\! 🚨*\n\n" \
-                  "The following groups still require tiebreaker matches to be played:\n"
-        for group_name, tied_players_ids in pending_tiebreakers.items():
-            player1_info = players.get(tied_players_ids[0], {})
-            player2_info = players.get(tied_players_ids[1], {})
-            message += f"\- *Group {escape_markdown_v2(group_name).upper()}:* " \
-                       f"{get_player_display_name(player1_info)} vs {get_player_display_name(player2_info)}\n"
-        message += "\nPlease ensure these matches are played and results submitted via the dedicated tiebreaker command\.\n" \
-                   "The Knockout Stage will only begin once all ties are resolved\."
-        
-        await context.bot.send_message(ADMIN_ID, message, parse_mode=ParseMode.MARKDOWN_V2)
-        await context.bot.send_message(GROUP_ID, message, parse_mode=ParseMode.MARKDOWN_V2)
-        print(f"DEBUG: Knockout stage halted. Tiebreakers pending: {pending_tiebreakers.keys()}")
-        # Important: Don't change stage if tiebreakers are pending. Stay in 'group_stage_completed' or a new 'tiebreaker_pending' stage
-        # You might set tournament_state["stage"] = PENDING_TIEBREAKERS_STAGE here and save_state.
-        # For now, we'll assume if pending_tiebreakers exists, we don't proceed.
-        return # STOP here if tiebreakers are still pending
-
-
     # Ensure tournament is in 'group_stage_completed' before proceeding to final qualification
     if tournament_state.get("stage") != "group_stage_completed":
-        print(f"DEBUG: advance_to_knockout called, but tournament state is not 'group_stage_completed'. Current stage: {tournament_state.get('stage')}. Aborting.")
+        tournament_log.debug("advance_to_knockout called, but tournament state is not 'group_stage_completed'. Current stage: %s. Aborting.", tournament_state.get('stage'))
         await context.bot.send_message(ADMIN_ID, "❌ Knockout stage cannot be initiated\. Group stage not marked as completed\.")
         return
 
@@ -1296,124 +3532,70 @@ async def advance_to_knockout(context: ContextTypes.DEFAULT_TYPE):
     all_final_qualified_players = [] # To store player IDs for actual knockout seeding
     group_stage_summary_qualified = [] # For the summary message
     group_stage_summary_eliminated = [] # For the summary message
+    pending_tiebreakers = {} # {group_name: [player1_id, player2_id]} still waiting for a playoff
 
     # Initialize tiebreaker fixtures storage if it doesn't exist
     if 'tiebreaker_fixtures' not in fixtures_data:
         fixtures_data['tiebreaker_fixtures'] = {} # Stores {group_name: [player1_id, player2_id, None, None, 'pending']}
-    
-    # 1. Calculate final group standings and determine qualifiers per group
-    for group_name, group_matches in fixtures_data.get("group_stage", {}).items():
-        print(f"DEBUG: Processing group: {group_name}")
-        group_players_stats = {} # player_id: player_stats
-
-        for match in group_matches:
-            # Ensure match data is complete before processing (player1, player2, score1, score2, round)
-            if len(match) >= 4 and all(x is not None for x in [match[0], match[1], match[2], match[3]]):
-                p1_id, p2_id, score1, score2 = match[0], match[1], match[2], match[3]
-                
-                # Initialize player stats if not present
-                if p1_id not in group_players_stats:
-                    group_players_stats[p1_id] = {'wins': 0, 'draws': 0, 'losses': 0, 'gf': 0, 'ga': 0, 'gd': 0, 'points': 0}
-                if p2_id not in group_players_stats:
-                    group_players_stats[p2_id] = {'wins': 0, 'draws': 0, 'losses': 0, 'gf': 0, 'ga': 0, 'gd': 0, 'points': 0}
-
-                # Update stats for player 1
-                group_players_stats[p1_id]['gf'] += score1
-                group_players_stats[p1_id]['ga'] += score2
-                group_players_stats[p1_id]['gd'] += (score1 - score2)
-
-                # Update stats for player 2
-                group_players_stats[p2_id]['gf'] += score2
-                group_players_stats[p2_id]['ga'] += score1
-                group_players_stats[p2_id]['gd'] += (score2 - score1)
-
-                if score1 > score2:
-                    group_players_stats[p1_id]['wins'] += 1
-                    group_players_stats[p1_id]['points'] += 3
-                    group_players_stats[p2_id]['losses'] += 1
-                elif score1 < score2:
-                    group_players_stats[p2_id]['wins'] += 1
-                    group_players_stats[p2_id]['points'] += 3
-                    group_players_stats[p1_id]['losses'] += 1
-                else:
-                    group_players_stats[p1_id]['draws'] += 1
-                    group_players_stats[p1_id]['points'] += 1
-                    group_players_stats[p2_id]['draws'] += 1
-                    group_players_stats[p2_id]['points'] += 1
-            else:
-                print(f"WARNING: Skipping incomplete match in group stage standings calculation for {group_name}: {match}")
-                await context.bot.send_message(ADMIN_ID, f"WARNING: Incomplete match detected in Group {group_name}\. Cannot fully process standings\.")
-                # You might want to halt here or flag the group as incomplete
-
-        # Convert group_players_stats to a list of (player_id, stats) for sorting
-        current_group_standings = []
-        for p_id, stats in group_players_stats.items():
-            # Apply updated stats back to the main players dictionary
+
+    # 1. Rank every group in one pass (recorded playoffs included) and determine qualifiers per group
+    fair_play = tournament_state.get("fair_play") or {}
+    rankings = rank_all_groups(groups, fixtures_data, fair_play)
+    for group_name, (order, table, unresolved) in rankings.items():
+        tournament_log.debug("Processing group: %s", group_name)
+        group_matches = fixtures_data.get("group_stage", {}).get(group_name) or []
+        if any(not isinstance(match, list) or len(match) < 4 or None in match[:4] for match in group_matches):
+            tournament_log.warning("Incomplete match in group stage standings calculation for %s", group_name)
+            await context.bot.send_message(ADMIN_ID, f"WARNING: Incomplete match detected in Group {group_name}\. Cannot fully process standings\.")
+
+        # Apply the final group stats back to the main players dictionary
+        for p_id, stats in table.items():
             if p_id in players:
                 players[p_id]['stats'] = stats
             else:
-                print(f"WARNING: Player {p_id} not found in 'players' dictionary during standings update for group {group_name}\.")
-            current_group_standings.append((p_id, stats))
-        
-        # Sort teams within the current group by points, then GD, then GF
-        # This is CRUCIAL for per-group qualification
-        current_group_standings_sorted = sorted(
-            current_group_standings,
-            key=lambda x: (x[1]['points'], x[1]['gd'], x[1]['gf']),
-            reverse=True # Highest points/GD/GF first
-        )
+                tournament_log.warning("Player %s not found in 'players' dictionary during standings update for group %s.", p_id, group_name)
 
-        print(f"DEBUG: Group {group_name} Standings: {[(players[p_id].get('team'), s['points'], s['gd'], s['gf']) for p_id, s in current_group_standings_sorted]}")
+        if tournament_log.isEnabledFor(logging.DEBUG):
+            tournament_log.debug("Group %s Standings: %s", group_name, [(players.get(p_id, {}).get('team'), table[p_id]['points'], table[p_id]['gd'], table[p_id]['gf']) for p_id in order])
 
-        # Determine qualification based on sorted group standings
-        if len(current_group_standings_sorted) < 4:
-            print(f"WARNING: Group {group_name} does not have 4 players. Cannot determine full qualification.")
+        # Determine qualification based on the ranked group
+        if len(order) < 4:
+            tournament_log.warning("Group %s does not have 4 players. Cannot determine full qualification.", group_name)
             await context.bot.send_message(ADMIN_ID, f"WARNING: Group {group_name} incomplete\. Cannot determine qualifiers\. Aborting knockout progression\.")
             tournament_state["stage"] = "group_stage_incomplete" # Mark it as such for admin
-            save_state("tournament_state", tournament_state)
-            save_state("players", players)
+            await save_state("tournament_state", tournament_state)
+            await save_state("players", players)
             return
 
-        team_1st_id, team_1st_stats = current_group_standings_sorted[0]
-        team_2nd_id, team_2nd_stats = current_group_standings_sorted[1]
-        team_3rd_id, team_3rd_stats = current_group_standings_sorted[2]
-        team_4th_id, team_4th_stats = current_group_standings_sorted[3]
-
-        # Check for tie between 2nd and 3rd place (only scenario requiring tiebreaker match)
-        if (team_2nd_stats['points'] == team_3rd_stats['points'] and
-            team_2nd_stats['gd'] == team_3rd_stats['gd'] and
-            team_2nd_stats['gf'] == team_3rd_stats['gf']):
-            
-            # --- TIEBREAKER NEEDED ---
-            print(f"DEBUG: Tie detected in Group {group_name} between {players[team_2nd_id].get('team')} and {players[team_3rd_id].get('team')}")
-            
-            # Mark this group as pending tiebreaker
-            pending_tiebreakers[group_name] = [team_2nd_id, team_3rd_id]
-            tournament_state['pending_tiebreakers'] = pending_tiebreakers # Update state
-
-            # Create a tiebreaker fixture
-            # Structure: [player1_id, player2_id, score1, score2, status]
-            fixtures_data['tiebreaker_fixtures'][group_name] = [team_2nd_id, team_3rd_id, None, None, 'pending']
-            
-            # Add 1st place to qualified for summary, 4th place to eliminated for summary
-            # The 2nd/3rd will be resolved by the tiebreaker match later
-            group_stage_summary_qualified.append(players[team_1st_id])
-            group_stage_summary_eliminated.append(players[team_4th_id])
-
+        if unresolved:
+            # --- TIEBREAKER NEEDED --- (level on every criterion before the playoff, straddling 2nd/3rd)
+            tournament_log.debug("Tie detected in Group %s between %s", group_name, [players.get(p_id, {}).get('team') for p_id in unresolved])
+            pending_tiebreakers[group_name] = unresolved
+            existing = fixtures_data['tiebreaker_fixtures'].get(group_name)
+            if not (isinstance(existing, list) and existing[4:5] == ['pending'] and set(existing[:2]) == set(unresolved)):
+                # Structure: [player1_id, player2_id, winner_id, loser_id, status]
+                fixtures_data['tiebreaker_fixtures'][group_name] = [unresolved[0], unresolved[1], None, None, 'pending']
         else:
             # --- NO TIEBREAKER NEEDED ---
-            print(f"DEBUG: No tie in Group {group_name}. Qualifiers: {players[team_1st_id].get('team')}, {players[team_2nd_id].get('team')}")
-            all_final_qualified_players.append(team_1st_id)
-            all_final_qualified_players.append(team_2nd_id)
-            
-            group_stage_summary_qualified.append(players[team_1st_id])
-            group_stage_summary_qualified.append(players[team_2nd_id])
-            group_stage_summary_eliminated.append(players[team_3rd_id])
-            group_stage_summary_eliminated.append(players[team_4th_id])
-    
-    save_state("players", players) # Save updated player stats
-    save_state("fixtures", fixtures_data) # Save new tiebreaker fixtures
-    save_state("tournament_state", tournament_state) # Save pending tiebreakers status
+            tournament_log.debug("Group %s resolved. Qualifiers: %s", group_name, [players.get(p_id, {}).get('team') for p_id in order[:QUALIFIERS_PER_GROUP]])
+            all_final_qualified_players.extend(order[:QUALIFIERS_PER_GROUP])
+
+        # Teams above a pending playoff are through and teams below it are out either way
+        for position, p_id in enumerate(order):
+            if unresolved and p_id in unresolved:
+                continue
+            if position < QUALIFIERS_PER_GROUP:
+                group_stage_summary_qualified.append(players.get(p_id, {}))
+            else:
+                group_stage_summary_eliminated.append(players.get(p_id, {}))
+
+    if pending_tiebreakers:
+        tournament_state['pending_tiebreakers'] = pending_tiebreakers
+    else:
+        tournament_state.pop('pending_tiebreakers', None)
+    await save_state("players", players) # Save updated player stats
+    await save_state("fixtures", fixtures_data) # Save new tiebreaker fixtures
+    await save_state("tournament_state", tournament_state) # Save pending tiebreakers status
 
     # --- Construct and Send Summary Message ---
     summary_message_parts = ["*🎉 Group Stage Results \& Knockout Stage Status\!* 🎉\n\n"]
@@ -1433,7 +3615,7 @@ async def advance_to_knockout(context: ContextTypes.DEFAULT_TYPE):
         summary_message_parts.append("\n")
 
     # Pending Tiebreakers
-    if pending_tiebreakers: # Check the *updated* pending_tiebreakers
+    if pending_tiebreakers:
         summary_message_parts.append("*🚨 Tiebreakers Needed\! 🚨*\n")
         summary_message_parts.append("The following groups have ties for the 2nd qualification spot and require a tiebreaker match:\n")
         for group_name, tied_players_ids in pending_tiebreakers.items():
@@ -1444,7 +3626,7 @@ async def advance_to_knockout(context: ContextTypes.DEFAULT_TYPE):
                 f"{get_player_display_name(player1_info)} vs {get_player_display_name(player2_info)}\n"
             )
         summary_message_parts.append("\nPlease ensure these matches are played and results submitted via the dedicated tiebreaker command\\.\n")
-        summary_message_parts.append("The Knockout Stage will only begin once all ties are resolved\\.\n")
+        summary_message_parts.append("The Knockout Stage will begin as soon as the last tiebreaker result is submitted\\.\n")
     else:
         # If no pending tiebreakers, confirm knockout stage can begin
         summary_message_parts.append("All group qualifications are resolved\\. Proceeding to Knockout Stage\\. 🎉\n")
@@ -1452,12 +3634,12 @@ async def advance_to_knockout(context: ContextTypes.DEFAULT_TYPE):
 
     final_summary_message = "".join(summary_message_parts)
     await context.bot.send_message(GROUP_ID, final_summary_message, parse_mode=ParseMode.MARKDOWN_V2)
-    print("DEBUG: Group Stage Summary message sent.")
+    tournament_log.debug("Group Stage Summary message sent.")
 
     # --- Final check before proceeding to create knockout bracket ---
     if pending_tiebreakers:
-        print("DEBUG: Cannot proceed to knockout. Tiebreakers are pending.")
-        return # STOP here if any tiebreakers are pending
+        tournament_log.debug("Cannot proceed to knockout. Tiebreakers are pending: %s", list(pending_tiebreakers))
+        return # submit_tiebreaker_result calls back in here once the last one is decided
 
     # 3. Create knockout bracket (only if all groups are resolved)
     # This logic assumes all_final_qualified_players contains exactly 16 players (8 groups * 2 qualifiers)
@@ -1469,36 +3651,16 @@ async def advance_to_knockout(context: ContextTypes.DEFAULT_TYPE):
             f"❌ Error: Expected {num_knockout_players_needed} qualified players\, but found {len(all_final_qualified_players)}\. "
             "Cannot form knockout bracket\. Please check group qualifications or pending tiebreakers\."
         )
-        print(f"ERROR: Incorrect number of qualified players for knockout stage: {len(all_final_qualified_players)} out of {num_knockout_players_needed} needed.")
+        tournament_log.error("Incorrect number of qualified players for knockout stage: %s out of %s needed.", len(all_final_qualified_players), num_knockout_players_needed)
         tournament_state["stage"] = "group_stage_qualification_error" # New error stage
-        save_state("tournament_state", tournament_state)
+        await save_state("tournament_state", tournament_state)
         return
 
-    # Sort the final qualified players for seeding in the knockout bracket
-    # This ensures 1st place from a group gets a better seed than 2nd place, etc.
-    # The existing global sorting on points/GD/GF is good here.
-    # However, you might want to consider adding group-winner priority for seeding.
-    # For simplicity, we'll re-sort the 'all_final_qualified_players' based on their overall stats.
-    
-    # Reload players state to ensure latest stats if anything changed or to use existing global sort logic
-    # Or, pass player_info along with player_id earlier to avoid re-loading.
-    qualified_players_with_stats = []
-    for p_id in all_final_qualified_players:
-        if p_id in players and 'stats' in players[p_id]:
-            qualified_players_with_stats.append((p_id, players[p_id]['stats']))
-        else:
-            print(f"WARNING: Qualified player {p_id} missing stats during knockout seeding.")
-            # Handle error or assign default stats
-
-    sorted_knockout_seeds = sorted(
-        qualified_players_with_stats,
-        key=lambda x: (x[1]['points'], x[1]['gd'], x[1]['gf']),
-        reverse=True # Highest points/GD/GF first
-    )
-    # Extract just the player IDs for pairing
-    seeds_for_pairing = [p_id for p_id, _ in sorted_knockout_seeds]
-    print(f"DEBUG: Qualified players (sorted for knockout seeding): {[(players[p_id].get('team'), players[p_id].get('stats', {}).get('points')) for p_id in seeds_for_pairing]}")
-
+    # Seed group winners ahead of runners-up, so 1 vs 16 is always a winner against a runner-up;
+    # within each set seeds follow points/GD/GF across groups, or Elo with RATING_SEEDING (see seed_qualifiers)
+    seeds_for_pairing = seed_qualifiers(rankings, fair_play, await load_ratings() if RATING_SEEDING else None)
+    if tournament_log.isEnabledFor(logging.DEBUG):
+        tournament_log.debug("Qualified players (sorted for knockout seeding): %s", [(players[p_id].get('team'), players[p_id].get('stats', {}).get('points')) for p_id in seeds_for_pairing])
 
     knockout_fixtures_r16 = []
     
@@ -1517,28 +3679,38 @@ async def advance_to_knockout(context: ContextTypes.DEFAULT_TYPE):
     # Add more `elif` blocks here for other bracket sizes if needed
 
     fixtures_data["round_of_16"] = knockout_fixtures_r16 # Store for Round of 16
-    save_state("fixtures", fixtures_data)
-    print(f"DEBUG: Knockout fixtures (Round of 16) saved: {json.dumps(knockout_fixtures_r16, indent=2)}")
+    # The rest of the bracket tree starts as waiting nodes that winners move into
+    fixtures_data.update(empty_bracket_levels(len(knockout_fixtures_r16)))
+    await save_state("fixtures", fixtures_data)
+    tournament_log.debug("Knockout fixtures (Round of 16) saved: %s", knockout_fixtures_r16)
 
     # 4. Update tournament state to reflect knockout stage
     tournament_state["stage"] = "round_of_16" # Mark tournament as being in Round of 16
     # Also reset `group_match_round` as it's no longer relevant for knockouts
     if "group_match_round" in tournament_state:
         del tournament_state["group_match_round"] 
-    save_state("tournament_state", tournament_state)
-    print(f"DEBUG: Tournament state updated to: {tournament_state['stage']}")
+    index_updates = {"tournament_state": tournament_state, "match_views": build_match_views(fixtures_data, tournament_state, players)}
+    for stage_name in KNOCKOUT_STAGES:
+        index_updates[f"match_index/pending_count/{stage_name}"] = len(fixtures_data[stage_name])
+    for i, match in enumerate(knockout_fixtures_r16):
+        index_updates.update(pending_set_change("round_of_16", i, None, match))
+    await record_match_event("round_advanced", index_updates, stage="round_of_16")
+    tournament_log.debug("Tournament state updated to: %s", tournament_state['stage'])
 
     # 5. Send final notification (already done by summary)
     # await context.bot.send_message(ADMIN_ID, "🎉 Group Stage is over! The Knockout Stage (Round of 16) has begun!\nCheck /fixtures for the new matchups!")
     # await context.bot.send_message(GROUP_ID, "🎉 The Group Stage has concluded! The Knockout Stage (Round of 16) has begun!\nCheck /fixtures for your new matchup!")
-    print("DEBUG: Knockout stage start notifications part of summary.")
+    # The summary promised the Round of 16 line-up; later matches are announced as each becomes ready
+    await notify_knockout_matches(context, "round_of_16")
+    await broadcast_fixtures(context, await load_pending_matches(tournament_state), "Round of 16 fixtures")
+    tournament_log.debug("Knockout stage start notifications sent.")
 
 
 
 
 async def submit_tiebreaker_result(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    print(f"DEBUG: Raw command args received: {context.args}")
-    print(f"DEBUG: Number of args received: {len(context.args)}")
+    tournament_log.debug("Raw command args received: %s", context.args)
+    tournament_log.debug("Number of args received: %s", len(context.args))
     GROUP_ID = "-1002835703789"
     args = context.args
     
@@ -1563,11 +3735,11 @@ async def submit_tiebreaker_result(update: Update, context: ContextTypes.DEFAULT
         return
 
     # Debug what the derived group_name_from_input is
-    print(f"DEBUG: Derived group_name_from_input: '{group_name_from_input}'")
+    tournament_log.debug("Derived group_name_from_input: '%s'", group_name_from_input)
 
-    fixtures_data = load_state("fixtures")
-    tournament_state = load_state("tournament_state")
-    players = load_state("players")
+    fixtures_data = await load_state("fixtures")
+    tournament_state = await load_state("tournament_state")
+    players = await load_state("players")
 
     # We need to find the exact group name key that exists in fixtures_data['tiebreaker_fixtures']
     # based on the group_name_from_input.
@@ -1596,7 +3768,7 @@ async def submit_tiebreaker_result(update: Update, context: ContextTypes.DEFAULT
 
     # Now, use the 'actual_group_name_in_fixtures' for all subsequent lookups
     group_name = actual_group_name_in_fixtures # Rename for clarity for the rest of the function
-    print(f"DEBUG: Using actual group name from fixtures: '{group_name}'")
+    tournament_log.debug("Using actual group name from fixtures: '%s'", group_name)
 
 
     # --- The rest of the function remains largely the same as previous iterations ---
@@ -1637,8 +3809,12 @@ async def submit_tiebreaker_result(update: Update, context: ContextTypes.DEFAULT
     if 'pending_tiebreakers' in tournament_state and group_name in tournament_state['pending_tiebreakers']:
         del tournament_state['pending_tiebreakers'][group_name]
 
-    save_state("fixtures", fixtures_data)
-    save_state("tournament_state", tournament_state)
+    await record_match_event(
+        "tiebreaker_decided",
+        {f"fixtures/tiebreaker_fixtures/{group_name}": fixtures_data['tiebreaker_fixtures'][group_name],
+         "tournament_state": tournament_state},
+        group=group_name, winner=winner_id, loser=loser_id,
+    )
 
     await update.message.reply_text(
         f"✅ Tiebreaker for Group *{escape_markdown_v2(group_name)}* submitted\!\n"
@@ -1646,18 +3822,22 @@ async def submit_tiebreaker_result(update: Update, context: ContextTypes.DEFAULT
         f"*{get_player_display_name(players.get(loser_id, {}))}* is eliminated\.",
         parse_mode=ParseMode.MARKDOWN_V2
     )
-    print(f"DEBUG: Tiebreaker for Group {group_name} resolved. Winner: {winner_id}")
+    tournament_log.debug("Tiebreaker for Group %s resolved. Winner: %s", group_name, winner_id)
+
+    # The last playoff result completes qualification; no second /advance_to_knockout needed
+    if not tournament_state.get('pending_tiebreakers') and tournament_state.get("stage") == "group_stage_completed":
+        await advance_to_knockout(context)
 
 
 
 async def notify_knockout_matches(context: ContextTypes.DEFAULT_TYPE, stage: str):
-    print(f"DEBUG: notify_knockout_matches called for stage: {stage}")
-    fixtures_data = load_state("fixtures")
-    players_data = load_state("players")
+    tournament_log.debug("notify_knockout_matches called for stage: %s", stage)
+    fixtures_data = await load_state("fixtures")
+    players_data = await load_state("players")
 
     matches = fixtures_data.get(stage, [])
     if not matches:
-        print(f"DEBUG: No matches found for stage {stage}. Not sending notification.")
+        tournament_log.debug("No matches found for stage %s. Not sending notification.", stage)
         return
 
     # Escape the stage title itself for the header
@@ -1668,10 +3848,10 @@ async def notify_knockout_matches(context: ContextTypes.DEFAULT_TYPE, stage: str
         # Ensure match has enough elements (player1_id, player2_id, score1, score2)
         # We now know knockout matches have 4 elements (including score placeholders)
         if not isinstance(match, list) or len(match) < 4:
-            print(f"WARNING: Skipping malformed match in notify_knockout_matches: {match}")
+            tournament_log.warning("Skipping malformed match in notify_knockout_matches: %s", match)
             continue
 
-        p1_id, p2_id, score1, score2 = match
+        p1_id, p2_id, score1, score2 = match[:4] # Pending knockout fixtures carry extra winner/status fields
         p1_info = players_data.get(p1_id)
         p2_info = players_data.get(p2_id)
         
@@ -1691,21 +3871,169 @@ async def notify_knockout_matches(context: ContextTypes.DEFAULT_TYPE, stage: str
                 f"vs {p2_team_escaped} (@{p2_username_escaped}){score_display}\n"
             )
         else:
-            print(f"WARNING: Could not find player info for match {match} in notify_knockout_matches.")
+            tournament_log.warning("Could not find player info for match %s in notify_knockout_matches.", match)
 
     message += "\n_Good luck to all participants!_"
     
     await context.bot.send_message(GROUP_ID, message, parse_mode=ParseMode.MARKDOWN_V2) # Use ParseMode.MARKDOWN_V2 for clarity
-    print("DEBUG: Knockout matches notification sent successfully.")
+    tournament_log.debug("Knockout matches notification sent successfully.")
+
+
+
+# === KNOCKOUT BRACKET ===
+# The knockout is a binary tree stored level by level: fixtures[stage][i] is node i of that stage,
+# shaped [p1, p2, score1, score2, winner, status]. Node i feeds slot i % 2 of node i // 2 in the
+# next stage, so a winner moves up as soon as their result is recorded, and a node becomes
+# playable once both of its feeders are done. The whole tree is created with the Round of 16.
+KNOCKOUT_STAGES = ["round_of_16", "quarter_finals", "semi_finals", "final"]
+NEXT_KNOCKOUT_STAGE = {"round_of_16": "quarter_finals", "quarter_finals": "semi_finals", "semi_finals": "final", "final": "completed"}
+
+def knockout_winner(match):
+    return match[0] if match[2] > match[3] else match[1]
+
+def knockout_node(p1_id=None, p2_id=None, score1=None, score2=None):
+    """A bracket node; winner and status follow from what is filled in."""
+    if score1 is not None and score2 is not None:
+        return [p1_id, p2_id, score1, score2, p1_id if score1 > score2 else p2_id, 'completed']
+    return [p1_id, p2_id, None, None, None, 'pending' if p1_id and p2_id else 'waiting']
+
+def bracket_parent(stage, index):
+    """(stage, index, slot) of the node this match's winner moves up to, or None for the final."""
+    next_stage = NEXT_KNOCKOUT_STAGE[stage]
+    if next_stage == "completed":
+        return None
+    return next_stage, index // 2, index % 2
+
+def empty_bracket_levels(first_round_size):
+    """Waiting nodes for every stage after the first, halving each level down to the final."""
+    levels, size = {}, first_round_size
+    for stage in KNOCKOUT_STAGES[1:]:
+        size //= 2
+        levels[stage] = [knockout_node() for _ in range(size)]
+    return levels
+
+def ensure_bracket(fixtures_data):
+    """
+    Upgrades flat per-stage lists (4-field results, later stages not drawn yet) to the tree in place.
+    Returns the fixture updates needed to persist it; empty once the tree is in place.
+    """
+    first_round = fixtures_data.get("round_of_16") or []
+    if not first_round:
+        return {}
+    updates = {}
+    size = len(first_round)
+    for stage in KNOCKOUT_STAGES:
+        level = list(fixtures_data.get(stage) or [])
+        upgraded = []
+        for i in range(size):
+            match = level[i] if i < len(level) and isinstance(level[i], list) else []
+            match = match + [None] * (4 - len(match))
+            upgraded.append(knockout_node(*match[:4]))
+        if upgraded != fixtures_data.get(stage):
+            fixtures_data[stage] = upgraded
+            updates[f"fixtures/{stage}"] = upgraded
+        size //= 2
+    # Fill slots whose feeder already has a winner (older trees only drew a stage once it was complete)
+    for stage in KNOCKOUT_STAGES[:-1]:
+        for i, match in enumerate(fixtures_data[stage]):
+            parent = bracket_parent(stage, i)
+            parent_node = fixtures_data[parent[0]][parent[1]]
+            if match[4] and parent_node[parent[2]] is None:
+                parent_node[parent[2]] = match[4]
+                fixtures_data[parent[0]][parent[1]] = knockout_node(*parent_node[:4])
+                updates[f"fixtures/{parent[0]}"] = fixtures_data[parent[0]]
+    return updates
+
+async def upgrade_bracket(fixtures_data):
+    """ensure_bracket, saved in a write of its own: its whole-level paths (fixtures/<stage>) can't
+    share a multi-path update with the node paths (fixtures/<stage>/<i>) the caller writes next."""
+    upgrades = ensure_bracket(fixtures_data)
+    if upgrades:
+        await update_state(upgrades)
+        tournament_log.info("Upgraded the knockout bracket to the tree layout: %s", ", ".join(sorted(upgrades)))
+
+def advance_winner(fixtures_data, stage, index):
+    """
+    Moves the winner of fixtures[stage][index] into its parent slot.
+    Returns (updates, ready) where ready is (stage, index) of the parent if it just became playable.
+    """
+    parent = bracket_parent(stage, index)
+    if parent is None:
+        return {}, None
+    parent_stage, parent_index, slot = parent
+    old_parent = fixtures_data[parent_stage][parent_index]
+    new_parent = list(old_parent)
+    new_parent[slot] = fixtures_data[stage][index][4]
+    new_parent = knockout_node(*new_parent[:4])
+    fixtures_data[parent_stage][parent_index] = new_parent
+    updates = {f"fixtures/{parent_stage}/{parent_index}": new_parent}
+    updates.update(pending_set_change(parent_stage, parent_index, old_parent, new_parent))
+    ready = (parent_stage, parent_index) if new_parent[5] == 'pending' and old_parent[5] != 'pending' else None
+    return updates, ready
+
+def close_knockout_stages(tournament_state, pending_counts):
+    """Moves tournament_state past every finished knockout stage; returns the round_advanced events and [(stage, next_stage)]."""
+    events, closed = [], []
+    stage = tournament_state.get("stage")
+    while stage in KNOCKOUT_STAGES and pending_counts.get(stage) == 0: # A missing counter is unknown, not zero
+        next_stage = NEXT_KNOCKOUT_STAGE[stage]
+        events.append(("round_advanced", {"stage": next_stage}))
+        closed.append((stage, next_stage))
+        stage = next_stage
+    tournament_state["stage"] = stage
+    return events, closed
+
+async def announce_ready_matches(context: ContextTypes.DEFAULT_TYPE, ready, fixtures_data, players_data):
+    """Group notice for bracket matches that just got both players."""
+    if not ready:
+        return
+    message = "🆕 *Next Knockout Matches Ready:*\n\n"
+    for stage, index in ready:
+        match = fixtures_data[stage][index]
+        message += (
+            f"*{escape_markdown_v2(get_player_team_name(match[0], players_data))}* vs "
+            f"*{escape_markdown_v2(get_player_team_name(match[1], players_data))}* "
+            f"\\({escape_markdown_v2(stage.replace('_', ' ').title())}\\)\n"
+        )
+    message += "\n_Play as soon as you are both available\\! Check /fixtures_"
+    await context.bot.send_message(GROUP_ID, message, parse_mode=ParseMode.MARKDOWN_V2)
+    # Both players hear about their match directly; single matches are too frequent for an admin report
+    entries = [pending_entry(stage, index, fixtures_data[stage][index]) for stage, index in ready]
+    await broadcast_fixtures(context, [entry for entry in entries if entry], "Knockout match ready", report=False)
 
+async def announce_knockout_transition(context: ContextTypes.DEFAULT_TYPE, stage: str, next_stage: str, fixtures_data, players_data):
+    stage_title_escaped = escape_markdown_v2(stage.replace('_', ' ').title())
+    if next_stage == "completed":
+        # Tournament is over! (Beautified)
+        final_winner_info = players_data.get(fixtures_data["final"][0][4]) # Winner of the root node
+        final_winner_team_escaped = escape_markdown_v2(final_winner_info.get('team', 'Unknown Team'))
+        final_winner_username_escaped = escape_markdown_v2(final_winner_info.get('username', 'unknown_user'))
+
+        await context.bot.send_message(
+            GROUP_ID, 
+            f"👑 *A NEW CHAMPION IS CROWNED\!* 👑\n"
+            f"🎉 The tournament has concluded and the winner is *{final_winner_team_escaped}* \(@{final_winner_username_escaped}\)\\!\n"
+            f"Congratulations to the champion and thank you to all participants\\! 🙏", # Escaped exclamation mark
+            parse_mode=ParseMode.MARKDOWN_V2
+        )
+        tournament_log.debug("Tournament completed!")
+        return
 
+    # Notify the group that the stage is over; its matches were announced as each became ready
+    await context.bot.send_message(
+        GROUP_ID, 
+        f"🌟 *ALL MATCHES CONCLUDED\!* \\- *{stage_title_escaped}*\n" # Escaped hyphen
+        f"🥳 Advancing to {escape_markdown_v2(next_stage.replace('_', ' ').title())}\\! Get ready for the next round of battles\\! 💪", # Escaped exclamation mark
+        parse_mode=ParseMode.MARKDOWN_V2
+    )
+    tournament_log.debug("Stage transition %s -> %s announced.", stage, next_stage)
 
 async def handle_knockout_score(update: Update, context: ContextTypes.DEFAULT_TYPE, stage: str, p1_id: str, p2_id: str, score1: int, score2: int):
-    print(f"DEBUG: handle_knockout_score called for stage {stage} with {p1_id}-{p2_id} score {score1}-{score2}")
+    tournament_log.debug("handle_knockout_score called for stage %s with %s-%s score %s-%s", stage, p1_id, p2_id, score1, score2)
     
-    fixtures_data = load_state("fixtures")
-    players_data = load_state("players")
-    tournament_state = load_state("tournament_state")
+    fixtures_data = await load_state("fixtures")
+    players_data = await load_state("players")
+    tournament_state = await load_state("tournament_state")
 
     # --- Input Validation and Pre-processing ---
     try:
@@ -1727,7 +4055,7 @@ async def handle_knockout_score(update: Update, context: ContextTypes.DEFAULT_TY
 
     if not winner_info or not loser_info:
         await update.message.reply_text("❌ Error: Could not find player information for one or both participants\\.", parse_mode=ParseMode.MARKDOWN_V2)
-        print(f"ERROR: Missing player info for winner_id={winner_id} or loser_id={loser_id}.")
+        tournament_log.error("Missing player info for winner_id=%s or loser_id=%s.", winner_id, loser_id)
         return
 
     # Escape player/team/username info and stage title for Markdown messages
@@ -1738,30 +4066,56 @@ async def handle_knockout_score(update: Update, context: ContextTypes.DEFAULT_TY
     stage_title_escaped = escape_markdown_v2(stage.replace('_', ' ').title())
 
     # --- Find and Update the Match in Fixtures ---
+    await upgrade_bracket(fixtures_data) # No-op unless the bracket predates the tree layout
+    updates = {}
     current_matches = fixtures_data.get(stage, [])
     match_found_and_updated = False
+    match_index = None
     for i, match in enumerate(current_matches):
         if not isinstance(match, list) or len(match) < 2:
-            print(f"WARNING: Skipping malformed match in current_matches: {match}")
+            tournament_log.warning("Skipping malformed match in current_matches: %s", match)
             continue
 
+        was_pending = len(match) < 4 or match[2] is None
         if (match[0] == p1_id and match[1] == p2_id):
-            current_matches[i] = [p1_id, p2_id, score1, score2]
+            current_matches[i] = knockout_node(p1_id, p2_id, score1, score2)
             match_found_and_updated = True
+            match_index = i
             break
         elif (match[0] == p2_id and match[1] == p1_id):
-            current_matches[i] = [p2_id, p1_id, score2, score1] 
+            current_matches[i] = knockout_node(p2_id, p1_id, score2, score1) # Keep the bracket's slot order
             match_found_and_updated = True
+            match_index = i
             break
 
     if not match_found_and_updated:
         await update.message.reply_text("❌ Error: Knockout match not found or already processed in fixtures for this stage\\.", parse_mode=ParseMode.MARKDOWN_V2)
-        print(f"ERROR: Knockout match {p1_id}-{p2_id} not found/updated in stage {stage}.")
+        tournament_log.error("Knockout match %s-%s not found/updated in stage %s.", p1_id, p2_id, stage)
         return
 
     fixtures_data[stage] = current_matches
-    save_state("fixtures", fixtures_data)
-    print(f"DEBUG: Fixtures data saved for stage {stage} after score update.")
+    updates[f"fixtures/{stage}/{match_index}"] = current_matches[match_index]
+    updates.update(match_view_updates(stage, match_index, current_matches[match_index], players_data))
+    events = [("result_recorded", {"stage": stage, "p1": p1_id, "p2": p2_id, "s1": score1, "s2": score2})]
+    ready, closed = None, []
+    if was_pending:
+        pending_counts = await load_pending_counts()
+        updates.update(set_pending_count(pending_counts, stage, await pending_count(pending_counts, stage) - 1))
+        updates.update(pending_set_change(stage, match_index, match, current_matches[match_index]))
+        tournament_log.debug("Pending matches left in %s: %s", stage, pending_counts[stage])
+        # The winner moves up the tree right away; their next match is playable once its other feeder is done
+        winner_updates, ready = advance_winner(fixtures_data, stage, match_index)
+        updates.update(winner_updates)
+        parent = bracket_parent(stage, match_index)
+        if parent:
+            # The winner's view moves up to their next match
+            updates.update(match_view_updates(parent[0], parent[1], fixtures_data[parent[0]][parent[1]], players_data))
+        stage_events, closed = close_knockout_stages(tournament_state, pending_counts)
+        if stage_events:
+            updates["tournament_state"] = tournament_state
+            events.extend(stage_events)
+    await record_match_events(events, updates)
+    tournament_log.debug("Fixtures data saved for stage %s after score update.", stage)
 
     # --- Send Confirmation Messages (Beautified) ---
     # Confirmation for the admin
@@ -1778,84 +4132,326 @@ async def handle_knockout_score(update: Update, context: ContextTypes.DEFAULT_TY
         f"🌟 *{winner_team_escaped}* advances to the *{stage_title_escaped}*\\! @{winner_username_escaped}", # Escaped exclamation mark
         parse_mode=ParseMode.MARKDOWN_V2
     )
-    print(f"DEBUG: Score notification sent for {winner_team_escaped} vs {loser_team_escaped}.")
-
-    # --- Check for Stage Completion and Advance ---
-    all_matches_completed = True
-    for match in current_matches:
-        if match[2] is None or match[3] is None:
-            all_matches_completed = False
+    tournament_log.debug("Score notification sent for %s vs %s.", winner_team_escaped, loser_team_escaped)
+
+    for closed_stage, next_stage in closed:
+        await announce_knockout_transition(context, closed_stage, next_stage, fixtures_data, players_data)
+    await announce_ready_matches(context, [ready] if ready else [], fixtures_data, players_data)
+
+# === SCORE CORRECTION ===
+
+def recorded_results(fixtures_data):
+    """Every fixture that has a score, in a stable order: [(stage, group, index, match)]."""
+    results = []
+    for group_name in sorted(fixtures_data.get("group_stage") or {}):
+        for i, match in enumerate(fixtures_data["group_stage"][group_name] or []):
+            if isinstance(match, list) and len(match) >= 4 and match[2] is not None:
+                results.append(("group_stage", group_name, i, match))
+    for stage in KNOCKOUT_STAGES:
+        for i, match in enumerate(fixtures_data.get(stage) or []):
+            if isinstance(match, list) and len(match) >= 4 and match[2] is not None:
+                results.append((stage, None, i, match))
+    return results
+
+def reroute_knockout_winner(fixtures_data, stage, match_index, new_winner):
+    """
+    Puts `new_winner` into the bracket slot the corrected match feeds, walking up the tree only as far
+    as needed: a later match the old winner already played is voided back to unplayed and the slot
+    it fed is emptied. Returns (fixture updates by path, voided matches as (stage, match), ready) where
+    ready is (stage, index) of the match `new_winner` moved into if it now has both players.
+    """
+    updates, voided, ready = {}, [], None
+    index, replacement = match_index, new_winner
+    parent = bracket_parent(stage, index)
+    while parent:
+        parent_stage, parent_index, slot = parent
+        old_node = fixtures_data[parent_stage][parent_index]
+        played = old_node[2] is not None
+        if played:
+            voided.append((parent_stage, old_node))
+        node = list(old_node)
+        node[slot] = replacement
+        node = knockout_node(*node[:2]) # Unplayed either way: a voided match is replayed
+        if replacement and node[5] == 'pending':
+            ready = (parent_stage, parent_index) # A new pairing, even if the slot's old match was pending too
+        updates.update(pending_set_change(parent_stage, parent_index, old_node, node))
+        fixtures_data[parent_stage][parent_index] = node
+        updates[f"fixtures/{parent_stage}/{parent_index}"] = node
+        if not played:
             break
-    
-    print(f"DEBUG: All matches in {stage} completed: {all_matches_completed}")
-
-    if all_matches_completed:
-        next_stage = ""
-        if stage == "round_of_16":
-            next_stage = "quarter_finals"
-        elif stage == "quarter_finals":
-            next_stage = "semi_finals"
-        elif stage == "semi_finals":
-            next_stage = "final"
-        elif stage == "final":
-            next_stage = "completed"
-
-        if next_stage == "completed":
-            # Tournament is over! (Beautified)
-            final_winner_info = players_data.get(winner_id) # Get winner info again, it's the last winner
-            final_winner_team_escaped = escape_markdown_v2(final_winner_info.get('team', 'Unknown Team'))
-            final_winner_username_escaped = escape_markdown_v2(final_winner_info.get('username', 'unknown_user'))
+        index, replacement = parent_index, None # The voided match has no winner to pass on
+        parent = bracket_parent(parent_stage, index)
+    return updates, voided, ready
 
-            await context.bot.send_message(
-                GROUP_ID, 
-                f"👑 *A NEW CHAMPION IS CROWNED\!* 👑\n"
-                f"🎉 The tournament has concluded and the winner is *{final_winner_team_escaped}* \(@{final_winner_username_escaped}\)\\!\n"
-                f"Congratulations to the champion and thank you to all participants\\! 🙏", # Escaped exclamation mark
-                parse_mode=ParseMode.MARKDOWN_V2
-            )
-            tournament_state["stage"] = "completed"
-            save_state("tournament_state", tournament_state)
-            print("DEBUG: Tournament completed!")
+async def correct_score(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Admin: /correct lists recorded results; /correct <n> a-b replaces result n.
+    Group results swap their stat delta in place; knockout results re-route only the bracket path
+    above the corrected match.
+    """
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("❌ Only the admin can correct scores.")
+        return
+
+    fixtures_data = await load_state("fixtures")
+    players = await load_state("players")
+    tournament_state = await load_state("tournament_state")
+    results = recorded_results(fixtures_data)
+
+    if not context.args:
+        if not results:
+            await update.message.reply_text("ℹ️ No results have been recorded yet.")
             return
+        lines = ["✏️ Recorded results (use /correct <n> a-b):"]
+        for n, (stage, group_name, _, match) in enumerate(results, 1):
+            where = group_name if group_name else stage.replace('_', ' ').title()
+            lines.append(f"{n}. {get_player_team_name(match[0], players)} {match[2]}-{match[3]} "
+                         f"{get_player_team_name(match[1], players)} ({where})")
+        await update.message.reply_text("\n".join(lines))
+        return
 
-        winners_of_current_stage_ordered = []
-        for match in current_matches:
-            if match[2] is not None and match[3] is not None:
-                winner = match[0] if match[2] > match[3] else match[1]
-                winners_of_current_stage_ordered.append(winner)
-            else:
-                print(f"WARNING: Found incomplete match while collecting winners for next stage: {match}")
+    try:
+        if len(context.args) != 2:
+            raise ValueError("expected a result number and a score")
+        number = int(context.args[0].lstrip("#").removeprefix("match"))
+        goals = context.args[1].split("-")
+        if len(goals) != 2:
+            raise ValueError("invalid score format")
+        score1, score2 = int(goals[0]), int(goals[1])
+        if not 1 <= number <= len(results):
+            raise ValueError(f"there is no result {number}")
+    except ValueError as ve:
+        await update.message.reply_text(f"❌ Invalid format. Use like: /correct 3 2-1. Error: {ve}")
+        return
 
-        next_stage_fixtures = []
-        for i in range(0, len(winners_of_current_stage_ordered), 2):
-            if i + 1 < len(winners_of_current_stage_ordered):
-                next_stage_fixtures.append([winners_of_current_stage_ordered[i], winners_of_current_stage_ordered[i+1], None, None, None, 'pending'])
-            else:
-                print(f"WARNING: Odd number of winners ({len(winners_of_current_stage_ordered)}) for {next_stage}. This indicates an issue in bracket generation or reporting.")
+    stage, group_name, match_index, match = results[number - 1]
+    p1_id, p2_id, old_score1, old_score2 = match[:4]
+    if (old_score1, old_score2) == (score1, score2):
+        await update.message.reply_text("ℹ️ That is already the recorded score.")
+        return
 
-        fixtures_data[next_stage] = next_stage_fixtures
-        tournament_state["stage"] = next_stage
-        save_state("fixtures", fixtures_data)
-        save_state("tournament_state", tournament_state)
-        print(f"DEBUG: Advanced to {next_stage}. New fixtures: {json.dumps(next_stage_fixtures, indent=2)}")
+    updates = {}
+    voided, ready = [], None
+    p1_team = get_player_team_name(p1_id, players)
+    p2_team = get_player_team_name(p2_id, players)
+    where = group_name if group_name else stage.replace('_', ' ').title()
+    notice = f"✏️ *Score correction* \\({escape_markdown_v2(where)}\\)\n" \
+             f"*{escape_markdown_v2(p1_team)}* {score1} \\- {score2} *{escape_markdown_v2(p2_team)}* " \
+             f"\\(was {old_score1}\\-{old_score2}\\)"
+
+    if stage == "group_stage":
+        if tournament_state.get("stage") != "group_stage":
+            await update.message.reply_text("❌ Group results are final once the group stage has ended.")
+            return
+        p1_stats = players[p1_id].setdefault('stats', empty_stats())
+        p2_stats = players[p2_id].setdefault('stats', empty_stats())
+        apply_result_delta(p1_stats, p2_stats, old_score1, old_score2, sign=-1)
+        apply_result_delta(p1_stats, p2_stats, score1, score2)
+        corrected = [p1_id, p2_id, score1, score2, match[4]]
+        updates[f"players/{p1_id}/stats"] = p1_stats
+        updates[f"players/{p2_id}/stats"] = p2_stats
+    else:
+        if score1 == score2:
+            await update.message.reply_text("❌ Knockout matches cannot be a draw. Please enter a decisive score.")
+            return
+        await upgrade_bracket(fixtures_data)
+        corrected = knockout_node(p1_id, p2_id, score1, score2)
+        old_winner = knockout_winner(match)
+        new_winner = knockout_winner(corrected)
+        if new_winner != old_winner:
+            path_updates, voided, ready = reroute_knockout_winner(fixtures_data, stage, match_index, new_winner)
+            updates.update(path_updates)
+            notice += f"\n🔀 *{escape_markdown_v2(get_player_team_name(new_winner, players))}* advances instead of " \
+                      f"*{escape_markdown_v2(get_player_team_name(old_winner, players))}*\\."
+            if voided:
+                pending_counts = await load_pending_counts()
+                for v_stage, _ in voided:
+                    updates.update(set_pending_count(pending_counts, v_stage, await pending_count(pending_counts, v_stage) + 1))
+                # The stage rolls back to the earliest stage that has a match to replay
+                tournament_state["stage"] = voided[0][0]
+                updates["tournament_state"] = tournament_state
+                notice += f"\n♻️ {len(voided)} later match\\(es\\) involving them will be replayed\\."
+            elif stage == "final":
+                notice += f"\n👑 The champion is *{escape_markdown_v2(get_player_team_name(new_winner, players))}*\\!"
+            # Only the admin match shortcuts that point at the old winner are stale
+            for key in [k for k, info in current_admin_matches.items() if old_winner in (info["p1_id"], info["p2_id"])]:
+                del current_admin_matches[key]
+
+    fixtures_slot = f"fixtures/group_stage/{group_name}/{match_index}" if group_name else f"fixtures/{stage}/{match_index}"
+    updates[fixtures_slot] = corrected
+    if group_name:
+        fixtures_data["group_stage"][group_name][match_index] = corrected
+    else:
+        fixtures_data[stage][match_index] = corrected
+    # A re-routed winner can move several players' views; corrections are rare enough to rebuild them all
+    updates["match_views"] = build_match_views(fixtures_data, tournament_state, players)
+    await record_match_event(
+        "result_corrected", updates,
+        stage=stage, group=group_name, round=match[4] if group_name else None,
+        p1=p1_id, p2=p2_id, s1=score1, s2=score2, old_s1=old_score1, old_s2=old_score2,
+        voided=[match_ref(v_stage, v_match[0], v_match[1]) for v_stage, v_match in voided],
+    )
 
-        # Notify the group about advancing to the next stage and new matches (Beautified)
-        await context.bot.send_message(
-            GROUP_ID, 
-            f"🌟 *ALL MATCHES CONCLUDED\!* \\- *{stage_title_escaped}*\n" # Escaped hyphen
-            f"🥳 Advancing to {escape_markdown_v2(next_stage.replace('_', ' ').title())}\\! Get ready for the next round of battles\\! 💪", # Escaped exclamation mark
-            parse_mode=ParseMode.MARKDOWN_V2
+    await update.message.reply_text(f"✅ Result {number} corrected to {score1}-{score2}.")
+    await context.bot.send_message(GROUP_ID, notice, parse_mode=ParseMode.MARKDOWN_V2)
+    # Same notice and DMs as a freshly recorded result when the re-routed winner completes a pairing
+    await announce_ready_matches(context, [ready] if ready else [], fixtures_data, players)
+
+# === BULK SCORE ENTRY ===
+BULK_MATCH_LINE_RE = re.compile(r"^/?(match\d+)(?:@\w+)?\s+(\d+)\s*-\s*(\d+)$", re.IGNORECASE)
+BULK_TEAMS_LINE_RE = re.compile(r"^(.+?)\s+(\d+)\s*-\s*(\d+)\s+(.+)$")
+
+def normalize_team_name(name):
+    """"🇧🇷 Brazil", "brazil" and "BRAZIL!" all become "brazil"."""
+    return " ".join(re.sub(r"[^\w\s]", " ", name).lower().split())
+
+async def bulk_scores(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Admin: /scores followed by one result per line ("match3 2-1" or "Brazil 1-0 Spain").
+    Every line is validated before anything is written; the batch is one multi-path update
+    and one digest message.
+    """
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("❌ Only the admin can enter scores.")
+        return
+
+    lines = update.message.text.splitlines()
+    first_line = lines[0].split(None, 1) # Results may start on the command line itself
+    lines = ([first_line[1]] if len(first_line) > 1 else []) + lines[1:]
+    lines = [line.strip() for line in lines if line.strip()]
+    if not lines:
+        await update.message.reply_text(
+            "Usage: /scores followed by one result per line, e.g.\n/scores\nmatch3 2-1\nBrazil 1-0 Spain"
+        )
+        return
+
+    fixtures_data = await load_state("fixtures")
+    players = await load_state("players")
+    tournament_state = await load_state("tournament_state")
+    pending = await load_pending_matches(tournament_state)
+    pending_by_pair = {frozenset((m["p1_id"], m["p2_id"])): m for m in pending}
+    ids_by_team = {normalize_team_name(p.get('team', '')): p_id for p_id, p in players.items()}
+
+    accepted, errors, seen = [], [], set()
+    for line in lines:
+        match_line = BULK_MATCH_LINE_RE.match(line)
+        teams_line = None if match_line else BULK_TEAMS_LINE_RE.match(line)
+        if match_line:
+            info = current_admin_matches.get(match_line.group(1).lower())
+            if not info:
+                errors.append(f"{line} → unknown match, use /addscore to list current matches")
+                continue
+            side1, side2 = info["p1_id"], info["p2_id"]
+            goals1, goals2 = int(match_line.group(2)), int(match_line.group(3))
+        elif teams_line:
+            side1 = ids_by_team.get(normalize_team_name(teams_line.group(1)))
+            side2 = ids_by_team.get(normalize_team_name(teams_line.group(4)))
+            if not side1 or not side2:
+                errors.append(f"{line} → unknown team")
+                continue
+            goals1, goals2 = int(teams_line.group(2)), int(teams_line.group(3))
+        else:
+            errors.append(f"{line} → expected 'match3 2-1' or 'Brazil 1-0 Spain'")
+            continue
+
+        pair = frozenset((side1, side2))
+        fixture = pending_by_pair.get(pair)
+        if not fixture:
+            errors.append(f"{line} → no pending match between these teams in the current round")
+            continue
+        if pair in seen:
+            errors.append(f"{line} → this match appears twice")
+            continue
+        if fixture["type"] == "knockout" and goals1 == goals2:
+            errors.append(f"{line} → knockout matches cannot be a draw")
+            continue
+        seen.add(pair)
+        if side1 != fixture["p1_id"]: # Typed the other way round; store in fixture order
+            goals1, goals2 = goals2, goals1
+        accepted.append((fixture, goals1, goals2))
+
+    if errors:
+        await update.message.reply_text("❌ Nothing was recorded. Fix these lines and resend:\n" + "\n".join(errors))
+        return
+
+    await upgrade_bracket(fixtures_data)
+    updates, events, digest, ready = {}, [], [], []
+    for fixture, score1, score2 in accepted:
+        p1_id, p2_id, index = fixture["p1_id"], fixture["p2_id"], fixture["index"]
+        if fixture["type"] == "group":
+            group_name = fixture["group"]
+            result = [p1_id, p2_id, score1, score2, fixture["round_num"]]
+            fixtures_data["group_stage"][group_name][index] = result
+            updates[f"fixtures/group_stage/{group_name}/{index}"] = result
+            update_player_stats(players, p1_id, p2_id, score1, score2)
+            updates[f"players/{p1_id}/stats"] = players[p1_id]['stats']
+            updates[f"players/{p2_id}/stats"] = players[p2_id]['stats']
+            where = group_name
+        else:
+            result = knockout_node(p1_id, p2_id, score1, score2)
+            fixtures_data[fixture["stage"]][index] = result
+            updates[f"fixtures/{fixture['stage']}/{index}"] = result
+            winner_updates, ready_match = advance_winner(fixtures_data, fixture["stage"], index)
+            updates.update(winner_updates)
+            if ready_match:
+                ready.append(ready_match)
+            where = fixture["stage"].replace('_', ' ').title()
+        events.append(("result_recorded", {
+            "stage": fixture["stage"], "group": fixture["group"], "round": fixture["round_num"],
+            "p1": p1_id, "p2": p2_id, "s1": score1, "s2": score2,
+        }))
+        digest.append(
+            f"*{escape_markdown_v2(get_player_team_name(p1_id, players))}* {score1} \\- {score2} "
+            f"*{escape_markdown_v2(get_player_team_name(p2_id, players))}* _{escape_markdown_v2(where)}_"
         )
-        await notify_knockout_matches(context, next_stage)
-        print(f"DEBUG: Notifications sent for {next_stage} start.")
+
+    stage = tournament_state.get("stage")
+    pending_counts = await load_pending_counts()
+    for fixture, _, _ in accepted:
+        key = round_key(fixture["stage"], fixture["round_num"])
+        updates.update(set_pending_count(pending_counts, key, await pending_count(pending_counts, key) - 1))
+        updates[f"match_index/pending/{match_ref(fixture['stage'], fixture['p1_id'], fixture['p2_id'], fixture['group'])}"] = None
+    remaining = len(pending) - len(accepted) + len(ready)
+    closed = []
+    round_closed = False
+    if stage in KNOCKOUT_STAGES:
+        stage_events, closed = close_knockout_stages(tournament_state, pending_counts)
+        if stage_events:
+            updates["tournament_state"] = tournament_state
+            events.extend(stage_events)
+    elif remaining == 0 and stage == "group_stage" and tournament_state.get("auto_advance"):
+        round_closed = True
+        events.append(group_round_transition(tournament_state))
+        updates["tournament_state"] = tournament_state
+    # A batch can touch most of the round; one rebuild is simpler than chasing each bracket move
+    updates["match_views"] = build_match_views(fixtures_data, tournament_state, players)
+
+    await record_match_events(events, updates)
+    recorded_pairs = {frozenset((f["p1_id"], f["p2_id"])) for f, _, _ in accepted}
+    for key in [k for k, info in current_admin_matches.items() if frozenset((info["p1_id"], info["p2_id"])) in recorded_pairs]:
+        del current_admin_matches[key]
+
+    await update.message.reply_text(f"✅ Recorded {len(accepted)} result(s) in one update. {remaining} match(es) still pending.")
+    await context.bot.send_message(
+        GROUP_ID,
+        f"📋 *Results Digest* \\({len(accepted)}\\)\n" + "\n".join(digest) +
+        "\n\n_➡️ Check /standings and /showknockout for the updated tables\\! 📊_",
+        parse_mode=ParseMode.MARKDOWN_V2
+    )
+
+    for closed_stage, next_stage in closed:
+        await announce_knockout_transition(context, closed_stage, next_stage, fixtures_data, players)
+    await announce_ready_matches(context, ready, fixtures_data, players)
+    if round_closed:
+        await announce_group_round_transition(context, tournament_state)
 
 async def mygroup(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
-    print(f"DEBUG: MyGroup command received from user_id: {user_id}")
+    handler_log.debug("MyGroup command received from user_id: %s", user_id)
 
-    players = load_state("players")
-    tournament_state = load_state("tournament_state")
-    fixtures_data = load_state("fixtures") # Needed for group stage matches to calculate standings
+    players = await load_state("players")
+    tournament_state = await load_state("tournament_state")
+    fixtures_data = await load_state("fixtures") # Needed for group stage matches to calculate standings
     
     current_stage = tournament_state.get("stage", "registration")
 
@@ -1877,86 +4473,14 @@ async def mygroup(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # --- Display Group Standings for user's group (simplified to Team Name and Points) ---
         
         group_matches = fixtures_data.get("group_stage", {}).get(player_group, [])
-        
-        # Calculate standings for this specific group
-        group_players_stats = {} 
-        # Initialize players in the group even if they have no matches, so they appear
-        # Also, fetch their initial stats (if any) and ensure 'ga' is initialized
-        for p_id_in_group in load_state("groups").get(player_group, []):
-            if p_id_in_group in players:
-                p_details = players[p_id_in_group]
-                group_players_stats[p_id_in_group] = {
-                    'team': p_details.get('team', 'N/A'),
-                    'username': p_details.get('username', 'N/A'),
-                    'points': p_details.get("stats", {}).get("points", 0),
-                    'gd': p_details.get("stats", {}).get("gd", 0), 
-                    'gf': p_details.get("stats", {}).get("gf", 0),
-                    'ga': p_details.get("stats", {}).get("ga", 0), # <<< BUG FIX: Initialize 'ga'
-                    'wins': p_details.get("stats", {}).get("wins", 0),
-                    'draws': p_details.get("stats", {}).get("draws", 0),
-                    'losses': p_details.get("stats", {}).get("losses", 0)
-                }
-
-        # Update stats based on completed matches in this group
-        for match in group_matches:
-            # Check if match is completed (has 5 elements and score is not None)
-            if len(match) == 5 and match[2] is not None and match[3] is not None:
-                p1_id, p2_id, score1, score2, _ = match
-
-                # This part initializes players if they somehow weren't already
-                # and ensures all necessary keys are present.
-                for p_id_in_match in [p1_id, p2_id]:
-                    if p_id_in_match not in group_players_stats:
-                        p_details = players.get(p_id_in_match, {})
-                        group_players_stats[p_id_in_match] = {
-                            'team': p_details.get('team', 'N/A'),
-                            'username': p_details.get('username', 'N/A'),
-                            'points': p_details.get("stats", {}).get("points", 0),
-                            'gd': p_details.get("stats", {}).get("gd", 0),
-                            'gf': p_details.get("stats", {}).get("gf", 0),
-                            'ga': p_details.get("stats", {}).get("ga", 0), # Initialize GA here too
-                            'wins': p_details.get("stats", {}).get("wins", 0),
-                            'draws': p_details.get("stats", {}).get("draws", 0),
-                            'losses': p_details.get("stats", {}).get("losses", 0)
-                        }
-
-                # Update stats for player 1
-                group_players_stats[p1_id]['gf'] += score1
-                group_players_stats[p1_id]['ga'] += score2
-                group_players_stats[p1_id]['gd'] = group_players_stats[p1_id]['gf'] - group_players_stats[p1_id]['ga'] # Recalculate GD
-
-                # Update stats for player 2
-                group_players_stats[p2_id]['gf'] += score2
-                group_players_stats[p2_id]['ga'] += score1
-                group_players_stats[p2_id]['gd'] = group_players_stats[p2_id]['gf'] - group_players_stats[p2_id]['ga'] # Recalculate GD
-
-                if score1 > score2:
-                    group_players_stats[p1_id]['wins'] += 1
-                    group_players_stats[p1_id]['points'] += 3
-                    group_players_stats[p2_id]['losses'] += 1
-                elif score1 < score2:
-                    group_players_stats[p2_id]['wins'] += 1
-                    group_players_stats[p2_id]['points'] += 3
-                    group_players_stats[p1_id]['losses'] += 1
-                else: # Draw
-                    group_players_stats[p1_id]['draws'] += 1
-                    group_players_stats[p1_id]['points'] += 1
-                    group_players_stats[p2_id]['draws'] += 1
-                    group_players_stats[p2_id]['points'] += 1
-
-        standings_list = []
-        for p_id, stats in group_players_stats.items():
-            # Only include team and points for display
-            standings_list.append({
-                "team": stats['team'],
-                "username": stats['username'], # Keep username for potential future use or debugging
-                "points": stats['points'],
-                "gd": stats['gd'], # Keep for sorting
-                "gf": stats['gf'], # Keep for sorting
-            })
-
-        # Sort by points, then GD, then GF (all descending)
-        standings_list.sort(key=lambda x: (x['points'], x['gd'], x['gf']), reverse=True)
+        group_player_ids = (await load_state("groups")).get(player_group, [])
+        # Ranked from the fixtures with the same tiebreak chain as qualification
+        order, table, _ = rank_group(player_group, group_matches, group_player_ids,
+                                     tournament_state.get("fair_play"), recorded_playoffs(fixtures_data).get(player_group))
+        standings_list = [
+            {"team": players.get(p_id, {}).get('team', 'N/A'), "points": table[p_id]['points']}
+            for p_id in order
+        ]
 
         reply_text += f"*📊 Your Group \\({escape_markdown_v2(player_group.upper())}\\) Standings:*\n\n"
         
@@ -1978,16 +4502,10 @@ async def mygroup(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         reply_text += f"*🏆 Group {escape_markdown_v2(player_group.upper())} Qualifiers:*\n\n"
         
-        players_in_my_group = [
-            (p_id, p_info) for p_id, p_info in players.items() 
-            if p_info.get('group') == player_group and 'stats' in p_info
-        ]
-
-        sorted_my_group_players = sorted(
-            players_in_my_group,
-            key=lambda x: (x[1]['stats']['points'], x[1]['stats']['gd'], x[1]['stats']['gf']),
-            reverse=True
-        )
+        group_player_ids = (await load_state("groups")).get(player_group, [])
+        order, _, _ = rank_group(player_group, fixtures_data.get("group_stage", {}).get(player_group, []), group_player_ids,
+                                 tournament_state.get("fair_play"), recorded_playoffs(fixtures_data).get(player_group))
+        sorted_my_group_players = [(p_id, players[p_id]) for p_id in order if p_id in players]
 
         if len(sorted_my_group_players) >= 2:
             top_1 = sorted_my_group_players[0]
@@ -2020,42 +4538,38 @@ async def mygroup(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         await update.message.reply_text(reply_text, parse_mode=ParseMode.MARKDOWN_V2) # Removed reply_markup
     except Exception as e:
-        print(f"ERROR: Could not send reply for /mygroup due to markdown parsing error: {e}")
-        print(f"Problematic reply_text:\n{reply_text}")
+        handler_log.error("Could not send reply for /mygroup due to markdown parsing error: %s\nProblematic reply_text:\n%s", e, reply_text)
         await update.message.reply_text("An error occurred while formatting your group info\\. Please contact admin\\. Here's the raw info: \\[`Error: {escape_markdown_v2(str(e))}`\\]", parse_mode=ParseMode.MARKDOWN_V2)
 def get_player_team_name(player_id, players_data):
+    if player_id is None:
+        return 'TBD' # Bracket slot still waiting for its feeder match
     return players_data.get(player_id, {}).get('team', f'Unknown Player ({player_id})')
 
 async def show_knockout_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    fixtures_data = load_state("fixtures")
-    players_data = load_state("players")
-    tournament_state = load_state("tournament_state")
-    current_stage = tournament_state.get("stage")
+    reply = await READ_FLIGHTS.run("showknockout", render_knockout_status)
+    await update.message.reply_text(reply, parse_mode=ParseMode.MARKDOWN_V2)
 
-    knockout_stages_order = ["round_of_16", "quarter_finals", "semi_finals", "final"]
+async def render_knockout_status():
+    fixtures_data = await load_state("fixtures")
+    players_data = await load_player_index() # Team names only
+    tournament_state = await load_state("tournament_state")
+    current_stage = tournament_state.get("stage")
 
     # Escape current stage title for general messages
-    current_stage_title_escaped = escape_markdown_v2(current_stage.replace('_', ' ').title())
+    current_stage_title_escaped = escape_markdown_v2((current_stage or "registration").replace('_', ' ').title())
 
-    if current_stage not in knockout_stages_order and current_stage != "completed":
+    if current_stage not in KNOCKOUT_STAGES and current_stage != "completed":
         # Beautified message for non-knockout/non-completed stages
-        await update.message.reply_text(
+        return (
             f"ℹ️ *Tournament Stage:* {current_stage_title_escaped} \\(Knockout bracket not active yet\\)\\.\n\n"
-            f"Check group details with /showgroups \\! 📊",
-            parse_mode=ParseMode.MARKDOWN_V2
+            f"Check group details with /showgroups \\! 📊"
         )
-        return
-    elif current_stage == "completed":
-        final_winner_id = None
-        final_stage_matches = fixtures_data.get("final", [])
-        if final_stage_matches and final_stage_matches[0][2] is not None:
-            # Assuming final_stage_matches[0] is the only match and it's played
-            match = final_stage_matches[0]
-            if match[2] > match[3]:
-                final_winner_id = match[0]
-            else:
-                final_winner_id = match[1]
-        
+
+    ensure_bracket(fixtures_data) # Render older flat brackets as a tree too (nothing is written here)
+    final_node = (fixtures_data.get("final") or [None])[0]
+    final_winner_id = final_node[4] if final_node else None # The root of the tree holds the champion
+
+    if current_stage == "completed":
         if final_winner_id:
             winner_team = escape_markdown_v2(get_player_team_name(final_winner_id, players_data))
             # Beautified message for completed tournament with winner
@@ -2074,69 +4588,345 @@ async def show_knockout_status(update: Update, context: ContextTypes.DEFAULT_TYP
         # Beautified header for active knockout stage
         reply = f"🥊 *Knockout Bracket: {current_stage_title_escaped}* 🥊\n\n"
 
-
-    # Iterate through all knockout stages to build the full bracket view
-    for stage_name in knockout_stages_order:
+    # One line per tree node, level by level from the leaves up to the final
+    for stage_name in KNOCKOUT_STAGES:
         stage_title_escaped = escape_markdown_v2(stage_name.replace('_', ' ').title()) # Re-escape for internal stage headers
-        matches_in_stage = fixtures_data.get(stage_name, [])
-
-        if not matches_in_stage:
-            # Check if this stage is in the future relative to current_stage
-            if knockout_stages_order.index(stage_name) > knockout_stages_order.index(current_stage):
-                # Beautified message for future stages (not yet drawn)
-                reply += f"\-\-\- 🔮 *{stage_title_escaped}:* \\(Matches to be drawn\\) \-\-\-\n\n"
-            elif stage_name == "final" and current_stage == "semi_finals":
-                # Beautified message for final when semi-final winners are TBD
-                 reply += f"\-\-\- 🗓️ *{stage_title_escaped}:* \\(Teams TBD\\) \-\-\-\n\n"
-            # else: don't print if it's a past stage that somehow got empty (shouldn't happen with proper flow)
-            continue
-        
         # Beautified stage header
-        reply += f"\-\-\- ✨ *{stage_title_escaped}* ✨ \-\-\-\n"
-        
-        for match_num, match in enumerate(matches_in_stage, 1):
-            if not isinstance(match, list) or len(match) < 4:
-                print(f"WARNING: Skipping malformed match in {stage_name}: {match}")
-                continue
-
-            p1_id, p2_id, score1, score2 = match[:4]
+        reply += f"\\-\\-\\- ✨ *{stage_title_escaped}* ✨ \\-\\-\\-\n"
 
-            p1_team = escape_markdown_v2(get_player_team_name(p1_id, players_data))
-            p2_team = escape_markdown_v2(get_player_team_name(p2_id, players_data))
+        for node in fixtures_data.get(stage_name) or []:
+            p1_team = escape_markdown_v2(get_player_team_name(node[0], players_data))
+            p2_team = escape_markdown_v2(get_player_team_name(node[1], players_data))
 
-            if score1 is not None and score2 is not None:
+            if node[5] == 'completed':
                 # Beautified completed match line: bold teams, explicit winner arrow
-                winner_team = p1_team if score1 > score2 else p2_team
-                loser_team = p2_team if score1 > score2 else p1_team
+                winner_team = escape_markdown_v2(get_player_team_name(node[4], players_data))
                 reply += (
-                    f"✅ *{p1_team}* {score1} \\- {score2} *{p2_team}* "
+                    f"✅ *{p1_team}* {node[2]} \\- {node[3]} *{p2_team}* "
                     f"\\(Winner: *{winner_team}*\\) ➡️\n" # Added right arrow emoji
                 )
-            else:
+            elif node[5] == 'pending':
                 # Beautified pending match line: bold teams, more descriptive status
                 reply += f"⏳ *{p1_team}* vs *{p2_team}* \\(Awaiting Result\\) ➡️\n" # Added right arrow emoji
+            else:
+                reply += f"🔮 *{p1_team}* vs *{p2_team}* \\(Waiting for the previous round\\)\n"
         reply += "\n" # Spacing between stages
 
-    await update.message.reply_text(reply, parse_mode=ParseMode.MARKDOWN_V2)
+    return reply
+
+# === TOURNAMENT ARCHIVE ===
+# A season is packed into one versioned blob under `archive/<season_id>`: the live keys below
+# plus the ledger's results, as zlib-compressed JSON in base64. `archive` and `archive_index` are
+# cold keys (see COLD_STATE_KEYS), so the tree the bot reads stays the size of one season.
+# `archive_index` answers lookups without unpacking a blob:
+#   seasons/<season_id>                   {at, version, completed, champion, runner_up, players, results, bytes}
+#   pairs/<low_id>:<high_id>/<season_id>  [[stage, low_id's goals, high_id's goals], ...]
+ARCHIVE_VERSION = 1
+ARCHIVE_KEYS = ("players", "groups", "fixtures", "tournament_state", "rules_list")
+
+def pack_archive(season):
+    raw = json.dumps(season, separators=(",", ":"), sort_keys=True).encode()
+    return {"version": ARCHIVE_VERSION, "codec": "zlib+base64", "raw_bytes": len(raw),
+            "data": base64.b64encode(zlib.compress(raw, 9)).decode()}
+
+def unpack_archive(record):
+    if record.get("version") != ARCHIVE_VERSION or record.get("codec") != "zlib+base64":
+        raise ValueError(f"Unsupported archive format {record.get('codec')} v{record.get('version')}")
+    return json.loads(zlib.decompress(base64.b64decode(record["data"])))
+
+def pair_key(p1_id, p2_id):
+    low, high = sorted((str(p1_id), str(p2_id)))
+    return f"{low}:{high}"
+
+def archived_player(player_id, players):
+    if not player_id:
+        return None
+    info = players.get(player_id) or {}
+    return {"id": player_id, "team": info.get("team"), "username": info.get("username")}
+
+def season_pairs(results):
+    """{pair_key: [[stage, low_score, high_score], ...]} for every recorded result."""
+    pairs = defaultdict(list)
+    for result in results.values():
+        p1_id, p2_id = str(result["p1"]), str(result["p2"])
+        scores = [result["s1"], result["s2"]] if p1_id <= p2_id else [result["s2"], result["s1"]]
+        pairs[pair_key(p1_id, p2_id)].append([result["stage"], *scores])
+    return pairs
+
+def season_finalists(results):
+    """(champion, runner_up) from the final's result, or (None, None) before it was played."""
+    final = next((r for r in results.values() if r["stage"] == "final"), None)
+    if not final:
+        return None, None
+    return (final["p1"], final["p2"]) if final["s1"] > final["s2"] else (final["p2"], final["p1"])
+
+def season_summary(season, record):
+    players, results = season["players"], season["results"]
+    champion, runner_up = season_finalists(results)
+    return {"at": record["at"], "version": record["version"],
+            "completed": season["tournament_state"].get("stage") == "completed",
+            "champion": archived_player(champion, players), "runner_up": archived_player(runner_up, players),
+            "players": len(players), "results": len(results), "bytes": len(record["data"])}
+
+async def archive_season():
+    """
+    Packs the live season into the archive and indexes it in one multi-path update. Archiving
+    again after more results rewrites the same season. Returns (season_id, summary), or None
+    if no result was recorded or nothing changed since the last archive.
+    """
+    ledger = await load_match_ledger()
+    if not ledger["results"]:
+        return None
+    tournament_state = await load_state("tournament_state")
+    archived = tournament_state.get("archived") or {}
+    if archived.get("events") == ledger["events"]:
+        return None
+    season_id = archived.get("id") or new_push_key()
+    season = {key: await load_state(key) for key in ARCHIVE_KEYS}
+    season["results"] = ledger["results"]
+    season["tournament_state"].pop("archived", None)
+    record = {**pack_archive(season), "at": int(time.time())}
+    summary = season_summary(season, record)
+    pairs = season_pairs(season["results"])
+    updates = {f"archive/{season_id}": record, f"archive_index/seasons/{season_id}": summary,
+               "tournament_state/archived": {"id": season_id, "events": ledger["events"]}}
+    previous = None
+    if archived:
+        # Corrections can re-route knockout pairings; drop index entries for pairs no longer played
+        previous = unpack_archive(await load_cold(f"archive/{season_id}"))
+        for pair in season_pairs(previous["results"]):
+            if pair not in pairs:
+                updates[f"archive_index/pairs/{pair}/{season_id}"] = None
+    for pair, games in pairs.items():
+        updates[f"archive_index/pairs/{pair}/{season_id}"] = games
+    updates.update(await career_updates(season, previous))
+    await update_state(updates)
+    tournament_log.info("Archived season %s: %d results, %d bytes compressed from %d",
+                        season_id, summary["results"], summary["bytes"], record["raw_bytes"])
+    return season_id, summary
+
+async def load_archived_season(season_id):
+    """The full archived season (players, groups, fixtures, tournament_state, rules_list, results)."""
+    record = await load_cold(f"archive/{season_id}")
+    return unpack_archive(record) if record else None
+
+async def archived_head_to_head(p1_id, p2_id):
+    """{season_id: [[stage, p1_goals, p2_goals], ...]} from the pair index, oriented to p1."""
+    seasons = await load_cold(f"archive_index/pairs/{pair_key(p1_id, p2_id)}")
+    flip = str(p1_id) > str(p2_id)
+    return {season_id: [[stage, high, low] if flip else [stage, low, high] for stage, low, high in games]
+            for season_id, games in seasons.items()}
+
+async def archive_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin: /archive — stores the current season in the archive without resetting anything."""
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("❌ Only the admin can archive the tournament.")
+        return
+    archived = await archive_season()
+    if not archived:
+        await update.message.reply_text("ℹ️ Nothing new to archive.")
+        return
+    season_id, summary = archived
+    await update.message.reply_text(
+        f"🗄️ Season {season_id} archived: {summary['results']} results, {summary['bytes']} bytes."
+    )
+
+async def champions_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/champions — winners of past seasons, newest first, from the archive index."""
+    seasons = await load_cold("archive_index/seasons")
+    finished = [(season_id, summary) for season_id, summary in seasons.items() if summary.get("champion")]
+    if not finished:
+        await update.message.reply_text("🏆 No archived champions yet.")
+        return
+    lines = ["🏆 Past champions:"]
+    for season_id, summary in sorted(finished, key=lambda item: item[1]["at"], reverse=True):
+        champion = summary["champion"]
+        day = time.strftime("%Y-%m-%d", time.gmtime(summary["at"]))
+        name = f"{champion.get('team') or 'Unknown'}" + (f" (@{champion['username']})" if champion.get("username") else "")
+        lines.append(f"{day}: {name}")
+    await update.message.reply_text("\n".join(lines))
+
+# === CAREER STATS ===
+# Totals across archived seasons, kept in archive_index beside the season index and updated once
+# per archive write; a re-archived season first takes back what it added last time. Commands
+# read one record each instead of scanning archived fixtures:
+#   users/<user_id>          {username, team, seasons, titles, finals, played, wins, draws, losses, gf, ga}
+#   h2h/<low_id>:<high_id>   {played, low_wins, high_wins, draws, low_goals, high_goals}
+#   usernames/<username>     user_id (lowercased username), for resolving @mentions
+CAREER_FIELDS = ("seasons", "titles", "finals", "played", "wins", "draws", "losses", "gf", "ga")
+H2H_FIELDS = ("played", "low_wins", "high_wins", "draws", "low_goals", "high_goals")
+USERNAME_PATTERN = re.compile(r"^@?([A-Za-z0-9_]{1,32})$")
+
+def season_contribution(season):
+    """({user_id: career counts}, {pair_key: h2h counts}) that one season adds to the totals."""
+    careers = defaultdict(lambda: dict.fromkeys(CAREER_FIELDS, 0))
+    h2h = defaultdict(lambda: dict.fromkeys(H2H_FIELDS, 0))
+    for p_id in season["players"]:
+        careers[str(p_id)]["seasons"] += 1
+    for result in season["results"].values():
+        p1_id, p2_id, s1, s2 = str(result["p1"]), str(result["p2"]), result["s1"], result["s2"]
+        for player_id, scored, conceded in ((p1_id, s1, s2), (p2_id, s2, s1)):
+            career = careers[player_id]
+            career["played"] += 1
+            career["gf"] += scored
+            career["ga"] += conceded
+            career["wins" if scored > conceded else "losses" if scored < conceded else "draws"] += 1
+        low_goals, high_goals = (s1, s2) if p1_id <= p2_id else (s2, s1)
+        record = h2h[pair_key(p1_id, p2_id)]
+        record["played"] += 1
+        record["low_goals"] += low_goals
+        record["high_goals"] += high_goals
+        record["low_wins" if low_goals > high_goals else "high_wins" if low_goals < high_goals else "draws"] += 1
+    champion, runner_up = season_finalists(season["results"])
+    for finalist in (champion, runner_up):
+        if finalist:
+            careers[str(finalist)]["finals"] += 1
+    if champion:
+        careers[str(champion)]["titles"] += 1
+    return careers, h2h
+
+async def career_updates(season, previous=None):
+    """Multi-path updates adding `season` to the aggregates (and removing `previous`, the same
+    season as archived before). Only the touched users and pairs are read, in parallel."""
+    careers, h2h = season_contribution(season)
+    old_careers, old_h2h = season_contribution(previous) if previous else ({}, {})
+    paths = [(f"archive_index/users/{user_id}", careers, old_careers, CAREER_FIELDS, user_id)
+             for user_id in set(careers) | set(old_careers)]
+    paths += [(f"archive_index/h2h/{pair}", h2h, old_h2h, H2H_FIELDS, pair) for pair in set(h2h) | set(old_h2h)]
+    stored = await asyncio.gather(*(load_cold(path) for path, *_ in paths))
+    updates = {}
+    for (path, added, removed, fields, key), current in zip(paths, stored):
+        totals = {field: current.get(field, 0) + added.get(key, {}).get(field, 0) - removed.get(key, {}).get(field, 0)
+                  for field in fields}
+        updates[path] = {**current, **totals} if any(totals.values()) else None
+    for user_id, player_info in season["players"].items():
+        path = f"archive_index/users/{user_id}"
+        if updates.get(path) is not None:
+            updates[path].update(username=player_info.get("username"), team=player_info.get("team"))
+        match = USERNAME_PATTERN.match(player_info.get("username") or "")
+        if match and player_info.get("username") != "NoUsername":
+            updates[f"archive_index/usernames/{match.group(1).lower()}"] = str(user_id)
+    return updates
+
+async def resolve_archived_user(mention):
+    """User ID for an @username seen in an archived season, or None."""
+    match = USERNAME_PATTERN.match(mention or "")
+    if not match:
+        return None
+    user_id = await load_cold(f"archive_index/usernames/{match.group(1).lower()}")
+    return user_id or None
+
+def career_name(career, user_id):
+    name = career.get("team") or f"Player {user_id}"
+    return f"{name} (@{career['username']})" if career.get("username") else name
+
+def win_rate(record, wins="wins"):
+    return record.get(wins, 0) / record["played"] if record.get("played") else 0.0
+
+async def leaderboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/leaderboard — the top players across archived seasons by titles, finals and win rate."""
+    careers = await load_cold("archive_index/users")
+    if not careers:
+        await update.message.reply_text("📊 No archived seasons yet.")
+        return
+    ranked = sorted(careers.items(), key=lambda item: (-item[1].get("titles", 0), -item[1].get("finals", 0),
+                                                       -win_rate(item[1]), -item[1].get("wins", 0), item[0]))
+    lines = ["📊 All-time leaderboard:"]
+    for position, (user_id, career) in enumerate(ranked[:10], 1):
+        lines.append(f"{position}. {career_name(career, user_id)} — 🏆 {career.get('titles', 0)}, "
+                     f"W{career.get('wins', 0)} D{career.get('draws', 0)} L{career.get('losses', 0)} "
+                     f"({win_rate(career):.0%})")
+    await update.message.reply_text("\n".join(lines))
+
+async def h2h_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/h2h @a @b — head-to-head record of two players across archived seasons."""
+    if len(context.args) != 2:
+        await update.message.reply_text("Usage: /h2h @player1 @player2")
+        return
+    user_ids = [await resolve_archived_user(mention) for mention in context.args]
+    if None in user_ids:
+        missing = [mention for mention, user_id in zip(context.args, user_ids) if user_id is None]
+        await update.message.reply_text(f"❌ No archived seasons for {', '.join(missing)}.")
+        return
+    a_id, b_id = user_ids
+    record = await load_cold(f"archive_index/h2h/{pair_key(a_id, b_id)}")
+    if not record:
+        await update.message.reply_text(f"🤝 {context.args[0]} and {context.args[1]} have never met.")
+        return
+    a_low = str(a_id) <= str(b_id)
+    a_wins, b_wins = (record["low_wins"], record["high_wins"]) if a_low else (record["high_wins"], record["low_wins"])
+    a_goals, b_goals = (record["low_goals"], record["high_goals"]) if a_low else (record["high_goals"], record["low_goals"])
+    await update.message.reply_text(
+        f"🤝 {context.args[0]} vs {context.args[1]}: {record['played']} played\n"
+        f"{context.args[0]} {a_wins} wins, {record['draws']} draws, {context.args[1]} {b_wins} wins\n"
+        f"Goals: {a_goals}-{b_goals}"
+    )
+
+async def career_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/career [@user] — titles, record and goals across archived seasons (yours by default)."""
+    if context.args:
+        user_id = await resolve_archived_user(context.args[0])
+    else:
+        user_id = str(update.effective_user.id)
+    career = await load_cold(f"archive_index/users/{user_id}") if user_id else {}
+    if not career:
+        await update.message.reply_text("📇 No archived seasons for that player yet.")
+        return
+    rating = rating_of(await load_ratings(), user_id)
+    await update.message.reply_text(
+        f"📇 {career_name(career, user_id)}\n"
+        f"Seasons: {career.get('seasons', 0)} | Titles: {career.get('titles', 0)} | Finals: {career.get('finals', 0)}\n"
+        f"Record: W{career.get('wins', 0)} D{career.get('draws', 0)} L{career.get('losses', 0)} "
+        f"({win_rate(career):.0%} of {career.get('played', 0)})\n"
+        f"Goals: {career.get('gf', 0)} scored, {career.get('ga', 0)} conceded\n"
+        f"Rating: {round(rating)}"
+    )
+
 async def reset_tournament(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # ADMIN_ID="7366894756"
     if update.effective_user.id != ADMIN_ID:
         await update.message.reply_text("❌ Only the admin can reset the tournament.")
         return
 
-    save_state("players", {})
-    save_state("groups", {})
-    save_state("fixtures", {})
-    save_state("lock", {})
-    save_state("tournament_state", {"stage": "registration"})
-    save_state("rules_list", [])
-
-    await update.message.reply_text("✅ Tournament data has been reset. Registrations are now open.")
+    # Keep the season before wiping it; a failed archive write aborts the reset
+    archived = await archive_season()
+    season_id = archived[0] if archived else ((await load_state("tournament_state")).get("archived") or {}).get("id")
+
+    await save_state("players", {})
+    await save_state("player_index", {})
+    await save_state("groups", {})
+    await save_state("fixtures", {})
+    await save_state("lock", {})
+    await save_state("tournament_state", {"stage": "registration"})
+    await save_state("rules_list", [])
+    await save_state("match_events", {})
+    await save_state("match_snapshot", {})
+    await save_state("match_index", {})
+    await save_state("match_views", {})
+    await save_state("schedule", {})
+    cancel_reminders()
+    reset_match_ledger() # `ratings` is kept: it spans tournaments
+
+    note = f" Season {season_id} was archived." if season_id else ""
+    await update.message.reply_text(f"✅ Tournament data has been reset.{note} Registrations are now open.")
     await context.bot.send_message(GROUP_ID, "📢 The tournament has been reset by the admin. Registrations are now open! Use /register to join.")
 
 
 # --- PTB Application Setup and Run Logic ---
 
+async def on_handler_error(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Application-wide error handler. A state error aborts the handler where it happened; writes it
+    already made stay in place, since several handlers save in more than one step."""
+    error = context.error
+    message = getattr(update, "effective_message", None)
+    if isinstance(error, StateError):
+        handler_log.error("State backend error while handling update: %s", error)
+        if message:
+            await message.reply_text("⚠️ The tournament database is temporarily unavailable, so this command may have only partly gone through. "
+                                     "Please check the result and try again in a minute.")
+        return
+    handler_log.error("Unhandled error while handling update: %s", error, exc_info=error)
+
 # We define the application instance globally or pass it.
 # The previous partial `main` function was causing a conflict.
 # ... (all your existing code, imports, functions, handlers etc. above this point) ...
@@ -2161,148 +4951,175 @@ def setup_bot_handlers_sync(app_instance: Application) -> None:
     app_instance.add_handler(conv_handler)
 
     app_instance.add_handler(CommandHandler("start", start))
-    app_instance.add_handler(CommandHandler("rules", rules))
-    app_instance.add_handler(CommandHandler("players", players_list))
+    app_instance.add_handler(CommandHandler("rules", throttled_read(rules)))
+    app_instance.add_handler(CommandHandler("players", throttled_read(players_list)))
     app_instance.add_handler(CommandHandler("addrule", addrule))
     app_instance.add_handler(CommandHandler("start_tournament", start_tournament))
-    app_instance.add_handler(CommandHandler("fixtures", fixtures))
-    app_instance.add_handler(CommandHandler("standings", group_standings))
-    application.add_handler(CommandHandler("advance_group_round", advance_group_round))
-    application.add_handler(CommandHandler("showknockout", show_knockout_status))
-    application.add_handler(CommandHandler("mygroup", mygroup))
-    application.add_handler(CommandHandler("advance_to_knockout", advance_to_knockout))
+    app_instance.add_handler(CommandHandler("fixtures", throttled_read(fixtures)))
+    app_instance.add_handler(CommandHandler("standings", throttled_read(group_standings)))
+    app_instance.add_handler(CommandHandler("advance_group_round", advance_group_round))
+    app_instance.add_handler(CommandHandler("showknockout", throttled_read(show_knockout_status)))
+    app_instance.add_handler(CommandHandler("mygroup", throttled_read(mygroup)))
+    app_instance.add_handler(CommandHandler("odds", throttled_read(odds_command)))
+    app_instance.add_handler(CommandHandler("rating", throttled_read(rating_command)))
+    app_instance.add_handler(CommandHandler("champions", throttled_read(champions_command)))
+    app_instance.add_handler(CommandHandler("leaderboard", throttled_read(leaderboard_command)))
+    app_instance.add_handler(CommandHandler("h2h", throttled_read(h2h_command)))
+    app_instance.add_handler(CommandHandler("career", throttled_read(career_command)))
+    app_instance.add_handler(CommandHandler("available", available_command))
+    app_instance.add_handler(CommandHandler("kickoffs", throttled_read(kickoffs_command)))
+    app_instance.add_handler(CommandHandler("advance_to_knockout", advance_to_knockout))
     app_instance.add_handler(CommandHandler("submit_tiebreaker_result", submit_tiebreaker_result))
-    # Dynamically add handlers for /matchX commands for admin scores
-    for i in range(1, 101): # Assuming up to 100 matches
-        app_instance.add_handler(CommandHandler(f"match{i}", handle_score))
+    # One regex handler for every /matchX admin score command (instead of 100 CommandHandlers
+    # that each had to be built at startup and checked against every update)
+    app_instance.add_handler(MessageHandler(filters.Regex(r"^/match\d+(@\w+)?(\s|$)"), handle_score))
 
     app_instance.add_handler(CommandHandler("addscore", addscore))
     app_instance.add_handler(CommandHandler("reset_tournament", reset_tournament))
+    app_instance.add_handler(CommandHandler("archive", archive_command))
+    app_instance.add_handler(CommandHandler("setpot", set_pot_command))
+    app_instance.add_handler(CommandHandler("setclan", set_clan_command))
+    app_instance.add_handler(CommandHandler("replay_draw", throttled_read(replay_draw)))
+    app_instance.add_handler(CommandHandler("replay_log", replay_log))
+    app_instance.add_handler(CommandHandler("correct", correct_score))
+    app_instance.add_handler(CommandHandler("scores", bulk_scores))
+    app_instance.add_handler(CommandHandler("autoadvance", auto_advance_command))
+    app_instance.add_handler(CommandHandler("pending", pending_dashboard))
+    app_instance.add_handler(CommandHandler("fairplay", fair_play_command))
 
     app_instance.add_handler(CallbackQueryHandler(handle_team_selection, pattern=r"^team_select:"))
-    print("--- Handlers added ---") # Moved print here for clearer flow
+    app_instance.add_handler(CommandHandler("metrics", metrics_command))
+    app_instance.add_handler(CommandHandler("profile", profile_command))
+    app_instance.add_error_handler(on_handler_error)
 
-# This is the main asynchronous function that will be executed by asyncio.run
-async def run_polling_mode_bot():
-    global application # Access the global application instance
+    # Time every handler registered above (must stay last)
+    instrument_application_handlers(app_instance)
+    log.info("Handlers added")
 
-    # Set bot commands (this is an async operation and must be awaited)
-    print("--- Setting bot commands ---") # Debug print
-    await set_bot_commands(application)
-    print("--- Bot commands set ---") # Debug print
-    
-    print("--- Starting bot in polling mode ---")
-    # This call will block and run the bot's polling loop indefinitely
-    await application.run_polling(drop_pending_updates=True, allowed_updates=Update.ALL_TYPES)
-    print("--- Bot polling finished (should not be reached during normal operation) ---") # Debug print
+# Startup phase durations, logged as one breakdown line once the bot is ready to poll
+_boot_phases = []
+_boot_mark = _BOOT_STARTED
+
+def mark_boot_phase(name):
+    global _boot_mark
+    now = time.perf_counter()
+    _boot_phases.append((name, now - _boot_mark))
+    _boot_mark = now
+
+def log_boot_breakdown():
+    total = sum(seconds for _, seconds in _boot_phases)
+    breakdown = " ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in _boot_phases)
+    log.info("Startup complete in %.0fms: %s", total * 1000, breakdown)
 
 # Main entry point for the script
-# Assuming 'players' is intended to be a global variable holding your player data.
-# If it's not defined globally, you might need to initialize it here:
-players = {} # Or wherever you load your initial global state (e.g., players = load_state("players"))
+
+async def inject_dummy_players():
+    """TEST_MODE only: adds dummy players for a tournament simulation."""
+    log.warning("TEST_MODE is ON. Injecting dummy players for tournament simulation.")
+    players = await load_state("players") # Served from the warmed cache
+
+    # Optional: Clear existing players if you want a fresh start with only dummy data
+    # DANGER: If you uncomment the line below and run it with your LIVE bot,
+    # it WILL WIPE OUT any actual registered players' data!
+    # players = {} # Uncomment with extreme caution for testing
+
+    # --- Generate 32 Dummy Players Using a Loop ---
+    num_dummy_players = 31 # Set the desired number of dummy players
+    for i in range(1, num_dummy_players + 1):
+        player_id = 1000 + i # Unique dummy user ID (e.g., 1001, 1002, ...)
+        player_name = f"Test Player {chr(64 + i)}" if i <= 26 else f"Test Player {i}" # A, B, C... or just numbers
+        username = f"tester_{player_id}"
+        team_name = f"Team {chr(64 + i)} FC" if i <= 26 else f"Team {i} FC" # Unique team names
+        pes_name = f"PES_User_{player_id}"
+
+        players[str(player_id)] = {
+            "user_id": player_id,
+            "name": player_name,
+            "username": username,
+            "team": team_name,
+            "pes": pes_name,
+            "group": None, # Will be filled by create_groups
+            "stats": {"wins": 0, "draws": 0, "losses": 0, "gf": 0, "ga": 0, "points": 0, "gd": 0}
+        }
+    log.info("%s dummy players injected.", num_dummy_players)
+
+    await save_state("players", players) # This line saves the dummy players to your state file
+    await save_state("player_index", {p_id: player_index_entry(p_info) for p_id, p_info in players.items()})
+    log.info("Dummy players saved to state.")
+
+async def post_init_setup(app_instance: Application) -> None:
+    """Runs on PTB's event loop after Application.initialize(), before polling starts."""
+    mark_boot_phase("bot_init")
+    await start_firebase()
+    mark_boot_phase("firebase_auth")
+    # One parallel read of the live keys instead of a read per key on the first commands after a restart
+    await warm_state_cache()
+    mark_boot_phase("state_warmup")
+    await arm_stored_reminders(app_instance.bot)
+    if os.environ.get("TEST_MODE") == "true":
+        await inject_dummy_players()
+    await set_bot_commands(app_instance)
+    mark_boot_phase("set_commands")
+    app_instance.bot_data["metrics_server"] = await start_metrics_server()
+    log_boot_breakdown()
+
+async def post_shutdown_cleanup(app_instance: Application) -> None:
+    metrics_server = app_instance.bot_data.get("metrics_server")
+    if metrics_server:
+        metrics_server.close()
+    if firebase_client:
+        await firebase_client.close()
 
 if __name__ == '__main__':
-    print("--- Script execution started ---")
+    configure_logging()
+    mark_boot_phase("imports")
+    log.info("Script execution started")
 
     try:
-        # Initialize Firebase once (synchronous)
-        print("--- Initializing Firebase ---")
+        # Build the Firebase client once (synchronous, no network I/O yet)
+        log.info("Initializing Firebase")
         init_firebase()
-        if firebase_db_ref is None:
-            print("FATAL: Firebase could not be initialized or required ENV vars are missing. Exiting.")
+        if firebase_client is None:
+            log.critical("Firebase could not be initialized or required ENV vars are missing. Exiting.")
             import sys
             sys.exit(1)
-        print("--- Firebase initialization status: OK ---")
+        mark_boot_phase("firebase_init")
+        log.info("Firebase initialization status: OK")
 
         # Basic check for BOT_TOKEN as it's fundamental
         if not BOT_TOKEN:
-            print("FATAL: BOT_TOKEN environment variable not set. Cannot run bot. Exiting.")
+            log.critical("BOT_TOKEN environment variable not set. Cannot run bot. Exiting.")
             import sys
             sys.exit(1)
-        print("--- BOT_TOKEN is set ---")
-
-        print("--- Building Telegram Application instance ---")
-
-        # Define an async function to be run after Application init, but before polling starts
-        async def post_init_setup(app_instance: Application) -> None:
-            print("--- Post-init setup: Setting bot commands ---")
-            # Call your existing async function here, passing the application instance
-            await set_bot_commands(app_instance)
-            print("--- Post-init setup: Bot commands set ---")
-
-
-        # Build the Application instance, using post_init to set commands
-        application = Application.builder().token(BOT_TOKEN).post_init(post_init_setup).build()
-        print("--- Telegram Application instance built ---")
-
-        # --- IMPORTANT: Ensure 'players' data is loaded/accessible here ---
-        # If 'players' is a global variable, and you load it from a file,
-        # you might need to explicitly load it here if it's not already.
-        # Example (uncomment if load_state sets a global 'players' variable):
-        
-        players = load_state("players") # Make sure your load_state function is available and returns the players dict
-
-
-        # ================================================================
-        # --- PLACE THE DUMMY PLAYER GENERATION CODE BLOCK HERE ---
-        # ================================================================
-        # This code will now be correctly indented inside the 'try' block
-        # and after your application is built.
-
-        if os.environ.get("TEST_MODE") == "true":
-            print("DEBUG: TEST_MODE is ON. Injecting dummy players for tournament simulation.")
-
-            # Optional: Clear existing players if you want a fresh start with only dummy data
-            # DANGER: If you uncomment the line below and run it with your LIVE bot,
-            # it WILL WIPE OUT any actual registered players' data!
-            # players = {} # Uncomment with extreme caution for testing
-
-            # --- Generate 32 Dummy Players Using a Loop ---
-            num_dummy_players = 31 # Set the desired number of dummy players
-            for i in range(1, num_dummy_players + 1):
-                player_id = 1000 + i # Unique dummy user ID (e.g., 1001, 1002, ...)
-                player_name = f"Test Player {chr(64 + i)}" if i <= 26 else f"Test Player {i}" # A, B, C... or just numbers
-                username = f"tester_{player_id}"
-                team_name = f"Team {chr(64 + i)} FC" if i <= 26 else f"Team {i} FC" # Unique team names
-                pes_name = f"PES_User_{player_id}"
-
-                players[str(player_id)] = {
-                    "user_id": player_id,
-                    "name": player_name,
-                    "username": username,
-                    "team": team_name,
-                    "pes": pes_name,
-                    "group": None, # Will be filled by create_groups
-                    "stats": {"wins": 0, "draws": 0, "losses": 0, "gf": 0, "ga": 0, "points": 0, "gd": 0}
-                }
-            print(f"DEBUG: {num_dummy_players} dummy players injected.")
-
-            save_state("players", players) # This line saves the dummy players to your state file
-            print("DEBUG: Dummy players saved to state.")
-
-        # ================================================================
-        # --- END OF DUMMY PLAYER GENERATION CODE ---
-        # ================================================================
+        log.info("BOT_TOKEN is set")
+
+        log.info("Building Telegram Application instance")
+        # Firebase auth, state warm-up and command registration run in post_init, on PTB's loop
+        application = (
+            Application.builder()
+            .token(BOT_TOKEN)
+            .post_init(post_init_setup)
+            .post_shutdown(post_shutdown_cleanup)
+            .build()
+        )
+        log.info("Telegram Application instance built")
 
         # Set up all synchronous handlers and other configuration
-        print("--- Setting up bot handlers ---")
+        log.info("Setting up bot handlers")
         setup_bot_handlers_sync(application)
-        print("--- Bot handlers setup complete ---")
+        mark_boot_phase("handlers")
+        log.info("Bot handlers setup complete")
 
         # Now, run the main polling part. PTB's run_polling manages its own event loop.
-        print("--- Starting bot in polling mode ---")
+        log.info("Starting bot in polling mode")
         application.run_polling(drop_pending_updates=True, allowed_updates=Update.ALL_TYPES)
-        print("--- Bot polling stopped (this should not print unless bot gracefully exits) ---")
+        log.info("Bot polling stopped (this should not print unless bot gracefully exits)")
 
 
     except Exception as e:
-        print(f"\n!!! CRITICAL UNHANDLED EXCEPTION DURING BOT STARTUP !!!")
-        print(f"Error type: {type(e).__name__}")
-        print(f"Error message: {e}")
-        import traceback
-        traceback.print_exc()
-        print("--- Script terminated due to unhandled exception ---")
+        log.critical("Unhandled exception during bot startup (%s): %s", type(e).__name__, e, exc_info=True)
+        log.critical("Script terminated due to unhandled exception")
         import sys
         sys.exit(1)
 
-    print("--- End of script execution path ---")
+    log.info("End of script execution path")